@@ -15,6 +15,7 @@ from typing import List
 import time
 from datetime import datetime as dt
 from encrypt_decrypt.perform_encryption_decryption import *
+from node_logging.console_feed import *
 
 
 
@@ -29,15 +30,37 @@ NODE_RECEIVER = 1
 NODE_DEINITIALIZED = 0
 NODE_INITIALIZED = 1
 
-# To enable debug prints in the file
+# To enable debug prints in the file, and the per-frame log records of the nodes
 DEBUG_PRINT = False
 
+# File the nodes log to, console if None
+NODE_LOG_FILE = None
+
+# Record the spans of each frame in the nodes (encrypt, send, kernel RX, recv wakeup,
+# MAC verify, decrypt), written to TRACE_FILE as a Chrome trace when the simulation stops
+TRACING_MODE = False
+TRACE_FILE = "CAN_Trace.json"
+TRACE_SENDER_FILE = "CAN_Trace_Sender.npz"
+TRACE_RECEIVER_FILE = "CAN_Trace_Receiver.npz"
+
+# Log events of the nodes
+LOG_EVENT_DEADLINE_MISSED = registerlogevent("Deadline missed counts : {arg0}")
+LOG_EVENT_SENDER_DATA = registerlogevent("Sender: Data before Encryption:  {payload}")
+LOG_EVENT_SENT_COUNT = registerlogevent("action_sender: sentmessagescount = {arg0}")
+LOG_EVENT_PERIOD = registerlogevent("Period: {arg0} ns, deadline : {arg1}")
+LOG_EVENT_SLEEP_TIME = registerlogevent("Sleep time: {arg0} ns")
+LOG_EVENT_RECEIVER_DATA = registerlogevent("Receiver: Data after Decryption:   {payload}")
+
 # Delay
 DELAY_IN_S = 20/1000
 
 #Loop Timeout in seconds
 LOOPTIMEOUT = 2
 
+# Cores the sender and receiver processes are pinned to
+SENDER_CORE = 1
+RECEIVER_CORE = 2
+
 ################################################################################
 # Globals
 ################################################################################
@@ -66,7 +89,7 @@ class Node:
         self.nodebus = bus
         self.nodestatus = NODE_DEINITIALIZED
 
-    def createprocess(self, console_queue, 
+    def createprocess(self, console_feed, 
                       simstate,
                       deadlinemc,
                       sentmsgc,
@@ -82,7 +105,7 @@ class Node:
         try:
             if self.nodetype == NODE_SENDER:
                 self.process = multiprocessing.Process(target=self.action_sender, 
-                                                       args=(console_queue,
+                                                       args=(console_feed,
                                                        simstate, 
                                                        deadlinemc, 
                                                        sentmsgc,
@@ -95,7 +118,7 @@ class Node:
                                                        ))
             elif self.nodetype == NODE_RECEIVER:
                 self.process =  multiprocessing.Process(target=self.action_receiver, 
-                                                        args=(console_queue,
+                                                        args=(console_feed,
                                                               simstate,
                                                               crypt_samples, 
                                                               crypt_cpuper,
@@ -114,7 +137,7 @@ class Node:
 
 
 
-    def action_sender(self, console_queue, 
+    def action_sender(self, console_feed, 
                       simulationstate, 
                       deadlinemisscounts, 
                       sentmessagescount,
@@ -135,7 +158,12 @@ class Node:
         # Pin to core 1
         pid_sender = os.getpid()
         p = psutil.Process(pid_sender)
-        p.cpu_affinity([1])
+        p.cpu_affinity([SENDER_CORE])
+        # Log records are formatted and written by a thread of the node, not on the hot path
+        startnodelogging("Sender " + self.nodename)
+        g_tracer.start("Sender " + self.nodename, TRACING_MODE)
+        # Measure the cost of the timer and the dispatch on this core, for the bias of the timings
+        calibratesendertimer(encscheme_state)
 
         #Open the file for saving the CAN frames in case of Replay Attack Simulation
         if(2 == replay_sim_state.value):
@@ -178,9 +206,14 @@ class Node:
                             if ((now > deadline) and
                                 (now - deadline) > 2000000):
                                 deadlinemisscounts.value += 1
-                                if (True == DEBUG_PRINT):
-                                    print("Deadline missed counts : ", deadlinemisscounts.value)
+                                g_logger.debug(LOG_EVENT_DEADLINE_MISSED, deadlinemisscounts.value)
 
+                        # Frame ID of the spans, the receiver counts the frames the same way
+                        g_tracer.beginframe(sentmessagescount.value + 1)
+                        # Freshness counter of the frame, to match it in the receiver for its end-to-end latency
+                        sentcounter = None
+                        if(True == encscheme_state.get()):
+                            sentcounter = getsendercounter(can_msg.arbritration_id, can_msg.isextended)
                         # Perform Encryption
                         encrypteddata, encryptiontime = perform_encryption(can_msg.data, 
                                                                            encrypt_samples, 
@@ -193,9 +226,9 @@ class Node:
                         # With encryption scheme, only 6 data bytes are send, 2 bytes will be 
                         # truncated MAC
                         if(True == encscheme_state.get()):
-                            print("Sender: Data before Encryption:  " + str(can_msg.data[0:6]))
+                            g_logger.debug(LOG_EVENT_SENDER_DATA, payload=can_msg.data[0:6])
                         else:
-                            print("Sender: Data before Encryption:  " + str(can_msg.data))
+                            g_logger.debug(LOG_EVENT_SENDER_DATA, payload=can_msg.data)
 
                         msg = can.Message(
                             arbitration_id=can_msg.arbritration_id,
@@ -204,11 +237,17 @@ class Node:
                             is_rx = False)
 
                         msg.timestamp = time.time()
+                        # Transmit time of the frame, for its end-to-end latency
+                        recordtransmit(msg.arbitration_id, sentcounter, msg.data)
+                        sendstarttime = time.perf_counter_ns()
                         self.nodebus.send(msg)
+                        g_tracer.span(TRACE_SPAN_SEND, sendstarttime)
                         # Increment the count of sent messages
                         sentmessagescount.value +=1
-                        console_queue.put(f"Sent: {msg}    t_encrypt: {encryptiontime:.3f} us")
-                        print("action_sender: sentmessagescount = ", sentmessagescount.value)
+                        # Record of the frame, formatted by the UI
+                        console_feed.put(msg.timestamp, msg.arbitration_id, msg.is_extended_id, False,
+                                         msg.data, encryptiontime)
+                        g_logger.debug(LOG_EVENT_SENT_COUNT, sentmessagescount.value)
 
                         # If recording frames for replay attack is On
                         if(2 == replay_sim_state.value):
@@ -219,14 +258,14 @@ class Node:
                                 #Stop recording once the message count reaches REPLAY_MESSAGE_COUNT
                                 fp.close()
 
+                        # Precompute the keystreams of the next counters, while waiting for the next period
+                        precomputekeystreams(encscheme_state)
+
                         if(True == firstCall):
                             time.sleep(DELAY_IN_S)
                             firstCall = False
                         else:
-                            if (True == DEBUG_PRINT):
-                                print("Period: " + str((now - prev) * CONVERT_NS_TO_MS) + " ms")
-                                print("now : ", now)
-                                print("deadline : ", deadline)
+                            g_logger.debug(LOG_EVENT_PERIOD, now - prev, deadline)
 
                             # Next Execution Window
                             next_execution_ns += int(DELAY_IN_S * CONVERT_S_TO_NS)
@@ -240,8 +279,7 @@ class Node:
                                 time_to_sleep_ns = time_to_sleep_ns \
                                     if (time_to_sleep_ns < (DELAY_IN_S * CONVERT_S_TO_NS))\
                                     else (DELAY_IN_S * CONVERT_S_TO_NS)
-                                if (True == DEBUG_PRINT):
-                                    print("Sleep time: " ,  time_to_sleep_ns * CONVERT_NS_TO_MS)
+                                g_logger.debug(LOG_EVENT_SLEEP_TIME, int(time_to_sleep_ns))
                                 # Provide the calculated sleep time
                                 time.sleep(truncate_float(time_to_sleep_ns * CONVERT_NS_TO_S, 2))
                     
@@ -272,10 +310,12 @@ class Node:
                 traceback.print_exc()
 
 
+        stopnodelogging()
+        g_tracer.write(TRACE_SENDER_FILE)
         print("Sender Node: " + self.nodename +  " de-initialized")
         self.nodestatus = NODE_DEINITIALIZED
         
-    def action_receiver(self, console_queue, simulationstate, decrypt_samples, decrypt_cpuper,
+    def action_receiver(self, console_feed, simulationstate, decrypt_samples, decrypt_cpuper,
                         encscheme_state, benchmarkinprogress, ready_event, replay_sim_state
                         ):
         '''Function for actions to be performed by the Receiver'''
@@ -290,13 +330,26 @@ class Node:
         # Pin to core 2
         pid_receiver = os.getpid()
         p = psutil.Process(pid_receiver)
-        p.cpu_affinity([2])  
+        p.cpu_affinity([RECEIVER_CORE])  
+        # Log records are formatted and written by a thread of the node, not on the hot path
+        startnodelogging("Receiver " + self.nodename)
+        g_tracer.start("Receiver " + self.nodename, TRACING_MODE, True)
+        # Frame ID of the spans, frames are received in the order they are sent
+        receivedmessagescount = 0
+        # Measure the cost of the timer and the dispatch on this core, for the bias of the timings
+        calibratereceivertimer(encscheme_state)
+        # Frames are matched with their transmit, within their period for frames with the same payload
+        startbuslatencyreceiver(int(DELAY_IN_S * CONVERT_S_TO_NS))
 
         while True == simulationstate.value:
             try:
                 received = None
                 received = self.nodebus.recv(timeout=0.005)
                 if received is not None:
+                    # Time from the kernel RX timestamp until recv returned
+                    receivedmessagescount += 1
+                    g_tracer.beginframe(receivedmessagescount)
+                    g_tracer.receive(received.timestamp, time.perf_counter_ns())
                     # Setting the received flag to True
                     received.is_rx = True
                     # Perform Decrytpion and acceptance
@@ -307,9 +360,15 @@ class Node:
                                                                         received.arbitration_id,
                                                                         received.is_extended_id
                                                                         )
-                    acceptancestate = "  ✅" if DECRYPT_OK == accepted else "  ❌"
-                    print("Receiver: Data after Decryption:   " + str(list(decrypteddata)))
-                    console_queue.put(f"Received: {received}    t_decrypt: {decryptiontime:.3f} us {acceptancestate}")
+                    # End-to-end latency from the transmit time, to the kernel RX and the plaintext
+                    recordreceive(encscheme_state.get(), received.arbitration_id, received.data,
+                                  received.timestamp, accepted, time.time_ns())
+                    g_logger.debug(LOG_EVENT_RECEIVER_DATA, payload=decrypteddata)
+                    # Record of the frame, formatted by the UI
+                    console_feed.put(received.timestamp, received.arbitration_id, received.is_extended_id, True,
+                                     received.data, decryptiontime, DECRYPT_OK == accepted)
+                    # Move the verification window forward, while waiting for the next frame
+                    precomputereceiverwindow(encscheme_state)
                     if(False == receiver_ready):
                         #Indicate the reciever is ready
                         ready_event.set()
@@ -320,6 +379,8 @@ class Node:
                 import traceback
                 traceback.print_exc()
 
+        stopnodelogging()
+        g_tracer.write(TRACE_RECEIVER_FILE)
         print("Receiver Node: " + self.nodename + " de-initialized")
         self.nodestatus = NODE_DEINITIALIZED
 
@@ -351,7 +412,7 @@ class CanSim:
         objcanbus_1.nodes.append(Node("ECU1", NODE_SENDER, objcanbus_1.bus))
         objcanbus_1.nodes.append(Node("ECU2", NODE_RECEIVER, objcanbus_1.bus))
 
-    def start_simulation(self, ui_senderqueue, ui_receiverqueue, 
+    def start_simulation(self, ui_senderfeed, ui_receiverfeed, 
                          simulationstate, deadlinemisscounts, sentmessagescount,
                          encrypt_samples, encrypt_cpuper,
                          decrypt_samples, decrypt_cpuper,
@@ -366,7 +427,7 @@ class CanSim:
 
         #Start each Node
         for eachBus in self.CanbusList:
-            instantiatenodes(eachBus, ui_senderqueue, ui_receiverqueue, 
+            instantiatenodes(eachBus, ui_senderfeed, ui_receiverfeed, 
                              simulationstate, deadlinemisscounts, sentmessagescount,
                              encrypt_samples, encrypt_cpuper,
                              decrypt_samples, decrypt_cpuper,
@@ -398,13 +459,17 @@ class CanSim:
         if(self.CanbusList[0].nodes[1].process.is_alive()):
             self.CanbusList[0].nodes[1].process.terminate()
             print("stop_simulation: Receiver Node Stopped")
+
+        # Spans of both nodes in a single trace, with the frames linked across the nodes
+        if (True == TRACING_MODE):
+            mergetraces([TRACE_SENDER_FILE, TRACE_RECEIVER_FILE], TRACE_FILE)
         
 
 
 ################################################################################
 # Functions
 ################################################################################
-def instantiatenodes(objbus, squeue, rqueue, simstate, deadlinemc, 
+def instantiatenodes(objbus, sfeed, rfeed, simstate, deadlinemc, 
                      sentmsgc, encrypt_samples, encrypt_cpuper, 
                      decrypt_samples, decrypt_cpuper,
                      encscheme_state, benchmarkinprogress, ready_event, replay_sim_state):
@@ -412,12 +477,21 @@ def instantiatenodes(objbus, squeue, rqueue, simstate, deadlinemc,
     for eachNode in objbus.nodes:
         #Check the Node type
         if(NODE_SENDER == eachNode.nodetype):
-            eachNode.createprocess(squeue, simstate, deadlinemc, sentmsgc, encrypt_samples, encrypt_cpuper,
+            eachNode.createprocess(sfeed, simstate, deadlinemc, sentmsgc, encrypt_samples, encrypt_cpuper,
                                    encscheme_state, benchmarkinprogress, ready_event, replay_sim_state)
         else:
-            eachNode.createprocess(rqueue, simstate, None, None, decrypt_samples, decrypt_cpuper,
+            eachNode.createprocess(rfeed, simstate, None, None, decrypt_samples, decrypt_cpuper,
                                    encscheme_state, None, ready_event, None)
 
+def startnodelogging(name):
+    '''Start the logging of the calling node process, with the per-frame records if DEBUG_PRINT'''
+    g_logger.setlevel(LOG_LEVEL_DEBUG if (True == DEBUG_PRINT) else LOG_LEVEL)
+    g_logger.start(name, NODE_LOG_FILE)
+
+def stopnodelogging():
+    '''Write the remaining log records of the calling node process, and stop its logging'''
+    g_logger.stop()
+
 def setcanmessage(canid, data, isExtended):
     '''Function sets the parameters for CAN Message'''
     global can_msg
@@ -3,6 +3,9 @@ This module provides utility functions for AES encryption algorithm.
 
 It includes :
     * Functions for encrypting and decrypting data using AES (Advanced Encryption Cipher) cipher
+    * AES-CTR with persistent cipher contexts and bulk keystream generation
+    * AES-CMAC engine with precomputed subkeys and a cached cipher context
+    * AES-CMAC verification of a tag against a window of candidate messages
 
 """
 ################################################################################
@@ -12,9 +15,11 @@ import struct
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 import os
+import hmac
 from Crypto.Cipher import AES
 from Crypto.Hash import CMAC
 from icecream import ic
+from Crypto_Algorithms.cipher_registry import CipherInfo, registercipher
 
 ################################################################################
 # Macros
@@ -23,6 +28,17 @@ from icecream import ic
 AES_KEY = b"2023ht6554400000"
 AES_KEY_SIZE = 16
 AES_KEYSTREAM_SIZE = 8
+AES_BLOCK_SIZE = 16
+
+# Constant for CMAC subkey generation (NIST SP 800-38B)
+CMAC_RB = 0x87
+
+# Number of frames of keystream generated in a single update() call
+AES_BULK_FRAMES = 256
+
+# Use AES-CTR with persistent cipher contexts, instead of creating the
+# cipher for every frame
+AES_PERSISTENT_CTX_MODE = True
 
 ################################################################################
 # Globals
@@ -40,6 +56,9 @@ class AES_Cipher:
         # This key is the shared secret.
         self.nonce = os.urandom(AES_KEY_SIZE)
         
+    def reset(self):
+        '''New nonce, e.g. when the object is reused'''
+        self.nonce = os.urandom(AES_KEY_SIZE)
 
     def xor_bytes(self, a: bytes, b: bytes) -> bytes:
         """Performs a byte-by-byte XOR operation between two byte strings."""
@@ -94,4 +113,239 @@ class AES_Cipher:
         '''Verify CMAC tag on receiver side.'''
         expected = self.generate_cmac_aes128(message, taglen)
         return expected == mac
-        
\ No newline at end of file
+
+
+class CTRKeystream:
+    '''Represents one direction of a persistent AES-CTR keystream.
+       Keystream of many frames is generated in a single update() call'''
+    def __init__(self, key, nonce, bulkframes):
+        self.key = key
+        self.nonce = int.from_bytes(nonce, 'big')
+        self.bulkframes = bulkframes
+        self.bulksize = bulkframes * AES_KEYSTREAM_SIZE
+        # Encryptor kept alive, it continues the counter across update() calls
+        self.encryptor = Cipher(algorithms.AES(key), modes.CTR(nonce),
+                                backend=default_backend()).encryptor()
+        # ECB context, for fetching the keystream of any frame directly
+        self.ecb = Cipher(algorithms.AES(key), modes.ECB(),
+                          backend=default_backend()).encryptor()
+        # Preallocated buffers, update_into needs room for one more block
+        self.zeros = bytes(self.bulksize)
+        self.buffer = bytearray(self.bulksize + AES_BLOCK_SIZE - 1)
+        self.view = memoryview(self.buffer)
+        # First frame held in the buffer, nothing generated yet
+        self.baseframe = -bulkframes
+
+    def keystream_for_frame(self, frame):
+        '''Compute the keystream of the frame directly from its counter block'''
+        offset = frame * AES_KEYSTREAM_SIZE
+        counter = (self.nonce + (offset // AES_BLOCK_SIZE)) % (1 << (8 * AES_BLOCK_SIZE))
+        block = self.ecb.update(counter.to_bytes(AES_BLOCK_SIZE, 'big'))
+        offset %= AES_BLOCK_SIZE
+        return block[offset:offset + AES_KEYSTREAM_SIZE]
+
+    def seek(self, frame):
+        '''Restart the CTR stream at the counter block holding the frame'''
+        framesperblock = AES_BLOCK_SIZE // AES_KEYSTREAM_SIZE
+        self.baseframe = frame - (frame % framesperblock)
+        counter = (self.nonce + (self.baseframe // framesperblock)) % (1 << (8 * AES_BLOCK_SIZE))
+        self.encryptor = Cipher(algorithms.AES(self.key), modes.CTR(counter.to_bytes(AES_BLOCK_SIZE, 'big')),
+                                backend=default_backend()).encryptor()
+        self.encryptor.update_into(self.zeros, self.buffer)
+
+    def get(self, frame):
+        '''Get the keystream of the frame'''
+        index = frame - self.baseframe
+        if (index == self.bulkframes):
+            # Next frame after the buffer, generate the next bulk of keystream
+            self.encryptor.update_into(self.zeros, self.buffer)
+            self.baseframe += self.bulkframes
+            index = 0
+        elif (index > self.bulkframes):
+            # Frames were skipped, restart the stream at the frame
+            self.seek(frame)
+            index = frame - self.baseframe
+        elif (index < 0):
+            # Frame before the buffer, compute it without moving the stream
+            return self.keystream_for_frame(frame)
+        offset = index * AES_KEYSTREAM_SIZE
+        return self.view[offset:offset + AES_KEYSTREAM_SIZE]
+
+
+class AES_CTR_Stream(AES_Cipher):
+    '''Represents the AES Algorithm class, with persistent CTR contexts.
+       The keystream of frame k is the k-th 8 byte slice of the CTR stream'''
+    def __init__(self, key, bulkframes = AES_BULK_FRAMES):
+        super().__init__(key)
+        self.bulkframes = bulkframes
+        self.reset()
+
+    def reset(self):
+        '''New nonce and CTR contexts starting at frame 0, e.g. when the object is reused'''
+        super().reset()
+        # One context per direction
+        self.sender_stream = CTRKeystream(self.key, self.nonce, self.bulkframes)
+        self.recv_stream = CTRKeystream(self.key, self.nonce, self.bulkframes)
+        self.txframecounter = 0
+        self.rxframecounter = 0
+
+    def keystream_for_frame(self, frame):
+        '''Keystream of frame k, e.g. for the receiver to resynchronize'''
+        return self.recv_stream.keystream_for_frame(frame)
+
+    def xor_keystream(self, data, keystream):
+        '''XOR the data with the keystream'''
+        datalen = len(data)
+        result = int.from_bytes(bytes(data), 'big') ^ int.from_bytes(keystream[:datalen], 'big')
+        return result.to_bytes(datalen, 'big')
+
+    def aesencrypt(self, data):
+        ''' Performs encryption with the next sender frame of the CTR stream '''
+        ciphertext_payload = self.xor_keystream(data, self.sender_stream.get(self.txframecounter))
+        self.txframecounter += 1
+        return ciphertext_payload
+
+    def aesdecrypt(self, data):
+        ''' Performs decryption with the next receiver frame of the CTR stream '''
+        plaintext_payload = self.xor_keystream(data, self.recv_stream.get(self.rxframecounter))
+        self.rxframecounter += 1
+        return plaintext_payload
+
+    def aesdecrypt_frame(self, data, frame):
+        ''' Performs decryption with the keystream of frame k '''
+        return self.xor_keystream(data, self.recv_stream.get(frame))
+
+
+class AES_CMAC:
+    '''Represents the AES-128 CMAC engine.
+       Subkeys and the AES-ECB context are derived once per key'''
+    def __init__(self, key):
+        self.key = key
+        # AES key schedule is done once, the ECB context is reused for every block
+        self.ecb = Cipher(algorithms.AES(self.key), modes.ECB(),
+                          backend=default_backend()).encryptor()
+        # Subkeys K1, K2 from L = AES(K, 0^128)
+        l_value = int.from_bytes(self.ecb.update(bytes(AES_BLOCK_SIZE)), 'big')
+        self.k1 = cmac_double(l_value)
+        self.k2 = cmac_double(self.k1)
+
+    def lastblock(self, message):
+        '''Get the last block of the message, XORed with the subkey, as int.
+           Message must be at most one block'''
+        msglen = len(message)
+        if (AES_BLOCK_SIZE == msglen):
+            return int.from_bytes(message, 'big') ^ self.k1
+        # Incomplete block is padded with 10..0
+        padded = (((int.from_bytes(message, 'big') << 1) | 1) << (8 * (AES_BLOCK_SIZE - msglen) - 1))
+        return padded ^ self.k2
+
+    def macinput(self, message):
+        '''Get the input of the final block encryption, chaining the full blocks before it'''
+        message = bytes(message)
+        # Number of blocks before the last block, empty message is one padded block
+        nblocks = max(0, (len(message) - 1) // AES_BLOCK_SIZE)
+        chain = 0
+        for offset in range(0, nblocks * AES_BLOCK_SIZE, AES_BLOCK_SIZE):
+            block = int.from_bytes(message[offset:offset + AES_BLOCK_SIZE], 'big') ^ chain
+            chain = int.from_bytes(self.ecb.update(block.to_bytes(AES_BLOCK_SIZE, 'big')), 'big')
+        return (self.lastblock(message[nblocks * AES_BLOCK_SIZE:]) ^ chain).to_bytes(AES_BLOCK_SIZE, 'big')
+
+    def generate_cmac_aes128(self, message: bytes, tag_len: int = 4) -> bytes:
+        '''Generate AES-128 CMAC tag for the given message.'''
+        return self.ecb.update(self.macinput(message))[:tag_len]
+
+    def verify_cmac_aes128(self, message: bytes, taglen: bytes, mac) -> bool:
+        '''Verify CMAC tag on receiver side.'''
+        expected = self.generate_cmac_aes128(message, taglen)
+        return hmac.compare_digest(expected, bytes(mac))
+
+    def generate_many(self, messages, tag_len: int = 4):
+        '''Generate the CMAC tags for a list of messages.
+           Final blocks of all the messages are encrypted in one call'''
+        blocks = self.ecb.update(b"".join(self.macinput(message) for message in messages))
+        return [blocks[offset:offset + tag_len]
+                for offset in range(0, len(blocks), AES_BLOCK_SIZE)]
+
+    def verify_many(self, messages, taglen, macs):
+        '''Verify the CMAC tags for a list of messages, returns the result for each message'''
+        return [hmac.compare_digest(expected, bytes(mac))
+                for expected, mac in zip(self.generate_many(messages, taglen), macs)]
+
+    def precompute_window(self, prefixes):
+        '''Precompute the last blocks of the messages starting with each of the prefixes.
+           Prefixes must have the same length. The blocks of the window are kept as one int,
+           first prefix in the most significant block'''
+        prefixes = [bytes(prefix) for prefix in prefixes]
+        prefixlen = len(prefixes[0]) if (len(prefixes) > 0) else 0
+        if (any(len(prefix) != prefixlen for prefix in prefixes)):
+            raise ValueError("Prefixes of the window must have the same length")
+        blocks = None
+        if (prefixlen <= AES_BLOCK_SIZE):
+            blocks = int.from_bytes(b"".join(prefix.ljust(AES_BLOCK_SIZE, b"\x00") for prefix in prefixes), 'big')
+        # Bit 0 of every block, to repeat a block over the window
+        repeat = sum(1 << (8 * AES_BLOCK_SIZE * index) for index in range(len(prefixes)))
+        # Tag length -> masks of the tags over the window, filled on first use
+        tagmasks = {}
+        return prefixlen, prefixes, blocks, repeat, tagmasks
+
+    def verify_window(self, state, suffix, taglen, mac):
+        '''Verify the CMAC tag of prefix || suffix, for each prefix of the window.
+           Returns the index of the first matching prefix, -1 if none.
+           Tags of all the prefixes are generated in one call and all compared, without
+           a branch per prefix'''
+        prefixlen, prefixes, blocks, repeat, tagmasks = state
+        suffix = bytes(suffix)
+        mac = bytes(mac)
+        count = len(prefixes)
+        if ((0 == count) or (len(mac) != taglen)):
+            return -1
+        if ((None == blocks) or ((prefixlen + len(suffix)) > AES_BLOCK_SIZE) or (taglen >= AES_BLOCK_SIZE)):
+            results = self.verify_many([prefix + suffix for prefix in prefixes], taglen, [mac] * count)
+            return results.index(True) if (True in results) else -1
+        # Message of one block: the last block is linear in the message, so the last
+        # block of prefix || suffix is the prefix XOR the last block of 0..0 || suffix
+        common = self.lastblock(bytes(prefixlen) + suffix)
+        output = self.ecb.update((blocks ^ (common * repeat)).to_bytes(count * AES_BLOCK_SIZE, 'big'))
+        # Tag is in the top bits of each block, difference to the received tag is kept there
+        tagshift = 8 * (AES_BLOCK_SIZE - taglen)
+        masks = tagmasks.get(taglen)
+        if (None == masks):
+            masks = tagmasks[taglen] = ((((1 << (8 * taglen)) - 1) << tagshift) * repeat,
+                                        repeat << (8 * AES_BLOCK_SIZE))
+        tagmask, carries = masks
+        difference = (int.from_bytes(output, 'big') ^ ((int.from_bytes(mac, 'big') << tagshift) * repeat)) & tagmask
+        # Adding the mask carries into the next block, only for a non-zero difference
+        matches = carries & ~(difference + tagmask)
+        if (0 == matches):
+            return -1
+        # First prefix is in the most significant block
+        return count - (matches.bit_length() - 1) // (8 * AES_BLOCK_SIZE)
+
+
+################################################################################
+# Functions
+################################################################################
+def cmac_double(value):
+    '''Multiply by x in GF(2^128), for CMAC subkey generation'''
+    value <<= 1
+    if (value >> (8 * AES_BLOCK_SIZE)):
+        value = (value & ((1 << (8 * AES_BLOCK_SIZE)) - 1)) ^ CMAC_RB
+    return value
+
+
+################################################################################
+# Registration
+################################################################################
+registercipher(CipherInfo("AES128", AES_Cipher, AES_KEY,
+                          encrypt="aesencrypt", decrypt="aesdecrypt", reset="reset",
+                          isstream=True))
+registercipher(CipherInfo("AES128", AES_CTR_Stream, AES_KEY,
+                          backend="persistent",
+                          encrypt="aesencrypt", decrypt="aesdecrypt", reset="reset",
+                          isstream=True, isequivalent=False,
+                          isdefault=AES_PERSISTENT_CTX_MODE))
+registercipher(CipherInfo("AES128-CMAC", AES_CMAC, AES_KEY,
+                          blocksize=AES_BLOCK_SIZE,
+                          mac="generate_cmac_aes128", verify="verify_cmac_aes128",
+                          mac_batch="generate_many", verify_batch="verify_many",
+                          mac_window="precompute_window", verify_window="verify_window"))
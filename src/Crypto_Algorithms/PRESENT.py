@@ -3,12 +3,17 @@ This module provides utility functions for PRESENT encryption algorithm.
 
 It includes :
     * Functions for encrypting and decrypting data using PRESENT
+    * Table-driven PRESENT with fused S-box/P-box lookup tables
+    * Vectorized batch encryption and decryption over arrays of 64-bit blocks
 
 """
 ################################################################################
 # Imports
 ################################################################################
-
+import os
+import time
+import numpy as np
+from Crypto_Algorithms.cipher_registry import CipherInfo, registercipher
 
 
 
@@ -19,6 +24,12 @@ It includes :
 PRESENT_KEY = b"2023ht6554" 
 PRESENT_ROUNDS = 31
 
+# Number of byte slices of the 64-bit state, used for the lookup tables
+PRESENT_TABLE_SLICES = 8
+
+# Number of blocks processed at once in batch mode, to bound the temporaries
+PRESENT_BATCH_CHUNK = 1 << 16
+
 
 ################################################################################
 # Globals
@@ -40,15 +51,24 @@ P_BOX = [
     8, 24, 40, 56, 9, 25, 41, 57, 10, 26, 42, 58, 11, 27, 43, 59,
     12, 28, 44, 60, 13, 29, 45, 61, 14, 30, 46, 62, 15, 31, 47, 63
 ]
+
+# Inverse P-box for PRESENT (for decryption)
+INV_P_BOX = [P_BOX.index(i) for i in range(64)]
+
+# Identity S-box and P-box, to build tables for a single layer
+IDENTITY_S_BOX = list(range(16))
+IDENTITY_P_BOX = list(range(64))
 ################################################################################
 # Classes
 ################################################################################
 class PRESENT:
     '''Represents the PRESENT Algorithm class'''
-    def __init__(self):
-        self.key = int(PRESENT_KEY.hex())
+    def __init__(self, key = PRESENT_KEY):
+        self.key = int(key.hex())
         self.rounds = PRESENT_ROUNDS
         self.round_keys = self.generate_round_keys()
+        # Lookup tables for batch mode, created on first use
+        self.batch_tables = None
 
     def generate_round_keys(self):
         '''Generate round keys for PRESENT Algorithm.
@@ -136,9 +156,219 @@ class PRESENT:
                 new_state |= (1 << i)
         return new_state        
 
-    
+    def init_batch_tables(self):
+        '''Create the NumPy lookup tables and round keys for batch mode'''
+        round_keys = np.array(self.round_keys, dtype=np.uint64)
+        inv_round_keys = np.array([self.p_box_layer_inverse(self.round_keys[r])
+                                   for r in range(self.rounds - 2, 0, -1)], dtype=np.uint64)
+        # Lookup tables do not depend on the key, they are shared by all the objects
+        self.batch_tables = {
+            "sp" : PRESENT_SP_ARRAY,
+            "inv_sp" : PRESENT_INV_SP_ARRAY,
+            "inv_p" : PRESENT_INV_P_ARRAY,
+            "inv_s" : PRESENT_INV_S_ARRAY,
+            "round_keys" : round_keys,
+            "inv_round_keys" : inv_round_keys
+        }
+
+    def encrypt_blocks(self, blocks):
+        '''Perform Encryption of a numpy.uint64 array, or a bytes buffer of N x 8 bytes.
+           Returns the same type and shape as the input'''
+        if (None == self.batch_tables):
+            self.init_batch_tables()
+        return process_blocks(blocks, self.encrypt_block_array)
+
+    def decrypt_blocks(self, blocks):
+        '''Perform Decryption of a numpy.uint64 array, or a bytes buffer of N x 8 bytes.
+           Returns the same type and shape as the input'''
+        if (None == self.batch_tables):
+            self.init_batch_tables()
+        return process_blocks(blocks, self.decrypt_block_array)
+
+    def encrypt_block_array(self, state):
+        '''Encrypt a flat numpy.uint64 array, all the rounds vectorized across the array'''
+        sp_table = self.batch_tables["sp"]
+        round_keys = self.batch_tables["round_keys"]
+        for r in range(self.rounds - 1):
+            state = state ^ round_keys[r]
+            state = table_lookup_array(sp_table, state)
+        return state ^ round_keys[self.rounds - 1]
+
+    def decrypt_block_array(self, state):
+        '''Decrypt a flat numpy.uint64 array, all the rounds vectorized across the array'''
+        inv_sp_table = self.batch_tables["inv_sp"]
+        round_keys = self.batch_tables["round_keys"]
+        state = state ^ round_keys[self.rounds - 1]
+        state = table_lookup_array(self.batch_tables["inv_p"], state)
+        for inv_round_key in self.batch_tables["inv_round_keys"]:
+            state = table_lookup_array(inv_sp_table, state) ^ inv_round_key
+        return table_lookup_array(self.batch_tables["inv_s"], state) ^ round_keys[0]
+
+
+class PRESENT_Table(PRESENT):
+    '''Represents the table-driven PRESENT Algorithm class.
+       Output is bit-identical to the PRESENT class'''
+    def __init__(self, key = PRESENT_KEY):
+        super().__init__(key)
+        # Lookup tables do not depend on the key, built once at import.
+        # Key setup only computes the round keys
+        self.sp_table = PRESENT_SP_TABLE
+        self.inv_sp_table = PRESENT_INV_SP_TABLE
+        self.inv_p_table = PRESENT_INV_P_TABLE
+        self.inv_s_table = PRESENT_INV_S_TABLE
+        self.inv_round_keys = [self.p_box_layer_inverse(self.round_keys[r])
+                               for r in range(self.rounds - 2, 0, -1)]
+
+    def presentencrypt(self, plaintext):
+        '''Perform Encryption'''
+        state = int.from_bytes(bytes(plaintext), 'big')
+        if (state >> 64):
+            raise ValueError("Plaintext must be 64 bits or less.")
+
+        t0, t1, t2, t3, t4, t5, t6, t7 = self.sp_table
+        for round_key in self.round_keys[:-1]:
+            state ^= round_key
+            # S-box and P-box layer in one step, one lookup per byte
+            state = (t0[state & 0xFF] | t1[(state >> 8) & 0xFF] |
+                     t2[(state >> 16) & 0xFF] | t3[(state >> 24) & 0xFF] |
+                     t4[(state >> 32) & 0xFF] | t5[(state >> 40) & 0xFF] |
+                     t6[(state >> 48) & 0xFF] | t7[state >> 56])
+        state ^= self.round_keys[-1] # Last round without P-box and S-box
+
+        #Convert to bytearray
+        return bytearray(state.to_bytes(8, 'big'))
+
+    def presentdecrypt(self, ciphertext):
+        '''Perform Decryption'''
+        state = int.from_bytes(bytes(ciphertext), 'big')
+        if (state >> 64):
+            raise ValueError("Ciphertext must be 64 bits or less.")
+
+        state ^= self.round_keys[self.rounds - 1] # First step of decryption
+        state = table_lookup(self.inv_p_table, state)
+
+        t0, t1, t2, t3, t4, t5, t6, t7 = self.inv_sp_table
+        for inv_round_key in self.inv_round_keys:
+            # Inverse S-box and inverse P-box layer in one step
+            state = (t0[state & 0xFF] | t1[(state >> 8) & 0xFF] |
+                     t2[(state >> 16) & 0xFF] | t3[(state >> 24) & 0xFF] |
+                     t4[(state >> 32) & 0xFF] | t5[(state >> 40) & 0xFF] |
+                     t6[(state >> 48) & 0xFF] | t7[state >> 56]) ^ inv_round_key
+        # Last round without P-box
+        state = table_lookup(self.inv_s_table, state) ^ self.round_keys[0]
+
+        #Convert to bytearray
+        return bytearray(state.to_bytes(8, 'big'))
+
 
 
 ################################################################################
 # Functions
-################################################################################
\ No newline at end of file
+################################################################################
+def generate_sp_table(s_box_table, p_box_table):
+    '''Generate byte-indexed lookup tables, mapping each byte of the state
+       to its substituted and permuted 64-bit contribution'''
+    sp_table = []
+    for byteidx in range(PRESENT_TABLE_SLICES):
+        slice_table = []
+        for value in range(256):
+            # Substitute both the nibbles of the byte
+            substituted = (s_box_table[value >> 4] << 4) | s_box_table[value & 0xF]
+            # Move each bit to its permuted position in the state
+            entry = 0
+            for bit in range(8):
+                if (substituted >> bit) & 1:
+                    entry |= (1 << p_box_table[(byteidx * 8) + bit])
+            slice_table.append(entry)
+        sp_table.append(slice_table)
+    return sp_table
+
+def table_lookup(table, state):
+    '''Apply the byte-indexed lookup tables on the 64-bit state'''
+    new_state = 0
+    for byteidx in range(PRESENT_TABLE_SLICES):
+        new_state |= table[byteidx][(state >> (byteidx * 8)) & 0xFF]
+    return new_state
+
+def table_lookup_array(table, state):
+    '''Apply the byte-indexed lookup tables on a numpy.uint64 array of states'''
+    new_state = table[0][state & 0xFF]
+    for byteidx in range(1, PRESENT_TABLE_SLICES):
+        new_state |= table[byteidx][(state >> (byteidx * 8)) & 0xFF]
+    return new_state
+
+def process_blocks(blocks, blockfunction):
+    '''Run the block function over the blocks in chunks.
+       Bytes are interpreted as big endian 64-bit blocks, as in the scalar path'''
+    isbuffer = isinstance(blocks, (bytes, bytearray, memoryview))
+    if (True == isbuffer):
+        if (len(blocks) % 8):
+            raise ValueError("Buffer length must be a multiple of 8 bytes.")
+        state = np.frombuffer(blocks, dtype=">u8").astype(np.uint64)
+    else:
+        state = np.asarray(blocks, dtype=np.uint64).ravel()
+
+    result = np.empty_like(state)
+    for start in range(0, len(state), PRESENT_BATCH_CHUNK):
+        end = start + PRESENT_BATCH_CHUNK
+        result[start:end] = blockfunction(state[start:end])
+
+    if (True == isbuffer):
+        return result.astype(">u8").tobytes()
+    return result.reshape(np.shape(blocks))
+
+def measure_throughput(encobj, nblocks = 1_000_000, nscalarblocks = 2_000):
+    '''Compare the throughput of the scalar path and the batch mode in blocks/second'''
+    buffer = os.urandom(nblocks * 8)
+
+    # Scalar path, one block per call
+    starttime = time.perf_counter()
+    for offset in range(0, nscalarblocks * 8, 8):
+        encobj.presentencrypt(buffer[offset:offset + 8])
+    scalartime = time.perf_counter() - starttime
+
+    # Batch mode, all the blocks in one call
+    encobj.encrypt_blocks(buffer[0:8])
+    starttime = time.perf_counter()
+    encobj.encrypt_blocks(buffer)
+    batchtime = time.perf_counter() - starttime
+
+    return {
+        "scalar_blocks_per_s" : nscalarblocks / scalartime,
+        "batch_blocks_per_s" : nblocks / batchtime,
+        "speedup" : (nblocks / batchtime) / (nscalarblocks / scalartime)
+    }
+
+
+################################################################################
+# Lookup Tables
+################################################################################
+# Fused S-box and P-box tables for encryption
+PRESENT_SP_TABLE = generate_sp_table(S_BOX, P_BOX)
+# For decryption, inverse S-box and inverse P-box are fused.
+# Since the P-box is linear, the round key is pre-permuted
+# Pinv(InvS(x) ^ k) = Pinv(InvS(x)) ^ Pinv(k)
+PRESENT_INV_SP_TABLE = generate_sp_table(INV_S_BOX, INV_P_BOX)
+PRESENT_INV_P_TABLE = generate_sp_table(IDENTITY_S_BOX, INV_P_BOX)
+PRESENT_INV_S_TABLE = generate_sp_table(INV_S_BOX, IDENTITY_P_BOX)
+
+# Same tables for batch mode
+PRESENT_SP_ARRAY = np.array(PRESENT_SP_TABLE, dtype=np.uint64)
+PRESENT_INV_SP_ARRAY = np.array(PRESENT_INV_SP_TABLE, dtype=np.uint64)
+PRESENT_INV_P_ARRAY = np.array(PRESENT_INV_P_TABLE, dtype=np.uint64)
+PRESENT_INV_S_ARRAY = np.array(PRESENT_INV_S_TABLE, dtype=np.uint64)
+
+
+################################################################################
+# Registration
+################################################################################
+registercipher(CipherInfo("PRESENT", PRESENT, PRESENT_KEY,
+                          encrypt="presentencrypt", decrypt="presentdecrypt",
+                          encrypt_blocks="encrypt_blocks", decrypt_blocks="decrypt_blocks",
+                          returnsbytes=False))
+# Table-driven implementation, output identical to PRESENT
+registercipher(CipherInfo("PRESENT", PRESENT_Table, PRESENT_KEY,
+                          backend="table",
+                          encrypt="presentencrypt", decrypt="presentdecrypt",
+                          encrypt_blocks="encrypt_blocks", decrypt_blocks="decrypt_blocks",
+                          returnsbytes=False, isdefault=True))
@@ -3,12 +3,15 @@ This module provides utility functions for RC4 encryption algorithm.
 
 It includes :
     * Functions for encrypting and decrypting data using RC4 cipher
+    * Stateful RC4 with cached KSA snapshot and pregenerated keystream ring
 
 """
 ################################################################################
 # Imports
 ################################################################################
-
+import os
+import threading
+from Crypto_Algorithms.cipher_registry import CipherInfo, registercipher
 
 
 
@@ -19,6 +22,22 @@ It includes :
 RC4_KEY = b"2023ht65544"
 RC4_S_ARRAY_SIZE = 256
 
+# Use stateful RC4 (KSA once per key, keystream per frame) instead of
+# running the KSA for every frame
+RC4_STATEFUL_MODE = True
+
+# For stateful RC4
+# Number of initial keystream bytes dropped (RC4-drop[n])
+RC4_DROP_BYTES = 768
+# Keystream bytes consumed per CAN frame
+RC4_FRAME_SIZE = 8
+# Number of frames held in the keystream ring
+RC4_RING_FRAMES = 1024
+# Ring is refilled, once fewer frames than this are pregenerated
+RC4_RING_LOW_WATER = RC4_RING_FRAMES // 2
+# Frames generated by the refill thread, each time it holds the lock
+RC4_REFILL_CHUNK = 64
+
 
 # To represent time in 1 us
 us_DURATION = 1_000
@@ -81,7 +100,159 @@ class RC4:
         return self.rc4encrypt(ciphertext)
 
 
+class RC4_Stateful(RC4):
+    '''Represents the stateful RC4 Algorithm class.
+       KSA runs once per key, the keystream is served per frame from a ring
+       buffer, indexed by the frame counter'''
+    def __init__(self, key, s_arraysize, drop = RC4_DROP_BYTES,
+                 framesize = RC4_FRAME_SIZE, ringframes = RC4_RING_FRAMES):
+        super().__init__(key, s_arraysize)
+        self.drop = drop
+        self.framesize = framesize
+        self.ringframes = ringframes
+        self.ring = bytearray(ringframes * framesize)
+        # Run KSA once and keep a snapshot, to rewind the keystream
+        self.keyschedulealgo()
+        self.ksa_snapshot = list(self.s_array)
+        self.rewind(0)
+        # Frame counters for encryption and decryption, kept separately so
+        # that sender and receiver stay aligned
+        self.txframecounter = 0
+        self.rxframecounter = 0
+        # Refill thread is started in the process using the object, as
+        # threads are not carried over to forked processes
+        self.ownerpid = None
+        self.lock = None
+        self.refillevent = None
+        self.lastrequested = 0
+
+    def rewind(self, frame):
+        '''Restore the PRGA state from the KSA snapshot, and move to the frame'''
+        self.s_array = list(self.ksa_snapshot)
+        self.prga_i = 0
+        self.prga_j = 0
+        # Discard the dropped bytes and the keystream of earlier frames
+        self.generatekeystream(self.drop + (frame * self.framesize))
+        # First frame in the ring, and the next frame to be generated
+        self.ringbase = frame
+        self.nextframe = frame
+
+    def reset(self):
+        '''Restart the keystream at frame 0, e.g. when the object is reused'''
+        if (os.getpid() == self.ownerpid):
+            # Refill thread is running in this process
+            with self.lock:
+                self.rewind(0)
+                self.lastrequested = 0
+        else:
+            self.rewind(0)
+        self.txframecounter = 0
+        self.rxframecounter = 0
+
+    def generatekeystream(self, datalen):
+        '''Continue the Pseudo Random Generator for datalen bytes'''
+        s_array = self.s_array
+        size = self.s_arraysize
+        i = self.prga_i
+        j = self.prga_j
+        keystream = bytearray(datalen)
+        for idx in range(datalen):
+            i = (i + 1) % size
+            j = (j + s_array[i]) % size
+            s_array[i], s_array[j] = s_array[j], s_array[i]
+            keystream[idx] = s_array[(s_array[i] + s_array[j]) % size]
+        self.prga_i = i
+        self.prga_j = j
+        return keystream
+
+    def generateframes(self, count):
+        '''Generate the keystream of the next frames into the ring.
+           Must be called with the lock held'''
+        keystream = self.generatekeystream(count * self.framesize)
+        for idx in range(count):
+            offset = (self.nextframe % self.ringframes) * self.framesize
+            self.ring[offset:offset + self.framesize] = \
+                keystream[idx * self.framesize:(idx + 1) * self.framesize]
+            self.nextframe += 1
+        # Oldest frames are overwritten, once the ring is full
+        self.ringbase = max(self.ringbase, self.nextframe - self.ringframes)
+
+    def startrefill(self):
+        '''Start the background thread refilling the ring'''
+        self.ownerpid = os.getpid()
+        self.lock = threading.Lock()
+        self.refillevent = threading.Event()
+        self.refillthread = threading.Thread(target=self.refill, daemon=True)
+        self.refillthread.start()
+
+    def refill(self):
+        '''Background thread, pregenerates frames ahead of the last requested frame'''
+        while True:
+            self.refillevent.wait()
+            self.refillevent.clear()
+            while True:
+                with self.lock:
+                    count = min(RC4_REFILL_CHUNK,
+                                self.lastrequested + self.ringframes - self.nextframe)
+                    if (count <= 0):
+                        break
+                    self.generateframes(count)
+
+    def getkeystream(self, frame):
+        '''Get the keystream for the frame counter'''
+        if (os.getpid() != self.ownerpid):
+            self.startrefill()
+        with self.lock:
+            if (frame < self.ringbase):
+                # Frame already overwritten, regenerate from the KSA snapshot
+                self.rewind(frame)
+            if (frame >= self.nextframe):
+                # Ring has not caught up, generate the missing frames inline
+                self.generateframes(frame - self.nextframe + 1)
+            offset = (frame % self.ringframes) * self.framesize
+            keystream = bytes(self.ring[offset:offset + self.framesize])
+            self.lastrequested = frame
+            pregenerated = self.nextframe - frame
+        # Wake the refill thread, once the ring runs low
+        if (pregenerated < RC4_RING_LOW_WATER):
+            self.refillevent.set()
+        return keystream
+
+    def encrypt_frame(self, data, frame):
+        '''Encrypt or decrypt the data with the keystream of the frame counter'''
+        datalen = len(data)
+        if (datalen > self.framesize):
+            raise ValueError("Data must be " + str(self.framesize) + " bytes or less.")
+        keystream = self.getkeystream(frame)
+        result = int.from_bytes(bytes(data), 'big') ^ int.from_bytes(keystream[:datalen], 'big')
+        return result.to_bytes(datalen, 'big')
+
+    def rc4encrypt(self, plaintext):
+        '''For RC4 encryption with the next sender frame counter'''
+        ciphertext = self.encrypt_frame(plaintext, self.txframecounter)
+        self.txframecounter += 1
+        return ciphertext
+
+    def rc4decrypt(self, ciphertext):
+        '''For RC4 decryption with the next receiver frame counter'''
+        plaintext = self.encrypt_frame(ciphertext, self.rxframecounter)
+        self.rxframecounter += 1
+        return plaintext
+
+
 ################################################################################
 # Functions
 ################################################################################
 
+
+################################################################################
+# Registration
+################################################################################
+registercipher(CipherInfo("RC4", lambda key: RC4(key, RC4_S_ARRAY_SIZE), RC4_KEY,
+                          encrypt="rc4encrypt", decrypt="rc4decrypt",
+                          isstream=True, returnsbytes=False))
+registercipher(CipherInfo("RC4", lambda key: RC4_Stateful(key, RC4_S_ARRAY_SIZE), RC4_KEY,
+                          backend="stateful",
+                          encrypt="rc4encrypt", decrypt="rc4decrypt", reset="reset",
+                          isstream=True, isequivalent=False,
+                          isdefault=RC4_STATEFUL_MODE))
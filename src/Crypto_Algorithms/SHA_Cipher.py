@@ -3,6 +3,8 @@ This module provides utility functions for SHA256 MAC Generation.
 
 It includes :
     * Functions for generating and verifying MAC using SHA algorithm
+    * Batch generation and constant-time batch verification of MACs
+    * Verification of a MAC against a window of candidate messages
 
 """
 ################################################################################
@@ -10,6 +12,7 @@ It includes :
 ################################################################################
 import hmac
 import hashlib
+from Crypto_Algorithms.cipher_registry import CipherInfo, registercipher
 
 ################################################################################
 # Macros
@@ -19,6 +22,11 @@ SHA_KEY = b"2023ht6554400000"
 SHA_KEY_SIZE = 16
 SHA_KEYSTREAM_SIZE = 8
 
+# Block size of SHA256 in bytes, and the HMAC pads
+SHA_BLOCK_SIZE = 64
+HMAC_IPAD = 0x36
+HMAC_OPAD = 0x5C
+
 ################################################################################
 # Globals
 ################################################################################
@@ -31,13 +39,73 @@ class SHA_Cipher:
     '''Represents the SHA256 Algorithm class'''
     def __init__(self, key):
         self.key = key
+        self.keyschedule()
+
+    def keyschedule(self):
+        '''Precompute the keyed inner and outer SHA256 states. Called during Initialization'''
+        key = self.key
+        # Keys longer than the block size are hashed first
+        if (len(key) > SHA_BLOCK_SIZE):
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(SHA_BLOCK_SIZE, b"\x00")
+        self.inner = hashlib.sha256(bytes(k ^ HMAC_IPAD for k in key))
+        self.outer = hashlib.sha256(bytes(k ^ HMAC_OPAD for k in key))
     
     def generate_hmac_sha256(self, message: bytes, tag_len: int = 4) -> bytes:
         '''Generate HMAC-SHA256 tag for given message.'''
-        mac = hmac.new(self.key, message, hashlib.sha256).digest()
-        return mac[:tag_len]
+        # Clone the keyed states instead of hashing the pads again
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()[:tag_len]
 
     def verify_hmac_sha256(self, message: bytes, taglen: bytes, mac) -> bool:
         ''' Verify HMAC tag.'''
         expected = self.generate_hmac_sha256(message, taglen)
-        return hmac.compare_digest(expected, mac)
\ No newline at end of file
+        return hmac.compare_digest(expected, mac)
+
+    def generate_many(self, messages, tag_len: int = 4):
+        '''Generate HMAC-SHA256 tags for a list of messages.'''
+        return [self.generate_hmac_sha256(message, tag_len) for message in messages]
+
+    def verify_many(self, messages, taglen, macs):
+        '''Verify HMAC tags for a list of messages, returns the result for each message.
+           Every tag is compared in constant time, without stopping at the first match'''
+        return [hmac.compare_digest(expected, bytes(mac))
+                for expected, mac in zip(self.generate_many(messages, taglen), macs)]
+
+    def precompute_window(self, prefixes):
+        '''Precompute the inner SHA256 states of the messages starting with each of the prefixes'''
+        states = []
+        for prefix in prefixes:
+            inner = self.inner.copy()
+            inner.update(prefix)
+            states.append(inner)
+        return states
+
+    def verify_window(self, state, suffix, taglen, mac):
+        '''Verify the HMAC tag of prefix || suffix, for each prefix of the window.
+           Returns the index of the first matching prefix, -1 if none.
+           Every tag is compared in constant time, without stopping at the first match'''
+        suffix = bytes(suffix)
+        mac = bytes(mac)
+        index = -1
+        for candidate, prefixstate in enumerate(state):
+            inner = prefixstate.copy()
+            inner.update(suffix)
+            outer = self.outer.copy()
+            outer.update(inner.digest())
+            if ((True == hmac.compare_digest(outer.digest()[:taglen], mac)) and (index < 0)):
+                index = candidate
+        return index
+
+
+################################################################################
+# Registration
+################################################################################
+registercipher(CipherInfo("SHA256-HMAC", SHA_Cipher, SHA_KEY,
+                          blocksize=SHA_BLOCK_SIZE,
+                          mac="generate_hmac_sha256", verify="verify_hmac_sha256",
+                          mac_batch="generate_many", verify_batch="verify_many",
+                          mac_window="precompute_window", verify_window="verify_window"))
@@ -0,0 +1,204 @@
+"""
+This module provides the backend selection for the registered algorithms.
+
+It includes :
+    * Functions to cross-check the backends against the reference backend
+    * Functions to time the backends for single-frame and batch workloads
+    * Functions to select the fastest backend, cached per host in a file
+
+"""
+################################################################################
+# Imports
+################################################################################
+import json
+import os
+import socket
+import time
+from Crypto_Algorithms.cipher_registry import *
+
+
+################################################################################
+# Macros
+################################################################################
+# Force the reference backend of every algorithm, for thesis-grade comparisons
+FORCE_REFERENCE_BACKEND = False
+
+# File caching the selected backends, per host, next to this module
+CALIBRATION_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend_calibration.json")
+
+# Workloads timed during calibration
+WORKLOAD_SINGLE = "single"
+WORKLOAD_BATCH = "batch"
+
+# Number of frames timed for each workload
+CALIBRATION_SINGLE_FRAMES = 200
+CALIBRATION_BATCH_FRAMES = 4096
+
+# Length of the messages used for MAC algorithms (CAN ID || counter || 6 bytes)
+CALIBRATION_MAC_MSG_LEN = 14
+
+# Known-answer vectors, backends must give the same output as the reference
+KNOWN_ANSWER_VECTORS = [
+    bytes(8),
+    bytes([0xFF] * 8),
+    bytes(range(8)),
+    bytes([0xAA, 0xBB, 0xCC, 0xDD, 0xEE, 0xFF, 0x00, 0x11]),
+    bytes([0x00, 0xC0, 0xFF, 0xEE, 0x00, 0x00, 0x00, 0x01]),
+]
+
+
+################################################################################
+# Globals
+################################################################################
+# Backends selected on this host, algorithm name -> {workload -> backend name}
+g_selectedbackends = None
+
+
+################################################################################
+# Functions
+################################################################################
+def getknownanswervectors(info):
+    '''Get the known-answer input vectors for the algorithm'''
+    if (None != info.mac):
+        # Vectors are repeated to the MAC message length
+        return [(vector * 2)[:CALIBRATION_MAC_MSG_LEN] for vector in KNOWN_ANSWER_VECTORS]
+    return [vector[:info.blocksize].ljust(info.blocksize, b"\x00") for vector in KNOWN_ANSWER_VECTORS]
+
+def runvectors(cipher, vectors):
+    '''Get the outputs of a freshly created backend for the vectors'''
+    if (True == cipher.capabilities()["mac"]):
+        return [cipher.mac(vector) for vector in vectors] + cipher.mac_batch(vectors)
+    outputs = [cipher.encrypt(vector) for vector in vectors]
+    # Encryption must be reversible by the same backend
+    decrypted = [cipher.decrypt(output) for output in outputs]
+    return outputs + decrypted + cipher.encrypt_batch(vectors)
+
+def crosscheckbackend(name, backend):
+    '''Check the backend against the reference backend with known-answer vectors'''
+    info = getcipherinfo(name, backend)
+    vectors = getknownanswervectors(info)
+    reference = runvectors(createcipher(name, backend=CIPHER_BACKEND_REFERENCE), vectors)
+    result = runvectors(createcipher(name, backend=backend), vectors)
+    return reference == result
+
+def timebackend(name, backend):
+    '''Time the backend for single-frame and batch workloads, in ns per frame'''
+    info = getcipherinfo(name, backend)
+    cipher = createcipher(name, backend=backend)
+    vector = getknownanswervectors(info)[-1]
+    isMAC = (None != info.mac)
+    single = cipher.mac if isMAC else cipher.encrypt
+    batch = cipher.mac_batch if isMAC else cipher.encrypt_batch
+
+    # Warm up, e.g. for tables created on first use
+    single(vector)
+    batch([vector])
+
+    starttime = time.perf_counter_ns()
+    for _ in range(CALIBRATION_SINGLE_FRAMES):
+        single(vector)
+    singletime = (time.perf_counter_ns() - starttime) / CALIBRATION_SINGLE_FRAMES
+
+    vectors = [vector] * CALIBRATION_BATCH_FRAMES
+    starttime = time.perf_counter_ns()
+    batch(vectors)
+    batchtime = (time.perf_counter_ns() - starttime) / CALIBRATION_BATCH_FRAMES
+
+    return {WORKLOAD_SINGLE : singletime, WORKLOAD_BATCH : batchtime}
+
+def calibratecipher(name):
+    '''Time each backend of the algorithm, that matches the reference output.
+       Returns the fastest backend for each workload'''
+    candidates = []
+    for backend in getcipherbackends(name):
+        info = getcipherinfo(name, backend)
+        # Backends with a different output (e.g. another stream mode) are not compared
+        if (False == info.isequivalent):
+            continue
+        if ((CIPHER_BACKEND_REFERENCE != backend) and
+            (False == crosscheckbackend(name, backend))):
+            print("[Error] Backend " + backend + " of " + name + " does not match the reference output")
+            continue
+        candidates.append(backend)
+
+    selection = {}
+    if (len(candidates) > 1):
+        timings = {backend : timebackend(name, backend) for backend in candidates}
+        for workload in (WORKLOAD_SINGLE, WORKLOAD_BATCH):
+            selection[workload] = min(candidates, key=lambda backend: timings[backend][workload])
+    return selection
+
+def gethostkey():
+    '''Get the key identifying this host in the cache file'''
+    return socket.gethostname()
+
+def loadcalibrationcache():
+    '''Load the cached selection of all the hosts'''
+    try:
+        with open(CALIBRATION_CACHE_FILE, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+def savecalibrationcache(selectedbackends):
+    '''Save the selection of this host into the cache file'''
+    cache = loadcalibrationcache()
+    cache[gethostkey()] = selectedbackends
+    try:
+        with open(CALIBRATION_CACHE_FILE, "w") as fp:
+            json.dump(cache, fp, indent=4)
+    except OSError as e:
+        print(f"[Error] Unable to save the backend calibration {e}")
+
+def getselectedbackends():
+    '''Get the backends selected on this host, loaded from the cache file once'''
+    global g_selectedbackends
+    if (None == g_selectedbackends):
+        g_selectedbackends = loadcalibrationcache().get(gethostkey(), {})
+    return g_selectedbackends
+
+def selectbackend(name, recalibrate = False, forcereference = None):
+    '''Select the backend used for the algorithm.
+       Calibration runs only if no valid selection is cached for this host'''
+    if (None == forcereference):
+        forcereference = FORCE_REFERENCE_BACKEND
+    if (None == getcipherinfo(name)):
+        return None
+
+    if (True == forcereference):
+        setcipherbackend(name, CIPHER_BACKEND_REFERENCE)
+        return CIPHER_BACKEND_REFERENCE
+
+    resetcipherbackend(name)
+    selectedbackends = getselectedbackends()
+    selection = selectedbackends.get(name)
+    # Cached selection is not valid, if its backends are no longer registered
+    if ((None == selection) or (True == recalibrate) or
+        any(backend not in getcipherbackends(name) for backend in selection.values())):
+        selection = calibratecipher(name)
+        selectedbackends[name] = selection
+        savecalibrationcache(selectedbackends)
+
+    # Selection applies only if the default is equivalent to the reference,
+    # a different mode selected for the algorithm is kept
+    if ((WORKLOAD_SINGLE in selection) and (True == getcipherinfo(name).isequivalent)):
+        setcipherbackend(name, selection[WORKLOAD_SINGLE])
+    return getcipherinfo(name).backend
+
+def getbatchbackend(name):
+    '''Get the backend selected for batch workloads, None to use the current backend'''
+    return getselectedbackends().get(name, {}).get(WORKLOAD_BATCH)
+
+def getbatchcipher(name, cipher):
+    '''Get the object of the backend selected for batch workloads, with the key of the cipher.
+       The cipher itself, if it is the same backend or its output differs from the reference'''
+    backend = getbatchbackend(name)
+    if ((None == backend) or (backend == cipher.info.backend) or
+        (False == cipher.info.isequivalent) or (backend not in getcipherbackends(name))):
+        return cipher
+    return getcachedcipher(name, cipher.key, backend)
+
+def calibrateallbackends(recalibrate = False, forcereference = None):
+    '''Select the backends of all the registered algorithms, e.g. at startup'''
+    return {name : selectbackend(name, recalibrate, forcereference)
+            for name in getregisteredciphers()}
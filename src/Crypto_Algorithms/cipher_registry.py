@@ -0,0 +1,312 @@
+"""
+This module provides the registry of the cryptographic algorithms.
+
+It includes :
+    * Class describing the registration of an algorithm
+    * Class with the common interface for all the algorithms
+    * Functions to register the algorithms and create their objects
+    * Functions to cache the initialized objects, per algorithm and key
+
+"""
+################################################################################
+# Imports
+################################################################################
+import time
+from collections import OrderedDict
+
+
+################################################################################
+# Macros
+################################################################################
+# Name of the reference backend of an algorithm
+CIPHER_BACKEND_REFERENCE = "reference"
+
+# Length of the truncated MAC sent in the CAN frame
+CIPHER_MAC_TAG_LEN = 2
+
+# Number of initialized objects kept in the cache, least recently used are evicted
+CIPHER_CACHE_SIZE = 16
+
+
+################################################################################
+# Globals
+################################################################################
+# Registered algorithms, algorithm name -> {backend name -> CipherInfo}
+g_cipherregistry = {}
+
+# Backend used when creating the object of an algorithm, algorithm name -> backend name
+g_defaultbackend = {}
+
+# Default backend given at registration, algorithm name -> backend name
+g_registereddefault = {}
+
+# Initialized objects, (algorithm name, backend name, key) -> CipherContext
+g_ciphercache = OrderedDict()
+g_ciphercachehits = 0
+g_ciphercachemisses = 0
+
+
+################################################################################
+# Classes
+################################################################################
+class CipherInfo:
+    '''Represents the registration of an algorithm backend.
+       Method arguments are the method names of the algorithm class'''
+    def __init__(self, name, factory, key,
+                 backend = CIPHER_BACKEND_REFERENCE,
+                 blocksize = 8,
+                 encrypt = None, decrypt = None,
+                 encrypt_blocks = None, decrypt_blocks = None,
+                 mac = None, verify = None,
+                 mac_batch = None, verify_batch = None,
+                 mac_window = None, verify_window = None,
+                 reset = None,
+                 isstream = False,
+                 returnsbytes = True,
+                 isequivalent = True,
+                 isdefault = False):
+        self.name = name
+        # Called with the key, returns the initialized algorithm object
+        self.factory = factory
+        self.key = key
+        self.backend = backend
+        self.blocksize = blocksize
+        self.encrypt = encrypt
+        self.decrypt = decrypt
+        # Methods taking a bytes buffer of N blocks
+        self.encrypt_blocks = encrypt_blocks
+        self.decrypt_blocks = decrypt_blocks
+        self.mac = mac
+        self.verify = verify
+        # Methods taking a list of messages
+        self.mac_batch = mac_batch
+        self.verify_batch = verify_batch
+        # Methods precomputing the MAC state of a list of message prefixes,
+        # and verifying a tag against all of them
+        self.mac_window = mac_window
+        self.verify_window = verify_window
+        # Method restoring the state after key setup, for objects keeping a state (e.g. frame counters)
+        self.reset = reset
+        self.isstream = isstream
+        # False, if the methods return list or bytearray instead of bytes
+        self.returnsbytes = returnsbytes
+        # False, if the output differs from the reference backend (e.g. another stream mode)
+        self.isequivalent = isequivalent
+        self.isdefault = isdefault
+
+    def capabilities(self):
+        '''Get the capability metadata of the algorithm'''
+        return {
+            "name" : self.name,
+            "backend" : self.backend,
+            "blocksize" : self.blocksize,
+            "mac" : (None != self.mac),
+            "stream" : self.isstream,
+            "equivalent" : self.isequivalent,
+            "batch" : ((None != self.encrypt_blocks) or (None != self.mac_batch))
+        }
+
+
+class CipherContext:
+    '''Represents an initialized algorithm, with the common interface
+           encrypt(buf), decrypt(buf), encrypt_batch(bufs), decrypt_batch(bufs)
+           mac(buf), verify(buf, tag), mac_batch(bufs), verify_batch(bufs, tags)
+           mac_window(prefixes), verify_window(state, suffix, tag)
+       Methods of the algorithm object are bound once, at creation'''
+    def __init__(self, info, encobj, keysetupns, taglen = CIPHER_MAC_TAG_LEN, key = None):
+        self.info = info
+        self.name = info.name
+        self.encobj = encobj
+        self.key = info.key if (None == key) else key
+        self.keysetupns = keysetupns
+        self.taglen = taglen
+
+        self.encrypt = bindmethod(encobj, info.encrypt, info.returnsbytes)
+        self.decrypt = bindmethod(encobj, info.decrypt, info.returnsbytes)
+        self.encrypt_blocks = bindmethod(encobj, info.encrypt_blocks, True)
+        self.decrypt_blocks = bindmethod(encobj, info.decrypt_blocks, True)
+        self.macmethod = bindmethod(encobj, info.mac, True)
+        self.verifymethod = bindmethod(encobj, info.verify, True)
+        self.macbatchmethod = bindmethod(encobj, info.mac_batch, True)
+        self.verifybatchmethod = bindmethod(encobj, info.verify_batch, True)
+        self.macwindowmethod = bindmethod(encobj, info.mac_window, True)
+        self.verifywindowmethod = bindmethod(encobj, info.verify_window, True)
+        self.resetmethod = bindmethod(encobj, info.reset, True)
+        # Object running the batch methods, another backend of the algorithm (e.g. the fastest for batches)
+        self.batchcipher = self
+
+    def reset(self):
+        '''Restore the state of the algorithm object after key setup, e.g. when reused from the cache'''
+        if (None != self.resetmethod):
+            self.resetmethod()
+
+    def key_setup_cost(self):
+        '''Time taken to initialize the algorithm object with the key, in ns'''
+        return self.keysetupns
+
+    def capabilities(self):
+        '''Get the capability metadata of the algorithm'''
+        return self.info.capabilities()
+
+    def setbatchcipher(self, cipher):
+        '''Run the batch methods through the object of another backend, with the same output'''
+        self.batchcipher = cipher
+
+    def encrypt_batch(self, bufs):
+        '''Encrypt a list of buffers, returns a list of bytes'''
+        batchcipher = self.batchcipher
+        return runbatch(bufs, self.info.blocksize, batchcipher.encrypt_blocks, batchcipher.encrypt)
+
+    def decrypt_batch(self, bufs):
+        '''Decrypt a list of buffers, returns a list of bytes'''
+        batchcipher = self.batchcipher
+        return runbatch(bufs, self.info.blocksize, batchcipher.decrypt_blocks, batchcipher.decrypt)
+
+    def mac(self, buf):
+        '''Generate the truncated MAC of the buffer'''
+        return self.macmethod(buf, self.taglen)
+
+    def verify(self, buf, tag):
+        '''Verify the truncated MAC of the buffer'''
+        return self.verifymethod(buf, self.taglen, tag)
+
+    def mac_batch(self, bufs):
+        '''Generate the truncated MACs of a list of buffers'''
+        if (self != self.batchcipher):
+            return self.batchcipher.mac_batch(bufs)
+        if (None != self.macbatchmethod):
+            return self.macbatchmethod(bufs, self.taglen)
+        return [self.mac(buf) for buf in bufs]
+
+    def verify_batch(self, bufs, tags):
+        '''Verify the truncated MACs of a list of buffers, returns the result for each buffer'''
+        if (self != self.batchcipher):
+            return self.batchcipher.verify_batch(bufs, tags)
+        if (None != self.verifybatchmethod):
+            return self.verifybatchmethod(bufs, self.taglen, tags)
+        return [self.verify(buf, tag) for buf, tag in zip(bufs, tags)]
+
+    def mac_window(self, prefixes):
+        '''Precompute the MAC state of the messages starting with each of the prefixes'''
+        if (None != self.macwindowmethod):
+            return self.macwindowmethod(prefixes)
+        return [bytes(prefix) for prefix in prefixes]
+
+    def verify_window(self, state, suffix, tag):
+        '''Verify the truncated MAC of prefix || suffix, for each prefix of the window state.
+           Returns the index of the first matching prefix, -1 if none'''
+        if (None != self.verifywindowmethod):
+            return self.verifywindowmethod(state, suffix, self.taglen, tag)
+        suffix = bytes(suffix)
+        results = self.verify_batch([prefix + suffix for prefix in state], [tag] * len(state))
+        return results.index(True) if (True in results) else -1
+
+
+################################################################################
+# Functions
+################################################################################
+def registercipher(info):
+    '''Register an algorithm backend'''
+    g_cipherregistry.setdefault(info.name, {})[info.backend] = info
+    # First registered backend is used, unless a backend asks to be the default
+    if ((info.name not in g_registereddefault) or (True == info.isdefault)):
+        g_registereddefault[info.name] = info.backend
+        g_defaultbackend[info.name] = info.backend
+
+def getregisteredciphers():
+    '''Get the names of all the registered algorithms'''
+    return list(g_cipherregistry.keys())
+
+def getcipherbackends(name):
+    '''Get the names of the registered backends of an algorithm'''
+    return list(g_cipherregistry.get(name, {}).keys())
+
+def getcipherinfo(name, backend = None):
+    '''Get the registration of an algorithm backend, None if not registered'''
+    backends = g_cipherregistry.get(name, {})
+    if (None == backend):
+        backend = g_defaultbackend.get(name)
+    return backends.get(backend)
+
+def setcipherbackend(name, backend):
+    '''Set the backend used when creating the object of an algorithm'''
+    if (backend not in g_cipherregistry.get(name, {})):
+        raise ValueError("Backend " + str(backend) + " not registered for " + str(name))
+    g_defaultbackend[name] = backend
+
+def resetcipherbackend(name):
+    '''Use the default backend given at registration for the algorithm'''
+    if (name in g_registereddefault):
+        g_defaultbackend[name] = g_registereddefault[name]
+
+def createcipher(name, key = None, backend = None):
+    '''Create the initialized object of an algorithm, None if not registered'''
+    info = getcipherinfo(name, backend)
+    if (None == info):
+        return None
+    if (None == key):
+        key = info.key
+    # Measure the key setup, i.e. creating the object with its key schedule
+    starttime = time.perf_counter_ns()
+    encobj = info.factory(key)
+    keysetupns = time.perf_counter_ns() - starttime
+    return CipherContext(info, encobj, keysetupns, key=key)
+
+def getcachedcipher(name, key = None, backend = None):
+    '''Get the initialized object of an algorithm from the cache, created on a miss.
+       Reused objects are reset, the key setup is not repeated'''
+    global g_ciphercachehits, g_ciphercachemisses
+    info = getcipherinfo(name, backend)
+    if (None == info):
+        return None
+    if (None == key):
+        key = info.key
+    cachekey = (name, info.backend, bytes(key))
+
+    cipher = g_ciphercache.get(cachekey)
+    if (None != cipher):
+        g_ciphercachehits += 1
+        g_ciphercache.move_to_end(cachekey)
+        cipher.reset()
+        return cipher
+
+    g_ciphercachemisses += 1
+    cipher = createcipher(name, key, info.backend)
+    g_ciphercache[cachekey] = cipher
+    if (len(g_ciphercache) > CIPHER_CACHE_SIZE):
+        g_ciphercache.popitem(last=False)
+    return cipher
+
+def clearciphercache():
+    '''Remove all the initialized objects from the cache'''
+    global g_ciphercachehits, g_ciphercachemisses
+    g_ciphercache.clear()
+    g_ciphercachehits = 0
+    g_ciphercachemisses = 0
+
+def getciphercachestatistics():
+    '''Get the hits, misses and size of the cache'''
+    return {
+        "hits" : g_ciphercachehits,
+        "misses" : g_ciphercachemisses,
+        "size" : len(g_ciphercache)
+    }
+
+def bindmethod(encobj, methodname, returnsbytes):
+    '''Get the bound method of the algorithm object, converting the result to bytes if needed'''
+    if (None == methodname):
+        return None
+    method = getattr(encobj, methodname)
+    if (True == returnsbytes):
+        return method
+    return lambda data: bytes(method(data))
+
+def runbatch(bufs, blocksize, blocksmethod, method):
+    '''Run a list of buffers through the algorithm.
+       Buffers of exactly one block go through the multi-block method in one call'''
+    if ((None != blocksmethod) and (len(bufs) > 0) and
+        all(len(buf) == blocksize for buf in bufs)):
+        result = blocksmethod(b"".join(bytes(buf) for buf in bufs))
+        return [result[offset:offset + blocksize]
+                for offset in range(0, len(result), blocksize)]
+    return [method(buf) for buf in bufs]
@@ -3,12 +3,15 @@ This module provides utility functions for xTEA encryption algorithm.
 
 It includes :
     * Functions for encrypting and decrypting data using xTEA (Extended TEA) cipher
+    * Vectorized batch encryption and decryption over arrays of (v0, v1) pairs
 
 """
 ################################################################################
 # Imports
 ################################################################################
 import struct
+import numpy as np
+from Crypto_Algorithms.cipher_registry import CipherInfo, registercipher
 
 ################################################################################
 # Macros
@@ -19,6 +22,7 @@ XTEA_NUM_ROUNDS=32
 
 # The 32-bit Modulo (2^32)
 MOD = 0xFFFFFFFF + 1 
+U32_MASK = 0xFFFFFFFF
 
 # Delta constant for XTEA
 DELTA = 0x9E3779B9 
@@ -30,6 +34,23 @@ class xTEA:
     '''Represents the xTEA Cipher Algorithm class'''
     def __init__(self, key):
         self.key = key
+        self.keyschedule()
+
+    def keyschedule(self):
+        '''Precompute the per-round key+sum constants. Called during Initialization'''
+        k = struct.unpack('>LLLL', self.key)
+        self.f_constants = []
+        self.g_constants = []
+        sum_val = 0
+        for i in range(XTEA_NUM_ROUNDS):
+            sum_val = self.convert_to_u32(sum_val + DELTA)
+            # sum_val + k[sum_val & 3] (mod 2^32), for modifying v0
+            self.f_constants.append(self.convert_to_u32(sum_val + k[sum_val & 3]))
+            # sum_val + k[(sum_val >> 11) & 3] (mod 2^32), for modifying v1
+            self.g_constants.append(self.convert_to_u32(sum_val + k[(sum_val >> 11) & 3]))
+        # Pairs of constants in the order used by encryption and decryption
+        self.enc_constants = list(zip(self.f_constants, self.g_constants))
+        self.dec_constants = self.enc_constants[::-1]
 
     def convert_to_u32(self,val):
         """Ensures a value is represented as a positive 32-bit unsigned integer."""
@@ -38,66 +59,82 @@ class xTEA:
 
     def encrypt_xtea(self, data):
         """Encrypts a 64-bit data block using the XTEA algorithm."""
-        data = bytearray(data)
-        v0, v1 = struct.unpack('>LL', data)
-        k = struct.unpack('>LLLL', self.key)
-
-        sum_val = 0
+        v0, v1 = struct.unpack('>LL', bytes(data))
 
         # Encryption Rounds
-        for i in range(XTEA_NUM_ROUNDS):
-            # 1. Update Sum: sum_val += DELTA (mod 2^32)
-            sum_val = self.convert_to_u32(sum_val + DELTA)
-
-            # 2. Modify v0:
-            # F_key_select = k[sum_val & 3]
-            # F_inner = ((v1 << 4) ^ (v1 >> 5)) + v1 (all mod 2^32)
-            # F_term = F_inner ^ (sum_val + F_key_select) (mod 2^32)
-
-            # Note: (v1 << 4) ^ (v1 >> 5) is naturally 32-bit if v1 is
-            # We ensure it wraps using self.convert_to_u32
-            F_inner = self.convert_to_u32((v1 << 4) ^ (v1 >> 5) + v1)
-            F_term = self.convert_to_u32(F_inner ^ (sum_val + k[sum_val & 3]))
-
-            v0 = self.convert_to_u32(v0 + F_term)
+        for f_const, g_const in self.enc_constants:
+            # Modify v0: v0 += F_inner ^ (sum_val + k[sum_val & 3]) (mod 2^32)
+            # F_inner = (v1 << 4) ^ ((v1 >> 5) + v1), as in the reference rounds
+            # Masking once is enough, as addition mod 2^32 only depends on the low 32 bits
+            v0 = (v0 + (((v1 << 4) ^ ((v1 >> 5) + v1)) ^ f_const)) & U32_MASK
 
-            # 3. Modify v1:
-            # G_key_select = k[(sum_val >> 11) & 3]
-            # G_inner = ((v0 << 4) ^ (v0 >> 5)) + v0 (all mod 2^32)
-            # G_term = G_inner ^ (sum_val + G_key_select) (mod 2^32)
-
-            G_inner = self.convert_to_u32((v0 << 4) ^ (v0 >> 5) + v0)
-            G_term = self.convert_to_u32(G_inner ^ (sum_val + k[(sum_val >> 11) & 3]))
-
-            v1 = self.convert_to_u32(v1 + G_term)
+            # Modify v1: v1 += G_inner ^ (sum_val + k[(sum_val >> 11) & 3]) (mod 2^32)
+            v1 = (v1 + (((v0 << 4) ^ ((v0 >> 5) + v0)) ^ g_const)) & U32_MASK
 
         return struct.pack('>LL', v0, v1)
 
     def decrypt_xtea(self, data):
         """Decrypts a 64-bit data block using the XTEA algorithm."""
-        v0, v1 = struct.unpack('>LL', data)
-        k = struct.unpack('>LLLL', self.key)
-
-        # Initial Sum: sum_val starts at DELTA * XTEA_NUM_ROUNDS (mod 2^32)
-        sum_val = self.convert_to_u32(DELTA * XTEA_NUM_ROUNDS)
+        v0, v1 = struct.unpack('>LL', bytes(data))
 
         # Decryption Rounds (reverse order)
-        for i in range(XTEA_NUM_ROUNDS):
-            # 1. Reverse Modify v1 (using subtraction):
-            # We must use the 'sum_val' *before* decrementing it.
-            G_inner = self.convert_to_u32((v0 << 4) ^ (v0 >> 5) + v0)
-            G_term = self.convert_to_u32(G_inner ^ (sum_val + k[(sum_val >> 11) & 3]))
+        for f_const, g_const in self.dec_constants:
+            # Reverse Modify v1 (using subtraction), wraps around with the mask
+            v1 = (v1 - (((v0 << 4) ^ ((v0 >> 5) + v0)) ^ g_const)) & U32_MASK
+
+            # Reverse Modify v0 (using subtraction)
+            v0 = (v0 - (((v1 << 4) ^ ((v1 >> 5) + v1)) ^ f_const)) & U32_MASK
 
-            # The subtraction must correctly wrap around to 2^32-1, if the result is negatived
-            v1 = self.convert_to_u32(v1 - G_term)
+        return struct.pack('>LL', v0, v1)
+
+    def encrypt_blocks(self, v0, v1 = None):
+        '''Encrypts N blocks at once.
+           Takes two uint32 arrays (v0, v1) and returns the encrypted (v0, v1),
+           or a contiguous bytes buffer of N x 8 bytes and returns bytes'''
+        v0, v1, isbuffer = toblockwords(v0, v1)
+        for f_const, g_const in np.array(self.enc_constants, dtype=np.uint32):
+            # uint32 arithmetic wraps around mod 2^32
+            v0 = v0 + (((v1 << 4) ^ ((v1 >> 5) + v1)) ^ f_const)
+            v1 = v1 + (((v0 << 4) ^ ((v0 >> 5) + v0)) ^ g_const)
+        return fromblockwords(v0, v1, isbuffer)
+
+    def decrypt_blocks(self, v0, v1 = None):
+        '''Decrypts N blocks at once.
+           Takes two uint32 arrays (v0, v1) and returns the decrypted (v0, v1),
+           or a contiguous bytes buffer of N x 8 bytes and returns bytes'''
+        v0, v1, isbuffer = toblockwords(v0, v1)
+        for f_const, g_const in np.array(self.dec_constants, dtype=np.uint32):
+            v1 = v1 - (((v0 << 4) ^ ((v0 >> 5) + v0)) ^ g_const)
+            v0 = v0 - (((v1 << 4) ^ ((v1 >> 5) + v1)) ^ f_const)
+        return fromblockwords(v0, v1, isbuffer)
 
-            # 2. Reverse Modify v0 (using subtraction):
-            F_inner = self.convert_to_u32((v1 << 4) ^ (v1 >> 5) + v1)
-            F_term = self.convert_to_u32(F_inner ^ (sum_val + k[sum_val & 3]))
 
-            v0 = self.convert_to_u32(v0 - F_term)
+################################################################################
+# Functions
+################################################################################
+def toblockwords(v0, v1):
+    '''Convert the batch input to two uint32 word arrays.
+       A bytes buffer is unpacked big endian, as in the scalar path'''
+    if v1 is None:
+        if (len(v0) % 8):
+            raise ValueError("Buffer length must be a multiple of 8 bytes.")
+        words = np.frombuffer(v0, dtype=">u4").astype(np.uint32)
+        return words[0::2], words[1::2], True
+    return np.asarray(v0, dtype=np.uint32), np.asarray(v1, dtype=np.uint32), False
+
+def fromblockwords(v0, v1, isbuffer):
+    '''Convert the word arrays back to the type of the batch input'''
+    if (True == isbuffer):
+        words = np.empty(2 * len(v0), dtype=">u4")
+        words[0::2] = v0
+        words[1::2] = v1
+        return words.tobytes()
+    return v0, v1
 
-            # 3. Reverse Update Sum: sum_val -= DELTA (mod 2^32)
-            sum_val = self.convert_to_u32(sum_val - DELTA)
 
-        return struct.pack('>LL', v0, v1)
\ No newline at end of file
+################################################################################
+# Registration
+################################################################################
+registercipher(CipherInfo("xTEA", xTEA, XTEA_KEY,
+                          encrypt="encrypt_xtea", decrypt="decrypt_xtea",
+                          encrypt_blocks="encrypt_blocks", decrypt_blocks="decrypt_blocks"))
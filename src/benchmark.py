@@ -0,0 +1,292 @@
+"""
+This module is the entry point for the headless cipher micro-benchmark.
+
+It includes :
+    * Functions to time encryption, decryption and the Encryption Scheme
+      directly, without the CAN bus and the UI
+    * Command line interface, printing the results as JSON
+
+Usage: python3 src/benchmark.py [--frames N] [--algorithms RC4 SPECK ...]
+                                [--no-scheme] [--window SIZE] [--replay-window WIDTH]
+                                [--reorder DEPTH] [--cpu CORE] [--output FILE]
+
+"""
+################################################################################
+# Imports
+################################################################################
+import argparse
+import contextlib
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+import numpy as np
+import encrypt_decrypt.perform_encryption_decryption as encdec
+from encrypt_decrypt.perform_encryption_decryption import *
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of frames timed for each algorithm
+BENCHMARK_DEFAULT_FRAMES = 10_000
+
+# Frames run before timing, e.g. for tables created on first use
+BENCHMARK_WARMUP_FRAMES = 100
+
+# Number of times the key setup is timed for each algorithm
+BENCHMARK_KEYSETUP_REPEATS = 50
+
+# Default CAN message, same as in the UI
+BENCHMARK_CANID = 0xC0FFEE
+BENCHMARK_PAYLOAD = bytes([0xAA, 0xBB, 0xCC, 0xDD, 0xEE, 0xFF, 0x00, 0x11])
+
+# Algorithms that can be selected in the Encryption Scheme, same as in the UI
+BENCHMARK_NONCE_ALGORITHMS = ["SPECK", "xTEA"]
+BENCHMARK_KEYSTREAM_ALGORITHMS = ["xTEA", "SPECK"]
+BENCHMARK_MAC_ALGORITHMS = ["AES128-CMAC", "SHA256-HMAC"]
+
+# Payload bytes carried per frame with the Encryption Scheme (2 bytes are MAC)
+SCHEME_PAYLOAD_SIZE = 6
+
+
+################################################################################
+# Functions
+################################################################################
+def getstatistics(samples_ns, timerrecord = None):
+    '''Get the statistics of the per-frame samples in ns, and the mean without the timer bias'''
+    samples = np.array(samples_ns, dtype=np.float64)
+    mean_ns = float(np.mean(samples))
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "ns_per_frame" : round(mean_ns, 3),
+        "corrected_ns_per_frame" : round(correcttiming(mean_ns, timerrecord), 3),
+        "near_timer_floor" : isneartimerfloor(mean_ns, timerrecord),
+        "frames_per_s" : round(CONVERT_S_TO_NS / mean_ns, 3),
+        "p50_ns" : round(float(p50), 3),
+        "p95_ns" : round(float(p95), 3),
+        "p99_ns" : round(float(p99), 3),
+        "max_ns" : round(float(np.max(samples)), 3),
+        "jitter_ns" : round(float(np.std(samples)), 3)
+    }
+
+def addcyclesperbyte(results, frequency_mhz):
+    '''Add cycles/byte to the statistics of the results, for the measured frequency'''
+    for result in results:
+        for stats in (result["encrypt"], result["decrypt"]):
+            stats["cycles/byte"] = round(getcyclesperbyte(stats["ns_per_frame"], frequency_mhz,
+                                                          result["payload_bytes"]), 3)
+
+def getkeysetupstatistics(algo, repeats = BENCHMARK_KEYSETUP_REPEATS):
+    '''Time the key setup of the algorithm, i.e. creating its object with the key schedule'''
+    samples = np.array([createcipher(algo).key_setup_cost() for _ in range(repeats)], dtype=np.float64)
+    p50, p95 = np.percentile(samples, [50, 95])
+    return {
+        "mean_ns" : round(float(np.mean(samples)), 3),
+        "p50_ns" : round(float(p50), 3),
+        "p95_ns" : round(float(p95), 3),
+        "max_ns" : round(float(np.max(samples)), 3)
+    }
+
+def timeemptyframe():
+    '''Time the measured region of timeframes, for a call without work'''
+    outputs = []
+    starttime = time.perf_counter_ns()
+    outputs.append(emptyframe(None))
+    return time.perf_counter_ns() - starttime
+
+def timeframes(function, inputs, idle = None):
+    '''Call the function for each input, returns the outputs and the time per call in ns.
+       idle is called after each call, outside the timed region'''
+    outputs = []
+    samples = []
+    for data in inputs:
+        starttime = time.perf_counter_ns()
+        outputs.append(function(data))
+        samples.append(time.perf_counter_ns() - starttime)
+        if (None != idle):
+            idle()
+    return outputs, samples
+
+def benchmarkalgorithm(algo, frames, timerrecord = None):
+    '''Benchmark encryption and decryption of a single algorithm'''
+    setencryptionalgo(algo)
+    encobj = encdec.g_encryption
+    payloads = [BENCHMARK_PAYLOAD] * frames
+
+    # Warm up with a separate object, not the cached one, so that stream ciphers start at frame 0
+    warmup = createcipher(algo)
+    for _ in range(BENCHMARK_WARMUP_FRAMES):
+        warmup.decrypt(warmup.encrypt(BENCHMARK_PAYLOAD))
+
+    # Bound methods are timed, as the pre-bound frame functions of the simulation
+    ciphertexts, encsamples = timeframes(encobj.encrypt, payloads)
+    plaintexts, decsamples = timeframes(encobj.decrypt, ciphertexts)
+
+    return {
+        "name" : algo,
+        "backend" : encobj.capabilities()["backend"],
+        "key_setup" : getkeysetupstatistics(algo),
+        "verified" : all(bytes(plaintext) == BENCHMARK_PAYLOAD for plaintext in plaintexts),
+        "payload_bytes" : len(BENCHMARK_PAYLOAD),
+        "encrypt" : getstatistics(encsamples, timerrecord),
+        "decrypt" : getstatistics(decsamples, timerrecord)
+    }
+
+def schemedecrypt(data):
+    '''Receiver side of the Encryption Scheme, as done in perform_decryption'''
+    if (DECRYPT_OK == isMessageAccepted(True, data, BENCHMARK_CANID, True)):
+        return encryption_scheme_decrypt(data, BENCHMARK_CANID, True, encdec.g_acceptedcounter)
+    return None
+
+def receiveridle():
+    '''Move the receiver windows forward, as in the idle time of the receiver'''
+    for window in (encdec.g_receiverwindow, encdec.g_replaywindow):
+        if (None != window):
+            window.refill()
+
+def reorderframes(frames, depth):
+    '''Reverse the order of each group of depth frames, as received out of order'''
+    if (depth < 2):
+        return list(frames)
+    reordered = []
+    for offset in range(0, len(frames), depth):
+        reordered.extend(reversed(frames[offset:offset + depth]))
+    return reordered
+
+def benchmarkscheme(noncealgo, keystreamalgo, macalgo, frames, window = DECRYTPION_WINDOW,
+                    replaywindow = ANTI_REPLAY_WINDOW, reorder = 0, timerrecord = None):
+    '''Benchmark the Encryption Scheme for a combination of algorithms'''
+    initializeencryptionscheme(noncealgo, keystreamalgo, macalgo, BENCHMARK_CANID, window, replaywindow)
+    # Receiver is ready from the start, the sender starts one counter ahead
+    ready_event = threading.Event()
+    ready_event.set()
+    encdec.g_sendercounters.set(BENCHMARK_CANID, True, getreceivercounter(BENCHMARK_CANID) + 1)
+
+    payloads = [BENCHMARK_PAYLOAD] * frames
+    # Keystreams are precomputed between frames, as in the idle time of the sender
+    idle = None
+    if (None != encdec.g_senderlookahead):
+        idle = encdec.g_senderlookahead.refill
+    ciphertexts, encsamples = timeframes(lambda data: encryption_scheme_encrypt(data, ready_event, BENCHMARK_CANID, True),
+                                         payloads, idle)
+    # Receiver windows are moved forward between frames, as in the idle time of the receiver
+    plaintexts, decsamples = timeframes(schemedecrypt, reorderframes(ciphertexts, reorder), receiveridle)
+    accepted = [plaintext for plaintext in plaintexts if None != plaintext]
+
+    result = {
+        "name" : "ENCRYPTION_SCHEME",
+        "nonce" : noncealgo,
+        "keystream" : keystreamalgo,
+        "mac" : macalgo,
+        "key_setup" : {
+            "nonce" : getkeysetupstatistics(noncealgo),
+            "keystream" : getkeysetupstatistics(keystreamalgo),
+            "mac" : getkeysetupstatistics(macalgo)
+        },
+        "accepted_frames" : len(accepted),
+        "lookahead" : getlookaheadstatistics(),
+        "receiver_window" : getreceiverwindowstatistics(),
+        "acceptance" : getacceptancestatistics(),
+        "verified" : all(bytes(plaintext) == BENCHMARK_PAYLOAD[0:SCHEME_PAYLOAD_SIZE] for plaintext in accepted),
+        "payload_bytes" : SCHEME_PAYLOAD_SIZE,
+        "encrypt" : getstatistics(encsamples, timerrecord),
+        "decrypt" : getstatistics(decsamples, timerrecord)
+    }
+    deinitencryptionscheme()
+    return result
+
+def runbenchmark(algorithms, frames, withscheme, window = DECRYTPION_WINDOW,
+                 replaywindow = ANTI_REPLAY_WINDOW, reorder = 0, timerrecord = None):
+    '''Run the benchmark for all the algorithms and Encryption Scheme combinations'''
+    results = []
+    # Prints on the hot paths are not part of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for algo in algorithms:
+            results.append(benchmarkalgorithm(algo, frames, timerrecord))
+        if (True == withscheme):
+            for noncealgo in BENCHMARK_NONCE_ALGORITHMS:
+                for keystreamalgo in BENCHMARK_KEYSTREAM_ALGORITHMS:
+                    for macalgo in BENCHMARK_MAC_ALGORITHMS:
+                        results.append(benchmarkscheme(noncealgo, keystreamalgo, macalgo, frames,
+                                                       window, replaywindow, reorder, timerrecord))
+    return results
+
+def parsearguments(argv):
+    '''Parse the command line arguments'''
+    parser = argparse.ArgumentParser(description="Headless cipher micro-benchmark, without CAN bus and UI")
+    parser.add_argument("--frames", type=int, default=BENCHMARK_DEFAULT_FRAMES,
+                        help="number of frames timed for each algorithm")
+    parser.add_argument("--algorithms", nargs="+", default=ENCRYPTION_ALGORITHMS,
+                        choices=ENCRYPTION_ALGORITHMS, help="algorithms to benchmark")
+    parser.add_argument("--no-scheme", action="store_true",
+                        help="skip the Encryption Scheme combinations")
+    parser.add_argument("--window", type=int, default=DECRYTPION_WINDOW,
+                        choices=range(DECRYPTION_WINDOW_MIN, DECRYPTION_WINDOW_MAX + 1), metavar="SIZE",
+                        help="verification window of the Encryption Scheme receiver")
+    parser.add_argument("--replay-window", type=int, default=ANTI_REPLAY_WINDOW, metavar="WIDTH",
+                        help="anti-replay window of the Encryption Scheme receiver, 0 to disable")
+    parser.add_argument("--reorder", type=int, default=0, metavar="DEPTH",
+                        help="receive the Encryption Scheme frames in reversed groups of DEPTH frames")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="calibrate the backends of all the algorithms again, ignoring the cached selection")
+    parser.add_argument("--cpu", type=int, default=None,
+                        help="pin the benchmark to this core")
+    parser.add_argument("--output", default=None,
+                        help="write the JSON report to this file, instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    '''Run the benchmark and print the JSON report'''
+    args = parsearguments(argv)
+    if (0 != args.replay_window):
+        checkreplaywindow(args.replay_window)
+    if (None != args.cpu):
+        os.sched_setaffinity(0, [args.cpu])
+    # Backends are calibrated on the core running the benchmark
+    calibrateallbackends(args.calibrate)
+
+    # Frequency of the core running the benchmark, measured at start and end
+    clock = ClockCalibration(min(os.sched_getaffinity(0)))
+    clock.start()
+    # Cost of the timer and the call in the timed region, subtracted from the corrected timings
+    timer = TimerCalibration()
+    timer.calibrate(timeemptyframe)
+    results = runbenchmark(args.algorithms, args.frames, not args.no_scheme, args.window,
+                           args.replay_window, args.reorder, timer.getrecord())
+    clock.stop()
+    addcyclesperbyte(results, clock.getfrequency())
+    if (True == clock.isdrifted()):
+        print(f"[Warning] Frequency of core {clock.core} drifted by "
+              f"{100 * clock.getdrift():.1f}% during the benchmark", file=sys.stderr)
+
+    report = {
+        "host" : socket.gethostname(),
+        "platform" : platform.platform(),
+        "python" : platform.python_version(),
+        "frames" : args.frames,
+        "window" : args.window,
+        "replay_window" : args.replay_window,
+        "reorder" : args.reorder,
+        "clock" : clock.getrecord(),
+        "timer" : timer.getrecord(),
+        "cipher_cache" : getciphercachestatistics(),
+        "results" : results
+    }
+
+    output = json.dumps(report, indent=4)
+    if (None != args.output):
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,107 @@
+"""
+This module provides the freshness counters of the Encryption Scheme, per CAN ID.
+
+It includes :
+    * Class with the counters of one direction (sender or receiver) in shared
+      memory, direct-mapped for 11-bit IDs and hashed for 29-bit IDs
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+from multiprocessing.sharedctypes import RawArray
+
+
+################################################################################
+# Macros
+################################################################################
+# Initial value of the counter of each CAN ID
+FRESHNESS_COUNTER_INIT = 1
+
+# Counters are sent as 4 bytes in the Nonce and MAC input
+FRESHNESS_COUNTER_MASK = 0xFFFFFFFF
+
+# Number of 11-bit (standard) CAN IDs, direct-mapped
+FRESHNESS_STANDARD_IDS = 1 << 11
+
+# Largest 29-bit (extended) CAN ID
+FRESHNESS_EXTENDED_ID_MAX = (1 << 29) - 1
+
+# Number of slots for 29-bit CAN IDs, must be a power of 2
+# This is the number of different extended IDs that can have a counter
+FRESHNESS_EXTENDED_SLOTS = 1 << 14
+
+# Multiplier for hashing the 29-bit CAN IDs to a slot (Fibonacci hashing)
+FRESHNESS_HASH_MULTIPLIER = 0x9E3779B1
+
+
+################################################################################
+# Classes
+################################################################################
+class FreshnessCounters:
+    '''Represents the freshness counters of one direction, per CAN ID.
+       Counters are in shared memory without a lock, with a single writer:
+       the sender writes the sender counters, the receiver the receiver counters.
+       Other processes (e.g. UI) only read them'''
+    def __init__(self, initialvalue = FRESHNESS_COUNTER_INIT,
+                 extendedslots = FRESHNESS_EXTENDED_SLOTS):
+        self.initialvalue = initialvalue
+        self.extendedslots = extendedslots
+        self.hashshift = 32 - (extendedslots.bit_length() - 1)
+        # Counter of each 11-bit CAN ID, indexed by the ID
+        self.standard = RawArray(ctypes.c_uint32, [initialvalue] * FRESHNESS_STANDARD_IDS)
+        # Index of the 29-bit CAN IDs, slot holds CAN ID + 1, 0 if the slot is free
+        self.extendedids = RawArray(ctypes.c_uint32, extendedslots)
+        self.extended = RawArray(ctypes.c_uint32, extendedslots)
+        # Slots found by this process, CAN ID -> slot. Slots never move, as IDs are never removed
+        self.slotcache = {}
+
+    def lookup(self, canid, isextended):
+        '''Get the counter array and the slot of the CAN ID.
+           For a 29-bit CAN ID without a counter, the slot is the free slot for it'''
+        if (False == isextended):
+            if (canid >= FRESHNESS_STANDARD_IDS):
+                raise ValueError("CAN ID " + hex(canid) + " is not an 11-bit ID")
+            return self.standard, canid, True
+
+        slot = self.slotcache.get(canid)
+        if (None != slot):
+            return self.extended, slot, True
+        if (canid > FRESHNESS_EXTENDED_ID_MAX):
+            raise ValueError("CAN ID " + hex(canid) + " is not a 29-bit ID")
+        tag = canid + 1
+        slot = ((canid * FRESHNESS_HASH_MULTIPLIER) & 0xFFFFFFFF) >> self.hashshift
+        # Linear probing, IDs are never removed
+        for _ in range(self.extendedslots):
+            current = self.extendedids[slot]
+            if (tag == current):
+                self.slotcache[canid] = slot
+                return self.extended, slot, True
+            if (0 == current):
+                return self.extended, slot, False
+            slot = (slot + 1) & (self.extendedslots - 1)
+        raise ValueError("No free slot for CAN ID " + hex(canid))
+
+    def getslot(self, canid, isextended):
+        '''Get the counter array and the slot of the CAN ID, adding the ID if needed.
+           Only to be called by the writer'''
+        counters, slot, found = self.lookup(canid, isextended)
+        if (False == found):
+            # Counter is written before the ID, so that readers never see the ID without it
+            counters[slot] = self.initialvalue
+            self.extendedids[slot] = canid + 1
+            self.slotcache[canid] = slot
+        return counters, slot
+
+    def get(self, canid, isextended):
+        '''Get the counter of the CAN ID'''
+        counters, slot, found = self.lookup(canid, isextended)
+        if (False == found):
+            return self.initialvalue
+        return counters[slot]
+
+    def set(self, canid, isextended, value):
+        '''Set the counter of the CAN ID. Only to be called by the writer'''
+        counters, slot = self.getslot(canid, isextended)
+        counters[slot] = value & FRESHNESS_COUNTER_MASK
@@ -0,0 +1,166 @@
+"""
+This module provides the precomputation of the Encryption Scheme keystreams.
+
+It includes :
+    * Class buffering the keystreams of the next counters of each CAN ID,
+      filled ahead of time, with hit/miss statistics in shared memory
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawArray
+from encrypt_decrypt.freshness_counters import FRESHNESS_COUNTER_MASK
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of counters buffered ahead, for each CAN ID
+KEYSTREAM_LOOKAHEAD_DEPTH = 16
+
+# Smallest number of keystreams computed through the batch interface,
+# fewer are computed one by one, as the batch call has a fixed overhead
+KEYSTREAM_BATCH_MIN = 16
+
+# Index of the statistics in the shared array
+LOOKAHEAD_STAT_HITS = 0
+LOOKAHEAD_STAT_MISSES = 1
+# Time spent on the hot path, for hits and misses
+LOOKAHEAD_STAT_HIT_NS = 2
+LOOKAHEAD_STAT_MISS_NS = 3
+# Keystreams precomputed ahead of time, and the time spent on them
+LOOKAHEAD_STAT_FILLED = 4
+LOOKAHEAD_STAT_FILL_NS = 5
+LOOKAHEAD_STAT_COUNT = 6
+
+
+################################################################################
+# Classes
+################################################################################
+class KeystreamLookahead:
+    '''Represents the buffer of precomputed keystreams, per CAN ID.
+       Keystream of a counter is S = encrypt(K2, encrypt(K1, CAN_ID || counter)),
+       it does not depend on the payload. Buffers are local to the process
+       using them, statistics are in shared memory for the other processes'''
+    def __init__(self, noncecipher, keystreamcipher, depth = KEYSTREAM_LOOKAHEAD_DEPTH, keep = 0):
+        self.noncecipher = noncecipher
+        self.keystreamcipher = keystreamcipher
+        self.nonceencrypt = noncecipher.encrypt
+        self.keystreamencrypt = keystreamcipher.encrypt
+        self.depth = depth
+        # Number of counters before the requested one, whose keystreams are kept (e.g. for late frames)
+        self.keep = keep
+        # CAN ID -> {counter -> keystream}
+        self.buffers = {}
+        # CAN ID -> last counter requested
+        self.requested = {}
+        # CAN ID -> oldest counter that can be in the buffer
+        self.oldest = {}
+        self.statistics = RawArray(ctypes.c_double, LOOKAHEAD_STAT_COUNT)
+
+    def compute(self, canid, counter):
+        '''Compute the keystream of the counter'''
+        nonceinput = canid.to_bytes(4,'big') + counter.to_bytes(4,'big')
+        return self.keystreamencrypt(self.nonceencrypt(nonceinput))
+
+    def get(self, canid, counter):
+        '''Get the keystream of the counter, computed inline if not buffered'''
+        starttime = time.perf_counter_ns()
+        buffer = self.buffers.get(canid)
+        if (None == buffer):
+            buffer = self.buffers[canid] = {}
+        keystream = buffer.get(counter)
+        self.requested[canid] = counter
+        if (None != keystream):
+            self.statistics[LOOKAHEAD_STAT_HITS] += 1
+            self.statistics[LOOKAHEAD_STAT_HIT_NS] += time.perf_counter_ns() - starttime
+            return keystream
+
+        keystream = self.compute(canid, counter)
+        self.statistics[LOOKAHEAD_STAT_MISSES] += 1
+        self.statistics[LOOKAHEAD_STAT_MISS_NS] += time.perf_counter_ns() - starttime
+        return keystream
+
+    def getlate(self, canid, counter):
+        '''Get the keystream of a counter before the last requested one, if kept in the buffer.
+           Computed inline otherwise. The last requested counter is not changed'''
+        starttime = time.perf_counter_ns()
+        keystream = self.buffers.get(canid, {}).get(counter)
+        if (None != keystream):
+            self.statistics[LOOKAHEAD_STAT_HITS] += 1
+            self.statistics[LOOKAHEAD_STAT_HIT_NS] += time.perf_counter_ns() - starttime
+            return keystream
+
+        keystream = self.compute(canid, counter)
+        self.statistics[LOOKAHEAD_STAT_MISSES] += 1
+        self.statistics[LOOKAHEAD_STAT_MISS_NS] += time.perf_counter_ns() - starttime
+        return keystream
+
+    def prime(self, canid, counter):
+        '''Precompute the keystreams of the CAN ID from the counter on, e.g. before the first frame'''
+        self.buffers.setdefault(canid, {})
+        self.requested[canid] = counter
+        self.refill()
+
+    def refill(self):
+        '''Precompute the keystreams of the next counters of each CAN ID, e.g. in idle time.
+           Keystreams of counters already used are dropped, except the last keep counters'''
+        for canid, buffer in self.buffers.items():
+            counter = self.requested[canid]
+            oldest = max(counter - self.keep, 0)
+            previous = self.oldest.get(canid)
+            if ((None != previous) and (0 <= (oldest - previous) <= len(buffer))):
+                # Only the counters the window moved past are dropped
+                for oldcounter in range(previous, oldest):
+                    buffer.pop(oldcounter, None)
+            else:
+                for oldcounter in [each for each in buffer if each < oldest]:
+                    del buffer[oldcounter]
+            self.oldest[canid] = oldest
+            counters = [each for each in ((counter + offset) & FRESHNESS_COUNTER_MASK
+                                          for offset in range(self.depth))
+                        if each not in buffer]
+            if (len(counters) == 0):
+                continue
+            starttime = time.perf_counter_ns()
+            if (len(counters) >= KEYSTREAM_BATCH_MIN):
+                nonces = self.noncecipher.encrypt_batch([canid.to_bytes(4,'big') + each.to_bytes(4,'big')
+                                                         for each in counters])
+                keystreams = self.keystreamcipher.encrypt_batch(nonces)
+                buffer.update(zip(counters, keystreams))
+            else:
+                for each in counters:
+                    buffer[each] = self.compute(canid, each)
+            self.statistics[LOOKAHEAD_STAT_FILLED] += len(counters)
+            self.statistics[LOOKAHEAD_STAT_FILL_NS] += time.perf_counter_ns() - starttime
+
+    def resetstatistics(self):
+        '''Reset the statistics, e.g. at the start of a run'''
+        for index in range(LOOKAHEAD_STAT_COUNT):
+            self.statistics[index] = 0
+
+    def getstatistics(self):
+        '''Get the hit and miss rates, and the latency saved by the precomputation'''
+        hits = self.statistics[LOOKAHEAD_STAT_HITS]
+        misses = self.statistics[LOOKAHEAD_STAT_MISSES]
+        filled = self.statistics[LOOKAHEAD_STAT_FILLED]
+        requests = hits + misses
+        hit_ns = (self.statistics[LOOKAHEAD_STAT_HIT_NS] / hits) if (hits > 0) else 0
+        # Cost of computing a keystream, inline on misses and ahead of time
+        compute_ns = 0
+        if ((misses + filled) > 0):
+            compute_ns = ((self.statistics[LOOKAHEAD_STAT_MISS_NS] + self.statistics[LOOKAHEAD_STAT_FILL_NS])
+                          / (misses + filled))
+        return {
+            "hits" : int(hits),
+            "misses" : int(misses),
+            "hit_rate" : (hits / requests) if (requests > 0) else 0,
+            "miss_rate" : (misses / requests) if (requests > 0) else 0,
+            "hit_ns" : hit_ns,
+            "compute_ns" : compute_ns,
+            # Time taken off the hot path, per frame
+            "saved_ns_per_frame" : ((hits * max(compute_ns - hit_ns, 0)) / requests) if (requests > 0) else 0
+        }
@@ -17,10 +17,23 @@ from Crypto_Algorithms.PRESENT import *
 from Crypto_Algorithms.xTEA import *
 from Crypto_Algorithms.AES_Cipher import *
 from Crypto_Algorithms.SHA_Cipher import *
+from Crypto_Algorithms.cipher_registry import *
+from Crypto_Algorithms.backend_calibration import *
+from perf_metrics.clock_calibration import *
+from perf_metrics.sample_ring import *
+from perf_metrics.cpu_accounting import *
+from perf_metrics.timer_calibration import *
+from perf_metrics.frame_tracing import *
+from perf_metrics.bus_latency import *
+from encrypt_decrypt.freshness_counters import *
+from encrypt_decrypt.keystream_lookahead import *
+from encrypt_decrypt.receiver_window import *
+from encrypt_decrypt.replay_window import *
+from node_logging.binary_log import *
 import numpy as np
 import psutil, os
 import multiprocessing
-from multiprocessing import Process, Value, Manager
+from multiprocessing import Process, Value
 from icecream import ic
 
 
@@ -28,11 +41,6 @@ from icecream import ic
 ################################################################################
 # Macros
 ################################################################################
-# cpu frequency for calculating the cpu cycles required per byte
-# this value has been fetched from cpuinfo file in process
-#cat /proc/cpuinfo | grep "MHz"
-CPU_FREQ_MHZ = 2592.008
-
 # Enums for Can message accepted or not
 DECRYPT_OK = 1
 DECRYPT_NOT_OK = 0
@@ -42,13 +50,25 @@ CONVERT_S_TO_NS = 1_000_000_000
 CONVERT_NS_TO_S = 1/ 1_000_000_000
 CONVERT_NS_TO_MS = 1/ 1_000_000
 
+# Log events of the Encryption Scheme, written by the nodes
+LOG_EVENT_SENDER_COUNTER = registerlogevent("g_sendercounter = {arg0}")
+LOG_EVENT_RECEIVER_COUNTER = registerlogevent("g_receivercounter= {arg0}")
+
 #Encryption Algorithms
 ENCRYPTION_ALGORITHMS = ["RC4", "SPECK", "xTEA", "PRESENT", "AES128"]
 BENCHMARKPERIOD = [100, 50, 20, 10, 5]
 
 # For Encryption State
+# Default number of counters after the receiver counter that are accepted,
+# configurable from DECRYPTION_WINDOW_MIN to DECRYPTION_WINDOW_MAX
 DECRYTPION_WINDOW = 2
 
+# Precompute the sender keystreams of the next counters in idle time
+KEYSTREAM_LOOKAHEAD_MODE = True
+
+# Precompute the receiver MAC states and keystreams of the verification window
+RECEIVER_WINDOW_MODE = True
+
 BENCHMARK_MESSAGE_COUNT=200
 REPLAY_MESSAGE_COUNT = 500
 
@@ -61,6 +81,10 @@ g_encryptionalgo = "RC4"
 #Encryption Class Object
 g_encryption = None
 
+# Pre-bound encryption and decryption functions of the selected algorithm
+g_encryptframe = None
+g_decryptframe = None
+
 #Global objects for Encryption Scheme
 g_noncecreation = None
 g_keystreamgen = None
@@ -70,76 +94,67 @@ g_noncealgo = None
 g_keystreamalgo = None 
 g_macgenalgo = None
 
+# Pre-bound functions of the Encryption Scheme objects
+g_nonceencrypt = None
+g_keystreamencrypt = None
+g_macgenerate = None
+g_macverify = None
+
 g_canid = 0
 
-g_sendercounter = 0
-g_receivercounter = 0
+# Freshness counters per CAN ID, written only by the sender and the receiver respectively
+g_sendercounters = None
+g_receivercounters = None
+
+# Precomputed sender keystreams, None if disabled
+g_senderlookahead = None
+
+# Verification window of the receiver, and its precomputed candidates (None if disabled)
+g_decryptionwindow = DECRYTPION_WINDOW
+g_receiverwindow = None
 
-sender_processid = 0
-receiver_processid = 0
+# Anti-replay window of the receiver (None if disabled), and the acceptance statistics
+g_replaywindow = None
+g_acceptancestatistics = None
+# Counter of the last frame accepted by the receiver
+g_acceptedcounter = None
+
+# Cpu accounting of the sender and receiver nodes, None if not initialized
+g_sendercpu = None
+g_receivercpu = None
+
+# Timer calibration of the sender and receiver nodes, None if not initialized
+g_sendertimer = None
+g_receivertimer = None
+
+# End-to-end latency of the frames over the bus, None if not initialized
+g_buslatency = None
 
 ################################################################################
 # Functions
 ################################################################################
-def encrypt(algo, encobj, data): 
-    '''Function to encrypt data based on the algorithm'''
-    if("RC4" == algo):
-        data = encobj.rc4encrypt(data)
-    elif("SPECK" == algo):
-        data = encobj.speckencrypt(data)
-    elif("PRESENT" == algo):
-        data = encobj.presentencrypt(data)
-    elif("xTEA" == algo):
-        data = encobj.encrypt_xtea(data)
-    elif("AES128" == algo):
-        data = encobj.aesencrypt(data)
-    else:
-        pass
+def passthrough(data):
+    '''Used as encryption and decryption function, if no algorithm is selected'''
     return data
 
-def decrypt(algo, encobj, data): 
-    '''Function to decrypt data based on the algorithm'''
-    if("RC4" == algo):
-        data = encobj.rc4decrypt(data)
-    elif("SPECK" == algo):
-        data = encobj.speckdecrypt(data)
-    elif("PRESENT" == algo):
-        data = encobj.presentdecrypt(data)
-    elif("xTEA" == algo):
-        data = encobj.decrypt_xtea(data)
-    elif("AES128" == algo):
-        data = encobj.aesdecrypt(data)
-    else:
-        pass
-    return data
-
-def generatemac(algo, encobj, data):
-    '''Function to generate the MAC'''
-    if("AES128-CMAC" == algo):
-        mac = encobj.generate_cmac_aes128(data, 2)
-    elif("SHA256-HMAC" == algo):
-        mac = encobj.generate_hmac_sha256(data, 2)
-    return mac
-
-def verifymac(algo, encobj, data, mac):
-    '''Function to verify the MAC received'''
-    if("AES128-CMAC" == algo):
-        result = encobj.verify_cmac_aes128(data, 2, mac)
-    elif("SHA256-HMAC" == algo):
-        result = encobj.verify_hmac_sha256(data, 2, mac)
-    return result
-
-def encryption_scheme_encrypt(data, ready_event):
+def encryption_scheme_encrypt(data, ready_event, canid, isextended = True):
     '''Function to encrypt the CAN message with Encryption Scheme'''
-    global g_canid, g_keystreamgen, g_noncecreation, g_macgeneration
-    global g_noncealgo, g_keystreamalgo, g_macgenalgo, g_sendercounter
+    global g_nonceencrypt, g_keystreamencrypt, g_macgenerate
+    global g_sendercounters, g_senderlookahead
     
-    #Append the counter and CANID to create input for Nonce creation
-    sender_nonceinput = g_canid.to_bytes(4,'big') + g_sendercounter.value.to_bytes(4,'big')
-    #Encrypt this Nonce using Nonce-encrytpion Algorithm
-    sender_Nonce = encrypt(g_noncealgo, g_noncecreation, sender_nonceinput)
-    # Generate Keystream with this Nonce
-    sender_S = encrypt(g_keystreamalgo, g_keystreamgen, sender_Nonce)
+    # Counter of the CAN ID
+    counters, slot = g_sendercounters.getslot(canid, isextended)
+    counter = counters[slot]
+    if (None != g_senderlookahead):
+        # Keystream precomputed in idle time, computed inline on a miss
+        sender_S = g_senderlookahead.get(canid, counter)
+    else:
+        #Append the counter and CANID to create input for Nonce creation
+        sender_nonceinput = canid.to_bytes(4,'big') + counter.to_bytes(4,'big')
+        #Encrypt this Nonce using Nonce-encrytpion Algorithm
+        sender_Nonce = g_nonceencrypt(sender_nonceinput)
+        # Generate Keystream with this Nonce
+        sender_S = g_keystreamencrypt(sender_Nonce)
     #Encrypted Payload
     C = []
     for byte_a, byte_b in zip(data[0:6], sender_S):
@@ -148,29 +163,37 @@ def encryption_scheme_encrypt(data, ready_event):
     C = bytes(C)
 
     #Perform MAC generation
-    sender_macinput = g_canid.to_bytes(4,'big') + g_sendercounter.value.to_bytes(4,'big') + C
-    sender_mac = generatemac(g_macgenalgo, g_macgeneration, sender_macinput)
+    sender_macinput = canid.to_bytes(4,'big') + counter.to_bytes(4,'big') + C
+    sender_mac = g_macgenerate(sender_macinput)
 
     can_payload = sender_mac + C
 
     #Increment the counter, only if the Receiver event is set, to sync between sender and receiver
     if(True == ready_event.is_set()): 
-        g_sendercounter.value += 1
-        print("g_sendercounter = ", g_sendercounter.value)
+        counters[slot] = (counter + 1) & FRESHNESS_COUNTER_MASK
+        g_logger.debug(LOG_EVENT_SENDER_COUNTER, counters[slot])
     return can_payload
 
-def encryption_scheme_decrypt(data, canid):
-    '''Function to decrypt the CAN message applied with Encryption Scheme'''
-    global g_receivercounter
+def encryption_scheme_decrypt(data, canid, isextended = True, counter = None):
+    '''Function to decrypt the CAN message applied with Encryption Scheme.
+       counter is the counter accepted for the message, the receiver counter by default'''
+    global g_receivercounters, g_nonceencrypt, g_keystreamencrypt, g_receiverwindow
 
-    print("g_receivercounter= ", g_receivercounter.value)
+    # Counter of the CAN ID, as accepted by isMessageAccepted
+    if (None == counter):
+        counter = g_receivercounters.get(canid, isextended)
+    g_logger.debug(LOG_EVENT_RECEIVER_COUNTER, counter)
 
-    #Append the counter and CANID to create input for Nonce creation
-    recv_nonceinput = canid.to_bytes(4,'big') + g_receivercounter.value.to_bytes(4,'big')
-    #Encrypt this Nonce using Nonce-encrytpion Algorithm
-    recv_Nonce = encrypt(g_noncealgo, g_noncecreation, recv_nonceinput)
-    # Generate Keystream with this Nonce
-    recv_S = encrypt(g_keystreamalgo, g_keystreamgen, recv_Nonce)
+    if (None != g_receiverwindow):
+        # Keystream precomputed with the verification window
+        recv_S = g_receiverwindow.getkeystream(canid, counter)
+    else:
+        #Append the counter and CANID to create input for Nonce creation
+        recv_nonceinput = canid.to_bytes(4,'big') + counter.to_bytes(4,'big')
+        #Encrypt this Nonce using Nonce-encrytpion Algorithm
+        recv_Nonce = g_nonceencrypt(recv_nonceinput)
+        # Generate Keystream with this Nonce
+        recv_S = g_keystreamencrypt(recv_Nonce)
     #Encrypted Payload
     P = []
     for byte_a, byte_b in zip(data[2:8], recv_S):
@@ -183,12 +206,11 @@ def perform_encryption(data, encrypt_samples, encrypt_cpuper,
                        encscheme_state, canid, isextended, ready_event
                        ):
     ''' Perfrom encryption using the selected Algorithm'''
-    global sender_processid
+    global g_sendercpu
     # Start Measurement
     encryptiontime = 0
-    sender_processid = psutil.Process(os.getpid())
-    # For Cpu Percentage Calculation. Initial call of cpu_percent is for setting the baseline
-    cpupercent_b = sender_processid.cpu_percent(interval=None)
+    # For Cpu Percentage Calculation. Cpu time of the thread at the start of the frame
+    cpustart = g_sendercpu.begin()
     encryptionstarttime = time.perf_counter_ns()
     
     #Implementation pending for other algorithms
@@ -197,45 +219,111 @@ def perform_encryption(data, encrypt_samples, encrypt_cpuper,
     
     # if Encryption Scheme enabled
     if(True == encscheme_state.get()):
-        data = encryption_scheme_encrypt(data, ready_event)
+        data = encryption_scheme_encrypt(data, ready_event, canid, isextended)
     else:
-        data = encrypt(g_encryptionalgo, g_encryption, data)
+        data = g_encryptframe(data)
     # Stop Measurement
     encryptionendtime = time.perf_counter_ns()
-    # Get the cpu percentage
-    cpupercent_a = sender_processid.cpu_percent(interval=None)
+    g_tracer.span(TRACE_SPAN_ENCRYPT, encryptionstarttime, encryptionendtime)
+    # Get the cpu percentage of the frame, over the period since the previous frame
+    cpupercent = g_sendercpu.end(cpustart, encryptionstarttime, encryptionendtime)
     
-    # Storing the encryption cpu percent into the encrypt_cpuper shared variables
-    enccpupers = encrypt_cpuper[g_encryptionalgo]
-    enccpupers.append((cpupercent_a)/psutil.cpu_count())
-    encrypt_cpuper[g_encryptionalgo] = enccpupers
+    # Storing the encryption cpu percent into the encrypt_cpuper shared ring buffers
+    if (None != cpupercent):
+        encrypt_cpuper[g_encryptionalgo].append(cpupercent)
     
     #Time taken for encryption
     encryptiontime = (encryptionendtime - encryptionstarttime) / us_DURATION
     
-    # Storing the encryption times into the encrypt_samples shared variables
-    enctimes = encrypt_samples[g_encryptionalgo]
-    enctimes.append(encryptiontime)
-    encrypt_samples[g_encryptionalgo] = enctimes
+    # Storing the encryption times into the encrypt_samples shared ring buffers
+    encrypt_samples[g_encryptionalgo].append(encryptiontime)
 
     
     return data, encryptiontime
 
-def isMessageAccepted(encstate, data, canid):
+def precomputekeystreams(encscheme_state):
+    '''Called by the sender in idle time, to precompute the keystreams of the next counters'''
+    if ((True == encscheme_state.get()) and (None != g_senderlookahead)):
+        g_senderlookahead.refill()
+
+def precomputereceiverwindow(encscheme_state):
+    '''Called by the receiver in idle time, to move the verification and anti-replay windows forward'''
+    if (True == encscheme_state.get()):
+        if (None != g_receiverwindow):
+            g_receiverwindow.refill()
+        if (None != g_replaywindow):
+            g_replaywindow.refill()
+
+def resetlookaheadstatistics():
+    '''Reset the statistics of the precomputed keystreams, windows and acceptance, e.g. at the start of a run'''
+    if (None != g_senderlookahead):
+        g_senderlookahead.resetstatistics()
+    if (None != g_receiverwindow):
+        g_receiverwindow.resetstatistics()
+    if (None != g_acceptancestatistics):
+        g_acceptancestatistics.resetstatistics()
+
+def getlookaheadstatistics():
+    '''Get the hit and miss rates of the precomputed keystreams, None if disabled'''
+    if (None == g_senderlookahead):
+        return None
+    return g_senderlookahead.getstatistics()
+
+def getreceiverwindowstatistics():
+    '''Get the statistics of the receiver verification window, None if disabled'''
+    if (None == g_receiverwindow):
+        return None
+    return g_receiverwindow.getstatistics()
+
+def getacceptancestatistics():
+    '''Get the MAC verification attempts per accepted frame of the receiver, None if not initialized'''
+    if (None == g_acceptancestatistics):
+        return None
+    return g_acceptancestatistics.getstatistics()
+
+def verifycandidates(canid, receivercounter, data):
+    '''Verify the MAC of the CAN message against the counters after the receiver counter.
+       Returns the accepted counter, None if the message is rejected'''
+    global g_macverify, g_receiverwindow, g_decryptionwindow, g_acceptancestatistics
+
+    if (None != g_receiverwindow):
+        # Verify against all the precomputed candidates at once
+        g_acceptancestatistics.add(ACCEPTANCE_STAT_ATTEMPTS, g_receiverwindow.size)
+        return g_receiverwindow.accept(canid, receivercounter, data)
+
+    countercandidate = receivercounter + 1
+    while (countercandidate <= receivercounter + g_decryptionwindow):
+        #Perform MAC verification
+        receiver_macinput = canid.to_bytes(4,'big') + (countercandidate & FRESHNESS_COUNTER_MASK).to_bytes(4,'big') + data[2:]
+        g_acceptancestatistics.add(ACCEPTANCE_STAT_ATTEMPTS)
+        if(DECRYPT_OK == g_macverify(receiver_macinput, data[0:2])):
+            return countercandidate & FRESHNESS_COUNTER_MASK
+        countercandidate += 1
+    return None
+
+def isMessageAccepted(encstate, data, canid, isextended = True):
     '''Function returns if the received CAN message is accepted or not'''
-    global g_macgeneration, g_macgenalgo, g_receivercounter
+    global g_receivercounters, g_replaywindow, g_decryptionwindow
+    global g_acceptancestatistics, g_acceptedcounter
 
     verificationstatus = DECRYPT_NOT_OK
     if(True == encstate):
-        countercandidate = g_receivercounter.value + 1
-        while (countercandidate <= g_receivercounter.value + DECRYTPION_WINDOW):
-            #Perform MAC verification
-            receiver_macinput = canid.to_bytes(4,'big') + countercandidate.to_bytes(4,'big') + data[2:]
-            verificationstatus = verifymac(g_macgenalgo, g_macgeneration, receiver_macinput, data[0:2])
-            if(DECRYPT_OK == verificationstatus):
-                g_receivercounter.value = countercandidate
-                break
-            countercandidate += 1
+        # Counter of the CAN ID
+        counters, slot = g_receivercounters.getslot(canid, isextended)
+        receivercounter = counters[slot]
+        if (None != g_replaywindow):
+            # Late frames of the anti-replay window are accepted too, duplicates are rejected
+            countercandidate = g_replaywindow.accept(canid, receivercounter, data, verifycandidates)
+        else:
+            countercandidate = verifycandidates(canid, receivercounter, data)
+        g_acceptancestatistics.add(ACCEPTANCE_STAT_FRAMES)
+        if (None != countercandidate):
+            g_acceptedcounter = countercandidate
+            # Receiver counter is the highest accepted counter, it is not moved back by late frames
+            if (((countercandidate - receivercounter) & FRESHNESS_COUNTER_MASK) <= g_decryptionwindow):
+                counters[slot] = countercandidate
+            g_acceptancestatistics.add(ACCEPTANCE_STAT_ACCEPTED)
+            verificationstatus = DECRYPT_OK
     else:
         verificationstatus = DECRYPT_OK
 
@@ -246,80 +334,224 @@ def perform_decryption(data, decrypt_samples, decrypt_cpuper,
                        encscheme_state, canid, isextended
                        ):
     '''Perform Decryption using the selected Algorithm'''
-    global receiver_processid
-    accepted = DECRYPT_NOT_OK
+    global g_receivercpu
     
     # Start Measurement
     decryptiontime = 0
-    # For Cpu Percentage Calculation. Initial call of cpu_percent is for setting the baseline
-    receiver_processid = psutil.Process(os.getpid())
+    # For Cpu Percentage Calculation. Cpu time of the thread at the start of the frame
+    cpustart = g_receivercpu.begin()
+    # Spans are recorded after the measurement, only the end of the MAC verification is read in it
+    tracing = g_tracer.enabled
+    verifiedtime = None
     decryptionstarttime = time.perf_counter_ns()
-    # For Cpu Percentage Calculation. Initial call of cpu_percent is for setting the baseline
-    cpupercent_b = receiver_processid.cpu_percent(interval=None)
 
     #If encryption Mechanism enabled, do decrytpion only if the message is accepted
-    if(DECRYPT_OK == isMessageAccepted(encscheme_state.get(), data, canid)):
-        accepted = DECRYPT_OK
+    accepted = isMessageAccepted(encscheme_state.get(), data, canid, isextended)
+    if(True == tracing):
+        verifiedtime = time.perf_counter_ns()
+    if(DECRYPT_OK == accepted):
         #Implementation pending for other algorithms
         # Call decrytion function depending on the algorithm
         # to decrypt the data
         # Check if Encryption Scheme enabled
         if(True == encscheme_state.get()):
-            data = encryption_scheme_decrypt(data, canid)
+            data = encryption_scheme_decrypt(data, canid, isextended, g_acceptedcounter)
         else:
-            data = decrypt(g_encryptionalgo, g_encryption, data)
+            data = g_decryptframe(data)
     
     # End Measurement
     decryptionendtime = time.perf_counter_ns()
-    # Get the CPU Percentage
-    cpupercent_a = receiver_processid.cpu_percent(interval=None)
+    if(True == tracing):
+        g_tracer.span(TRACE_SPAN_MAC_VERIFY, decryptionstarttime, verifiedtime)
+        if(DECRYPT_OK == accepted):
+            g_tracer.span(TRACE_SPAN_DECRYPT, verifiedtime, decryptionendtime)
+    # Get the CPU Percentage of the frame, over the period since the previous frame
+    cpupercent = g_receivercpu.end(cpustart, decryptionstarttime, decryptionendtime)
 
-    # Storing the decryption cpu percent into the decrypt_cpuper shared variables
-    decpupers = decrypt_cpuper[g_encryptionalgo]
-    decpupers.append((cpupercent_a)/psutil.cpu_count())
-    decrypt_cpuper[g_encryptionalgo] = decpupers
+    # Storing the decryption cpu percent into the decrypt_cpuper shared ring buffers
+    if (None != cpupercent):
+        decrypt_cpuper[g_encryptionalgo].append(cpupercent)
 
     #Time taken for decryption
     decryptiontime = (decryptionendtime - decryptionstarttime) / us_DURATION
     
-    # Storing the encryption times into the encrypt_samples shared variables
-    dectimes = decrypt_samples[g_encryptionalgo]
-    dectimes.append(decryptiontime)
-    decrypt_samples[g_encryptionalgo] = dectimes
+    # Storing the decryption times into the decrypt_samples shared ring buffers
+    decrypt_samples[g_encryptionalgo].append(decryptiontime)
 
     return data, decryptiontime, accepted
 
-def initencryptionobject(algo):
-    '''Initialize the encryption Object based on the algorithm passed'''
-    encobj = None
-    if ("RC4" == algo):
-        encobj = RC4(RC4_KEY, RC4_S_ARRAY_SIZE)
-    elif ("SPECK" == algo):
-        encobj = SPECK(SPECK_KEY)
-    elif ("PRESENT" == algo):
-        encobj = PRESENT()
-    elif ("xTEA" == algo):
-        encobj = xTEA(XTEA_KEY)
-    elif (
-          ("AES128" == algo) or
-          ("AES128-CMAC" == algo)
-    ):
-        encobj = AES_Cipher(AES_KEY)
-    elif ("SHA256-HMAC" == algo):
-        encobj = SHA_Cipher(AES_KEY)
+def initializecpuaccounting(window_ns = CPU_WINDOW_NS):
+    '''Create the cpu accounting of the sender and receiver nodes, with the utilization
+       computed over windows of window_ns. Called before the node processes are forked'''
+    global g_sendercpu, g_receivercpu
+    g_sendercpu = CpuAccounting(window_ns)
+    g_receivercpu = CpuAccounting(window_ns)
+
+def deinitcpuaccounting():
+    '''Release the shared memory of the cpu accounting'''
+    global g_sendercpu, g_receivercpu
+    for cpuaccounting in (g_sendercpu, g_receivercpu):
+        if (None != cpuaccounting):
+            cpuaccounting.release()
+    g_sendercpu = None
+    g_receivercpu = None
+
+def resetcpuaccounting():
+    '''Remove the utilization time series of the nodes, e.g. at the start of a run'''
+    for cpuaccounting in (g_sendercpu, g_receivercpu):
+        if (None != cpuaccounting):
+            cpuaccounting.reset()
+
+def getcpuaccountingrecords():
+    '''Get the records of the sender and receiver utilization, None if not initialized'''
+    if (None == g_sendercpu):
+        return None
+    return {
+        "encryption_samples" : g_sendercpu.getrecord(),
+        "decryption_samples" : g_receivercpu.getrecord()
+    }
+
+def initializetimercalibration():
+    '''Create the timer calibration of the sender and receiver nodes.
+       Called before the node processes are forked'''
+    global g_sendertimer, g_receivertimer
+    g_sendertimer = TimerCalibration()
+    g_receivertimer = TimerCalibration()
+
+def emptyframe(*args):
+    '''Frame function without work, for the timer calibration'''
+    return DECRYPT_OK
+
+def timeemptyencryption(encscheme_state):
+    '''Time the measured region of perform_encryption without the cipher:
+       the timer, the Encryption Scheme state read and the call'''
+    encryptionstarttime = time.perf_counter_ns()
+    if(True == encscheme_state.get()):
+        emptyframe(None, None)
     else:
-        pass
-    return encobj
+        emptyframe(None)
+    return time.perf_counter_ns() - encryptionstarttime
+
+def timeemptydecryption(encscheme_state):
+    '''Time the measured region of perform_decryption without the acceptance and the cipher:
+       the timer, the Encryption Scheme state reads, the calls and the tracing timestamp'''
+    tracing = g_tracer.enabled
+    verifiedtime = None
+    decryptionstarttime = time.perf_counter_ns()
+    accepted = emptyframe(encscheme_state.get())
+    if(True == tracing):
+        verifiedtime = time.perf_counter_ns()
+    if(DECRYPT_OK == accepted):
+        if(True == encscheme_state.get()):
+            emptyframe(None, None)
+        else:
+            emptyframe(None)
+    return time.perf_counter_ns() - decryptionstarttime
+
+def calibratesendertimer(encscheme_state):
+    '''Called by the sender at start, on its core, to measure the bias of the encryption timings'''
+    if (None != g_sendertimer):
+        g_sendertimer.calibrate(lambda: timeemptyencryption(encscheme_state))
+
+def calibratereceivertimer(encscheme_state):
+    '''Called by the receiver at start, on its core, to measure the bias of the decryption timings'''
+    if (None != g_receivertimer):
+        g_receivertimer.calibrate(lambda: timeemptydecryption(encscheme_state))
+
+def gettimercalibrationrecords():
+    '''Get the timer calibration records of the sender and receiver, None if not initialized'''
+    if (None == g_sendertimer):
+        return None
+    return {
+        "encryption_samples" : g_sendertimer.getrecord(),
+        "decryption_samples" : g_receivertimer.getrecord()
+    }
+
+def initializebuslatency(names):
+    '''Create the end-to-end latency of the algorithms with the names.
+       Called before the node processes are forked'''
+    global g_buslatency
+    g_buslatency = BusLatency(names)
+
+def deinitbuslatency():
+    '''Release the shared memory of the end-to-end latency'''
+    global g_buslatency
+    if (None != g_buslatency):
+        g_buslatency.release()
+    g_buslatency = None
+
+def resetbuslatency():
+    '''Remove the transmits of the frames, at the start of a run'''
+    if (None != g_buslatency):
+        g_buslatency.resettransmits()
+
+def resetbuslatencysamples(algo):
+    '''Remove the end-to-end latencies of the algorithm'''
+    if (None != g_buslatency):
+        g_buslatency.resetsamples(algo)
+
+def recordtransmit(canid, counter, data):
+    '''Called by the sender right before the frame is sent, with its freshness counter
+       (None if the Encryption Scheme is disabled, the frame is then tagged by its payload)'''
+    if (None != g_buslatency):
+        g_buslatency.transmit(canid, getpayloadkey(data) if (None == counter) else counter)
+
+def startbuslatencyreceiver(period_ns):
+    '''Called by the receiver at start, with the period of the frames'''
+    if (None != g_buslatency):
+        g_buslatency.startreceiver(period_ns)
+
+def recordreceive(encscheme, canid, data, kerneltimestamp, accepted, plaintexttime_ns):
+    '''Called by the receiver after the frame is decrypted, with the kernel RX timestamp and
+       the time_ns of the plaintext. With the Encryption Scheme, the frame is tagged by the
+       counter it was accepted with, rejected frames are not matched'''
+    if (None == g_buslatency):
+        return
+    if (True == encscheme):
+        tag = g_acceptedcounter if (DECRYPT_OK == accepted) else None
+    else:
+        tag = getpayloadkey(data)
+    g_buslatency.receive(g_encryptionalgo, canid, tag, kerneltimestamp,
+                         plaintexttime_ns if (DECRYPT_OK == accepted) else None, encscheme)
+
+def getbuslatencysummary(algo):
+    '''Get the end-to-end latency distributions of the algorithm, None if not available'''
+    if (None == g_buslatency):
+        return None
+    return g_buslatency.getsummary(algo)
+
+def initencryptionobject(algo):
+    '''Initialize the encryption Object based on the algorithm passed.
+       Algorithms are looked up in the cipher registry, None if not registered'''
+    # Use the fastest backend on this host, calibrated on first use
+    selectbackend(algo)
+    # Objects are reused across selections, the key setup runs once per algorithm and key
+    cipher = getcachedcipher(algo)
+    if (None != cipher):
+        # Batch calls (e.g. keystream precomputation) use the fastest backend for batches
+        cipher.setbatchcipher(getbatchcipher(algo, cipher))
+    return cipher
 
 def initializeencryptionscheme(nonce_algo,
                                keystream_gen_algo,
                                mac_gen_algo,
-                               canid):
-    '''Function to initialize different encryption objects for encryption scheme'''
+                               canid,
+                               window = DECRYTPION_WINDOW,
+                               replaywindow = ANTI_REPLAY_WINDOW):
+    '''Function to initialize different encryption objects for encryption scheme.
+       window is the number of counters after the receiver counter that are accepted,
+       replaywindow the width of the anti-replay window before it, 0 if disabled'''
     global g_noncecreation, g_keystreamgen, g_macgeneration, g_canid
     global g_noncealgo, g_keystreamalgo, g_macgenalgo
-    global g_sendercounter, g_receivercounter
+    global g_nonceencrypt, g_keystreamencrypt, g_macgenerate, g_macverify
+    global g_sendercounters, g_receivercounters, g_senderlookahead
+    global g_decryptionwindow, g_receiverwindow
+    global g_replaywindow, g_acceptancestatistics, g_acceptedcounter
     
+    # Raises ValueError before changing the configuration
+    checkwindowsize(window)
+    if (0 != replaywindow):
+        checkreplaywindow(replaywindow)
 
     #Initilaize the objects for encryption scheme
     g_noncealgo = nonce_algo
@@ -330,13 +562,40 @@ def initializeencryptionscheme(nonce_algo,
     g_macgeneration = initencryptionobject(mac_gen_algo)
     g_canid = canid
 
-    g_sendercounter = multiprocessing.Value('i', 1)
-    g_receivercounter = multiprocessing.Value('i', 1)
+    # Bind the functions used on the hot path once
+    g_nonceencrypt = g_noncecreation.encrypt
+    g_keystreamencrypt = g_keystreamgen.encrypt
+    g_macgenerate = g_macgeneration.mac
+    g_macverify = g_macgeneration.verify
+
+    # Created before the sender and receiver processes are forked, to be shared with them
+    g_sendercounters = FreshnessCounters()
+    g_receivercounters = FreshnessCounters()
+
+    g_senderlookahead = None
+    if (True == KEYSTREAM_LOOKAHEAD_MODE):
+        g_senderlookahead = KeystreamLookahead(g_noncecreation, g_keystreamgen)
+
+    g_decryptionwindow = window
+    g_receiverwindow = None
+    if (True == RECEIVER_WINDOW_MODE):
+        # Keystreams of the counters skipped by the window are kept for the anti-replay window
+        g_receiverwindow = ReceiverWindow(g_noncecreation, g_keystreamgen, g_macgeneration, window, replaywindow)
+        # Window of the configured CAN ID is ready for the first frame, in the forked receiver too
+        g_receiverwindow.prime(canid, FRESHNESS_COUNTER_INIT)
+
+    g_acceptancestatistics = AcceptanceStatistics()
+    g_acceptedcounter = None
+    g_replaywindow = None
+    if (0 != replaywindow):
+        g_replaywindow = AntiReplayWindow(g_macgeneration, g_acceptancestatistics, replaywindow)
 
 def deinitencryptionscheme():
     '''Function to de-init different encryption objects for encryption scheme'''
     global g_noncecreation, g_keystreamgen, g_macgeneration, g_canid
     global g_noncealgo, g_keystreamalgo, g_macgenalgo
+    global g_nonceencrypt, g_keystreamencrypt, g_macgenerate, g_macverify
+    global g_senderlookahead, g_receiverwindow, g_replaywindow
 
     #De-init the objects for encryption scheme
     g_noncecreation = None
@@ -348,10 +607,19 @@ def deinitencryptionscheme():
     g_keystreamalgo = None
     g_macgenalgo = None
 
+    g_nonceencrypt = None
+    g_keystreamencrypt = None
+    g_macgenerate = None
+    g_macverify = None
+    g_senderlookahead = None
+    g_receiverwindow = None
+    g_replaywindow = None
+
 
 def setencryptionalgo(algorithm):
     '''Callback called on selecting the encyrption algorithm'''
     global g_encryptionalgo, g_encryption
+    global g_encryptframe, g_decryptframe
     
     # Set the selected algorithm to the global variable
     g_encryptionalgo = algorithm
@@ -359,13 +627,39 @@ def setencryptionalgo(algorithm):
     #Initialize g_encryption object, based on the algorithm selected
     g_encryption = initencryptionobject(g_encryptionalgo)
 
-def getsendercounter():
-    '''Retrieve the current Sender Counter of the Encryption Scheme'''
-    global g_sendercounter
-    return g_sendercounter.value
-
-def getreceivercounter():
-    '''Retrieve the current Receiver Counter of the Encryption Scheme'''
-    global g_receivercounter
-    return g_receivercounter.value
+    # Bind the functions used on the hot path once
+    if (None != g_encryption):
+        g_encryptframe = g_encryption.encrypt
+        g_decryptframe = g_encryption.decrypt
+    else:
+        g_encryptframe = passthrough
+        g_decryptframe = passthrough
+
+def getkeysetupcost():
+    '''Key setup time of the selected algorithm in ns, 0 if no algorithm is selected.
+       For the Encryption Scheme, sum of the key setup of its algorithms'''
+    if ("ENCRYPTION_SCHEME" == g_encryptionalgo):
+        return sum(encobj.key_setup_cost() for encobj in (g_noncecreation, g_keystreamgen, g_macgeneration)
+                   if None != encobj)
+    if (None == g_encryption):
+        return 0
+    return g_encryption.key_setup_cost()
+
+def getsendercounter(canid = None, isextended = True):
+    '''Retrieve the current Sender Counter of the CAN ID, the configured CAN ID by default'''
+    global g_sendercounters, g_canid
+    if (None == canid):
+        canid = g_canid
+    if ((None == g_sendercounters) or (None == canid)):
+        return 0
+    return g_sendercounters.get(canid, isextended)
+
+def getreceivercounter(canid = None, isextended = True):
+    '''Retrieve the current Receiver Counter of the CAN ID, the configured CAN ID by default'''
+    global g_receivercounters, g_canid
+    if (None == canid):
+        canid = g_canid
+    if ((None == g_receivercounters) or (None == canid)):
+        return 0
+    return g_receivercounters.get(canid, isextended)
     
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+This module provides the verification window of the Encryption Scheme receiver.
+
+It includes :
+    * Class keeping the MAC states and keystreams of the candidate counters
+      of each CAN ID precomputed, moved forward as the counter advances
+    * Function validating the size of the verification window
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawArray
+from encrypt_decrypt.freshness_counters import FRESHNESS_COUNTER_MASK
+from encrypt_decrypt.keystream_lookahead import KeystreamLookahead
+
+
+################################################################################
+# Macros
+################################################################################
+# Range of the number of counters after the receiver counter, that are accepted
+DECRYPTION_WINDOW_MIN = 2
+DECRYPTION_WINDOW_MAX = 64
+
+# Index of the statistics in the shared array
+WINDOW_STAT_FRAMES = 0
+WINDOW_STAT_REJECTED = 1
+# Time spent verifying the MAC against the window, on the hot path
+WINDOW_STAT_VERIFY_NS = 2
+# Windows built on the hot path (e.g. frames back to back), and ahead of time
+WINDOW_STAT_INLINE = 3
+WINDOW_STAT_PRECOMPUTED = 4
+WINDOW_STAT_PRECOMPUTE_NS = 5
+WINDOW_STAT_COUNT = 6
+
+
+################################################################################
+# Classes
+################################################################################
+class ReceiverWindow:
+    '''Represents the verification window of the receiver, per CAN ID.
+       For the receiver counter c, the MAC states of CAN_ID || c+1 .. CAN_ID || c+size
+       and the keystreams of these counters are precomputed. A frame is verified
+       against the whole window at once, and decrypted with the precomputed keystream.
+       Windows are local to the receiver process, statistics are in shared memory'''
+    def __init__(self, noncecipher, keystreamcipher, maccipher, size = DECRYPTION_WINDOW_MIN, keep = 0):
+        checkwindowsize(size)
+        self.size = size
+        self.macwindow = maccipher.mac_window
+        self.verifywindow = maccipher.verify_window
+        # Keystreams of the accepted counter and of the candidates after it.
+        # keep keystreams are kept behind the window, for late frames
+        self.keystreams = KeystreamLookahead(noncecipher, keystreamcipher, size + 1, keep)
+        # CAN ID -> (receiver counter, MAC state of its candidates)
+        self.windows = {}
+        # CAN ID -> counter accepted since the window was built
+        self.accepted = {}
+        self.statistics = RawArray(ctypes.c_double, WINDOW_STAT_COUNT)
+
+    def build(self, canid, receivercounter):
+        '''Build the window of the candidate counters after the receiver counter'''
+        prefixes = [canid.to_bytes(4,'big') + ((receivercounter + offset) & FRESHNESS_COUNTER_MASK).to_bytes(4,'big')
+                    for offset in range(1, self.size + 1)]
+        window = (receivercounter, self.macwindow(prefixes))
+        self.windows[canid] = window
+        return window
+
+    def accept(self, canid, receivercounter, data):
+        '''Verify the MAC of the CAN message against all the candidate counters.
+           Returns the accepted counter, None if the message is rejected'''
+        starttime = time.perf_counter_ns()
+        window = self.windows.get(canid)
+        if ((None == window) or (receivercounter != window[0])):
+            window = self.build(canid, receivercounter)
+            self.statistics[WINDOW_STAT_INLINE] += 1
+        index = self.verifywindow(window[1], data[2:], data[0:2])
+        self.statistics[WINDOW_STAT_FRAMES] += 1
+        self.statistics[WINDOW_STAT_VERIFY_NS] += time.perf_counter_ns() - starttime
+        if (index < 0):
+            self.statistics[WINDOW_STAT_REJECTED] += 1
+            return None
+        counter = (receivercounter + 1 + index) & FRESHNESS_COUNTER_MASK
+        self.accepted[canid] = counter
+        return counter
+
+    def getkeystream(self, canid, counter):
+        '''Get the keystream of the accepted counter, computed inline if not precomputed'''
+        window = self.windows.get(canid)
+        if ((None != window) and (((window[0] - counter) & FRESHNESS_COUNTER_MASK) < FRESHNESS_COUNTER_MASK // 2)):
+            # Late frame behind the window, e.g. accepted by the anti-replay window
+            return self.keystreams.getlate(canid, counter)
+        return self.keystreams.get(canid, counter)
+
+    def prime(self, canid, receivercounter):
+        '''Precompute the window of the CAN ID, e.g. before the first frame'''
+        self.build(canid, receivercounter)
+        self.keystreams.prime(canid, (receivercounter + 1) & FRESHNESS_COUNTER_MASK)
+
+    def refill(self):
+        '''Move the windows forward to the accepted counters, e.g. in idle time'''
+        starttime = time.perf_counter_ns()
+        for canid, counter in self.accepted.items():
+            self.build(canid, counter)
+            self.statistics[WINDOW_STAT_PRECOMPUTED] += 1
+        if (len(self.accepted) > 0):
+            self.statistics[WINDOW_STAT_PRECOMPUTE_NS] += time.perf_counter_ns() - starttime
+        self.accepted.clear()
+        self.keystreams.refill()
+
+    def resetstatistics(self):
+        '''Reset the statistics, e.g. at the start of a run'''
+        for index in range(WINDOW_STAT_COUNT):
+            self.statistics[index] = 0
+        self.keystreams.resetstatistics()
+
+    def getstatistics(self):
+        '''Get the verification cost per frame, and how often the window was ready'''
+        frames = self.statistics[WINDOW_STAT_FRAMES]
+        inline = self.statistics[WINDOW_STAT_INLINE]
+        precomputed = self.statistics[WINDOW_STAT_PRECOMPUTED]
+        return {
+            "size" : self.size,
+            "frames" : int(frames),
+            "rejected" : int(self.statistics[WINDOW_STAT_REJECTED]),
+            "verify_ns" : (self.statistics[WINDOW_STAT_VERIFY_NS] / frames) if (frames > 0) else 0,
+            "window_ready_rate" : ((frames - inline) / frames) if (frames > 0) else 0,
+            "precompute_ns" : (self.statistics[WINDOW_STAT_PRECOMPUTE_NS] / precomputed) if (precomputed > 0) else 0,
+            "keystreams" : self.keystreams.getstatistics()
+        }
+
+
+################################################################################
+# Functions
+################################################################################
+def checkwindowsize(size):
+    '''Raise ValueError, if the size of the verification window is out of range'''
+    if ((False == isinstance(size, int)) or
+        (size < DECRYPTION_WINDOW_MIN) or (size > DECRYPTION_WINDOW_MAX)):
+        raise ValueError("Decryption window " + str(size) + " is not in the range "
+                         + str(DECRYPTION_WINDOW_MIN) + ".." + str(DECRYPTION_WINDOW_MAX))
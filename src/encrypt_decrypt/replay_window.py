@@ -0,0 +1,176 @@
+"""
+This module provides the anti-replay window of the Encryption Scheme receiver.
+
+It includes :
+    * Class with the acceptance statistics of the receiver in shared memory,
+      e.g. MAC verification attempts per accepted frame
+    * Class keeping a sliding bitmap of the accepted counters of each CAN ID,
+      accepting late but unseen frames and rejecting duplicates
+    * Function validating the width of the anti-replay window
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+from collections import OrderedDict
+from multiprocessing.sharedctypes import RawArray
+from encrypt_decrypt.freshness_counters import FRESHNESS_COUNTER_MASK
+
+
+################################################################################
+# Macros
+################################################################################
+# Width of the anti-replay window in counters, 0 if disabled
+ANTI_REPLAY_WINDOW = 0
+ANTI_REPLAY_WINDOW_MIN = 32
+ANTI_REPLAY_WINDOW_MAX = 4096
+
+# Index of the statistics in the shared array
+ACCEPTANCE_STAT_FRAMES = 0
+ACCEPTANCE_STAT_ACCEPTED = 1
+# MAC verifications done, for all the frames
+ACCEPTANCE_STAT_ATTEMPTS = 2
+# Frames accepted behind the receiver counter, and duplicates rejected without verification
+ACCEPTANCE_STAT_LATE = 3
+ACCEPTANCE_STAT_DUPLICATES = 4
+ACCEPTANCE_STAT_COUNT = 5
+
+
+################################################################################
+# Classes
+################################################################################
+class AcceptanceStatistics:
+    '''Represents the acceptance statistics of the receiver, in shared memory.
+       Written by the receiver only, read by the other processes (e.g. UI)'''
+    def __init__(self):
+        self.statistics = RawArray(ctypes.c_double, ACCEPTANCE_STAT_COUNT)
+
+    def add(self, index, value = 1):
+        '''Add the value to the statistic'''
+        self.statistics[index] += value
+
+    def resetstatistics(self):
+        '''Reset the statistics, e.g. at the start of a run'''
+        for index in range(ACCEPTANCE_STAT_COUNT):
+            self.statistics[index] = 0
+
+    def getstatistics(self):
+        '''Get the MAC verification attempts per frame and per accepted frame'''
+        frames = self.statistics[ACCEPTANCE_STAT_FRAMES]
+        accepted = self.statistics[ACCEPTANCE_STAT_ACCEPTED]
+        attempts = self.statistics[ACCEPTANCE_STAT_ATTEMPTS]
+        return {
+            "frames" : int(frames),
+            "accepted" : int(accepted),
+            "rejected" : int(frames - accepted),
+            "late" : int(self.statistics[ACCEPTANCE_STAT_LATE]),
+            "duplicates" : int(self.statistics[ACCEPTANCE_STAT_DUPLICATES]),
+            "attempts" : int(attempts),
+            "attempts_per_frame" : (attempts / frames) if (frames > 0) else 0,
+            "attempts_per_accepted" : (attempts / accepted) if (accepted > 0) else 0
+        }
+
+
+class AntiReplayState:
+    '''Represents the anti-replay state of one CAN ID'''
+    def __init__(self, highest, width):
+        # Highest accepted counter, bit i of the bitmap is set if highest - i is accepted.
+        # Counters before the first frame are never accepted, they are marked as seen
+        self.highest = highest
+        self.bitmap = (1 << width) - 1
+        # Frames accepted in the window, payload -> counter
+        self.frames = OrderedDict()
+        # Counters not accepted yet in the window, and their MAC state, None if changed
+        self.holes = None
+
+
+class AntiReplayWindow:
+    '''Represents the anti-replay window of the receiver, per CAN ID (RFC 4303 style).
+       The counter is not sent in the frame, so it is found by MAC verification:
+       counters after the highest accepted one are tried first, then the counters
+       of the window not accepted yet (e.g. lost or reordered frames).
+       Duplicates of accepted frames are rejected with one lookup, without verification.
+       Windows are local to the receiver process'''
+    def __init__(self, maccipher, statistics, width = ANTI_REPLAY_WINDOW_MIN):
+        checkreplaywindow(width)
+        self.width = width
+        self.macwindow = maccipher.mac_window
+        self.verifywindow = maccipher.verify_window
+        self.statistics = statistics
+        # CAN ID -> AntiReplayState
+        self.states = {}
+
+    def getstate(self, canid, receivercounter):
+        '''Get the state of the CAN ID, restarted if the receiver counter was changed elsewhere'''
+        state = self.states.get(canid)
+        if ((None == state) or (receivercounter != state.highest)):
+            state = self.states[canid] = AntiReplayState(receivercounter, self.width)
+        return state
+
+    def getholes(self, canid, state):
+        '''Get the counters of the window not accepted yet, and the MAC state of their messages'''
+        if (None == state.holes):
+            counters = []
+            # Zero bits of the bitmap, from the most recent counter
+            missing = ~state.bitmap & ((1 << self.width) - 1)
+            while (0 != missing):
+                offset = (missing & -missing).bit_length() - 1
+                missing &= missing - 1
+                counters.append((state.highest - offset) & FRESHNESS_COUNTER_MASK)
+            macstate = None
+            if (len(counters) > 0):
+                macstate = self.macwindow([canid.to_bytes(4,'big') + counter.to_bytes(4,'big')
+                                           for counter in counters])
+            state.holes = (counters, macstate)
+        return state.holes
+
+    def accept(self, canid, receivercounter, data, verifyforward):
+        '''Accept the CAN message, if its counter is after the receiver counter or a counter
+           of the window not accepted yet. verifyforward verifies the counters after the
+           receiver counter. Returns the accepted counter, None if the message is rejected'''
+        state = self.getstate(canid, receivercounter)
+        payload = bytes(data)
+        if (payload in state.frames):
+            self.statistics.add(ACCEPTANCE_STAT_DUPLICATES)
+            return None
+
+        counter = verifyforward(canid, receivercounter, data)
+        if (None != counter):
+            # Slide the window to the new highest counter
+            shift = (counter - state.highest) & FRESHNESS_COUNTER_MASK
+            state.bitmap = ((state.bitmap << shift) | 1) & ((1 << self.width) - 1)
+            state.highest = counter
+            state.holes = None
+        else:
+            counters, macstate = self.getholes(canid, state)
+            if (len(counters) > 0):
+                self.statistics.add(ACCEPTANCE_STAT_ATTEMPTS, len(counters))
+                index = self.verifywindow(macstate, data[2:], data[0:2])
+                if (index >= 0):
+                    counter = counters[index]
+                    state.bitmap |= 1 << ((state.highest - counter) & FRESHNESS_COUNTER_MASK)
+                    state.holes = None
+                    self.statistics.add(ACCEPTANCE_STAT_LATE)
+
+        if (None != counter):
+            state.frames[payload] = counter
+            if (len(state.frames) > self.width):
+                state.frames.popitem(last=False)
+        return counter
+
+    def refill(self):
+        '''Precompute the MAC states of the counters not accepted yet, e.g. in idle time'''
+        for canid, state in self.states.items():
+            self.getholes(canid, state)
+
+
+################################################################################
+# Functions
+################################################################################
+def checkreplaywindow(width):
+    '''Raise ValueError, if the width of the anti-replay window is out of range'''
+    if ((False == isinstance(width, int)) or
+        (width < ANTI_REPLAY_WINDOW_MIN) or (width > ANTI_REPLAY_WINDOW_MAX)):
+        raise ValueError("Anti-replay window " + str(width) + " is not in the range "
+                         + str(ANTI_REPLAY_WINDOW_MIN) + ".." + str(ANTI_REPLAY_WINDOW_MAX))
@@ -0,0 +1,174 @@
+"""
+This module provides the asynchronous logging of the sender and receiver nodes.
+
+It includes :
+    * Function registering the log events, i.e. the formats of the records
+    * Class writing fixed-size binary records into a ring buffer on the hot
+      paths, formatted and flushed to the console or a file by a background
+      writer thread, with level gating
+
+"""
+################################################################################
+# Imports
+################################################################################
+import functools
+import struct
+import sys
+import threading
+import time
+
+
+################################################################################
+# Macros
+################################################################################
+# Levels of the records, records below the level of the logger are not written
+LOG_LEVEL_DEBUG = 10
+LOG_LEVEL_INFO = 20
+LOG_LEVEL_WARNING = 30
+LOG_LEVEL_ERROR = 40
+LOG_LEVEL_OFF = 100
+LOG_LEVEL_NAMES = {
+    LOG_LEVEL_DEBUG : "DEBUG",
+    LOG_LEVEL_INFO : "INFO",
+    LOG_LEVEL_WARNING : "WARNING",
+    LOG_LEVEL_ERROR : "ERROR"
+}
+
+# Default level, per-frame records are DEBUG and cost a no-op call when disabled
+LOG_LEVEL = LOG_LEVEL_INFO
+
+# Number of records in the ring buffer, records are dropped while it is full
+LOG_RING_CAPACITY = 1 << 14
+
+# Period of formatting and flushing the records, by the writer thread
+LOG_FLUSH_PERIOD_S = 0.05
+
+# Record: timestamp (perf_counter_ns), level, event, payload length, two integer arguments, payload
+LOG_RECORD = struct.Struct("<QBHB2q8s")
+LOG_PAYLOAD_SIZE = 8
+
+
+################################################################################
+# Globals
+################################################################################
+# Formats of the log events, event id -> format with {arg0}, {arg1} and {payload}
+g_logevents = []
+
+
+################################################################################
+# Classes
+################################################################################
+class BinaryLogger:
+    '''Represents the logger of a process. Hot paths pack a fixed-size record into
+       a preallocated ring buffer, without formatting or I/O. A writer thread of the
+       same process formats the records and writes them to the console or a file.
+       Threads do not survive fork, each node process starts its own writer'''
+    def __init__(self, capacity = LOG_RING_CAPACITY, level = LOG_LEVEL):
+        self.capacity = capacity
+        self.ring = bytearray(capacity * LOG_RECORD.size)
+        # Records written and read so far, written by the hot path and the writer respectively
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.name = ""
+        self.output = None
+        self.writerstop = threading.Event()
+        self.writerthread = None
+        self.setlevel(level)
+
+    def setlevel(self, level):
+        '''Set the level of the logger. Functions of the disabled levels are bound to a no-op'''
+        self.level = level
+        self.debug = self.getlevelfunction(LOG_LEVEL_DEBUG)
+        self.info = self.getlevelfunction(LOG_LEVEL_INFO)
+        self.warning = self.getlevelfunction(LOG_LEVEL_WARNING)
+        self.error = self.getlevelfunction(LOG_LEVEL_ERROR)
+
+    def getlevelfunction(self, level):
+        '''Get the function writing the records of the level, a no-op if the level is disabled'''
+        if (level < self.level):
+            return nolog
+        return functools.partial(self.write, level)
+
+    def write(self, level, event, arg0 = 0, arg1 = 0, payload = b""):
+        '''Write a record into the ring buffer, dropped if the ring buffer is full'''
+        head = self.head
+        if ((head - self.tail) >= self.capacity):
+            self.dropped += 1
+            return
+        LOG_RECORD.pack_into(self.ring, (head % self.capacity) * LOG_RECORD.size,
+                             time.perf_counter_ns(), level, event, min(len(payload), LOG_PAYLOAD_SIZE),
+                             arg0, arg1, bytes(payload[0:LOG_PAYLOAD_SIZE]))
+        # Head is moved after the record is written, the writer never reads a partial record
+        self.head = head + 1
+
+    def start(self, name, path = None):
+        '''Start the writer thread in the calling process, writing to the file or the console.
+           Records of the parent process, copied on fork, are discarded'''
+        self.name = name
+        self.tail = self.head
+        self.dropped = 0
+        self.output = sys.stdout
+        if (None != path):
+            self.output = open(path, "a")
+        self.writerstop.clear()
+        self.writerthread = threading.Thread(target=self.writerloop, daemon=True)
+        self.writerthread.start()
+
+    def stop(self):
+        '''Stop the writer thread, after writing the remaining records'''
+        if (None != self.writerthread):
+            self.writerstop.set()
+            self.writerthread.join()
+            self.writerthread = None
+        if ((None != self.output) and (sys.stdout != self.output)):
+            self.output.close()
+        self.output = None
+
+    def writerloop(self):
+        '''Format and flush the records periodically, until the logger is stopped'''
+        while (False == self.writerstop.wait(LOG_FLUSH_PERIOD_S)):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        '''Format the records written so far, and write them to the output'''
+        head = self.head
+        lines = []
+        while (self.tail < head):
+            lines.append(self.format(self.tail % self.capacity))
+            self.tail += 1
+        if (self.dropped > 0):
+            lines.append(f"[Warning] {self.name}: {self.dropped} log records dropped")
+            self.dropped = 0
+        if (len(lines) > 0):
+            self.output.write("\n".join(lines) + "\n")
+            self.output.flush()
+
+    def format(self, slot):
+        '''Format the record of the slot'''
+        timestamp, level, event, length, arg0, arg1, payload = LOG_RECORD.unpack_from(self.ring,
+                                                                                     slot * LOG_RECORD.size)
+        text = g_logevents[event].format(arg0=arg0, arg1=arg1, payload=list(payload[0:length]))
+        return f"{timestamp} {LOG_LEVEL_NAMES.get(level, level)} {self.name}: {text}"
+
+
+################################################################################
+# Functions
+################################################################################
+def registerlogevent(format):
+    '''Register the format of a log event, returns its id. Registered at import,
+       so the ids are the same in the forked processes'''
+    g_logevents.append(format)
+    return len(g_logevents) - 1
+
+def nolog(*args, **kwargs):
+    '''Log function of the disabled levels'''
+    pass
+
+
+################################################################################
+# Logger
+################################################################################
+# Logger of the process, started by each node process
+g_logger = BinaryLogger()
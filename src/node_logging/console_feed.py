@@ -0,0 +1,119 @@
+"""
+This module provides the console feed from the sender and receiver nodes to the UI.
+
+It includes :
+    * Class with a ring buffer of compact binary frame records in shared
+      memory, written by a node on each frame and read in batches by the UI,
+      dropping the oldest records when the UI falls behind
+    * Function formatting a frame record for the console, on the UI side
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import struct
+from multiprocessing.sharedctypes import RawArray
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of records kept for the UI, the oldest are overwritten
+CONSOLE_FEED_CAPACITY = 1 << 12
+
+# Record: timestamp (s), CAN ID, flags, DLC, data, encryption/decryption time (us)
+CONSOLE_RECORD = struct.Struct("<dIBB8sd")
+CONSOLE_DATA_SIZE = 8
+
+# Flags of the record
+CONSOLE_FLAG_EXTENDED = 1 << 0
+CONSOLE_FLAG_RX = 1 << 1
+CONSOLE_FLAG_ACCEPTED = 1 << 2
+
+# Index of the counters in the shared array
+# Records written by the node, and read by the UI
+CONSOLE_COUNTER_WRITTEN = 0
+CONSOLE_COUNTER_READ = 1
+# Records not shown, overwritten before being read or skipped by the UI
+CONSOLE_COUNTER_DROPPED = 2
+CONSOLE_COUNTER_COUNT = 3
+
+
+################################################################################
+# Classes
+################################################################################
+class ConsoleFeed:
+    '''Represents the console feed of a node, in shared memory.
+       Created before the processes are forked, written by a single node process,
+       read by the UI only. The node never waits for the UI'''
+    def __init__(self, capacity = CONSOLE_FEED_CAPACITY):
+        self.capacity = capacity
+        self.records = RawArray(ctypes.c_ubyte, capacity * CONSOLE_RECORD.size)
+        self.counters = RawArray(ctypes.c_uint64, CONSOLE_COUNTER_COUNT)
+        # Views for packing and updating single values, cheaper than the ctypes arrays
+        self.recordview = memoryview(self.records).cast('B')
+        self.counterview = memoryview(self.counters).cast('B').cast('Q')
+
+    def put(self, timestamp, canid, isextended, isrx, data, time_us, accepted = False):
+        '''Add the record of a frame, overwriting the oldest one if the UI fell behind'''
+        written = self.counterview[CONSOLE_COUNTER_WRITTEN]
+        flags = ((CONSOLE_FLAG_EXTENDED if (True == isextended) else 0) |
+                 (CONSOLE_FLAG_RX if (True == isrx) else 0) |
+                 (CONSOLE_FLAG_ACCEPTED if (True == accepted) else 0))
+        CONSOLE_RECORD.pack_into(self.recordview, (written % self.capacity) * CONSOLE_RECORD.size,
+                                 timestamp, canid, flags, len(data),
+                                 bytes(data[0:CONSOLE_DATA_SIZE]), time_us)
+        # Count is written after the record, the UI never reads an unwritten record
+        self.counterview[CONSOLE_COUNTER_WRITTEN] = written + 1
+
+    def getbatch(self, maxrecords):
+        '''Get the records written since the last batch, at most maxrecords of the latest.
+           Older records are dropped and counted'''
+        written = self.counterview[CONSOLE_COUNTER_WRITTEN]
+        read = self.counterview[CONSOLE_COUNTER_READ]
+        # Oldest records are skipped, if overwritten or more than the UI shows at once
+        first = max(read, written - min(self.capacity, maxrecords))
+        dropped = first - read
+        batch = []
+        for index in range(first, written):
+            record = CONSOLE_RECORD.unpack_from(self.recordview, (index % self.capacity) * CONSOLE_RECORD.size)
+            # Record overwritten by the node while being read
+            if ((self.counterview[CONSOLE_COUNTER_WRITTEN] - index) > self.capacity):
+                dropped += 1
+                continue
+            batch.append(record)
+        self.counterview[CONSOLE_COUNTER_READ] = written
+        self.counterview[CONSOLE_COUNTER_DROPPED] += dropped
+        return batch, dropped
+
+    def reset(self):
+        '''Remove all the records and the counters. Not to be called while the node is running'''
+        for index in range(CONSOLE_COUNTER_COUNT):
+            self.counterview[index] = 0
+
+    def getstatistics(self):
+        '''Get the records written by the node and the records not shown'''
+        return {
+            "written" : self.counterview[CONSOLE_COUNTER_WRITTEN],
+            "dropped" : self.counterview[CONSOLE_COUNTER_DROPPED]
+        }
+
+
+################################################################################
+# Functions
+################################################################################
+def formatconsolerecord(record):
+    '''Get the console line of a frame record, and if the frame was accepted'''
+    timestamp, canid, flags, dlc, data, time_us = record
+    isrx = (0 != (flags & CONSOLE_FLAG_RX))
+    accepted = (0 != (flags & CONSOLE_FLAG_ACCEPTED))
+    # Same fields as can.Message
+    message = (f"Timestamp: {timestamp:>15.6f}    ID: "
+               + (f"{canid:08x}    X" if (0 != (flags & CONSOLE_FLAG_EXTENDED)) else f"{canid:04x}    S")
+               + (" Rx" if (True == isrx) else " Tx")
+               + f"                DL: {dlc:2d}    " + data[0:dlc].hex(" "))
+    if (True == isrx):
+        return (f"Received: {message}    t_decrypt: {time_us:.3f} us "
+                + ("  ✅" if (True == accepted) else "  ❌")), accepted
+    return f"Sent: {message}    t_encrypt: {time_us:.3f} us", accepted
@@ -0,0 +1,215 @@
+"""
+This module provides the end-to-end latency of the frames over the CAN bus.
+
+It includes :
+    * Class with the transmit times of the frames in shared memory, tagged by
+      CAN ID and freshness counter (Encryption Scheme) or payload, written by
+      the sender and read in order by the receiver
+    * Class matching the received frames with their transmit, with the
+      transmit-to-receive (kernel RX timestamp) and transmit-to-plaintext
+      latencies of each algorithm
+
+"""
+################################################################################
+# Imports
+################################################################################
+import collections
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawArray
+from perf_metrics.sample_ring import SampleRings
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of transmits kept for the receiver, the oldest are overwritten
+BUS_LATENCY_CAPACITY = 1 << 12
+
+# Transmits not received within this time are lost, and no longer matched
+BUS_LATENCY_TIMEOUT_NS = 1_000_000_000
+
+# Index of the statistics in the shared array
+# Received frames matched with a transmit, and not matched (e.g. replayed or external frames)
+BUS_LATENCY_STAT_MATCHED = 0
+BUS_LATENCY_STAT_UNMATCHED = 1
+# Transmits never matched, i.e. frames lost or rejected
+BUS_LATENCY_STAT_LOST = 2
+BUS_LATENCY_STAT_COUNT = 3
+
+CONVERT_NS_TO_US = 1/ 1_000
+
+
+################################################################################
+# Classes
+################################################################################
+class TransmitLog:
+    '''Represents the transmits of the frames in shared memory, in the order they are sent.
+       Written by the sender only, read by the receiver only. A transmit is the time,
+       the CAN ID and the tag of the frame (freshness counter or payload key)'''
+    def __init__(self, capacity = BUS_LATENCY_CAPACITY):
+        self.capacity = capacity
+        self.times = RawArray(ctypes.c_int64, capacity)
+        self.canids = RawArray(ctypes.c_int64, capacity)
+        self.tags = RawArray(ctypes.c_uint64, capacity)
+        self.written = RawArray(ctypes.c_uint64, 1)
+        # Views for single values, cheaper than indexing the ctypes arrays
+        self.timeview = memoryview(self.times).cast('B').cast('q')
+        self.canidview = memoryview(self.canids).cast('B').cast('q')
+        self.tagview = memoryview(self.tags).cast('B').cast('Q')
+        self.writtenview = memoryview(self.written).cast('B').cast('Q')
+
+    def put(self, transmittime_ns, canid, tag):
+        '''Add the transmit of a frame, overwriting the oldest one if the receiver fell behind'''
+        written = self.writtenview[0]
+        slot = written % self.capacity
+        self.timeview[slot] = transmittime_ns
+        self.canidview[slot] = canid
+        self.tagview[slot] = tag
+        # Count is written after the transmit, the receiver never reads an unwritten one
+        self.writtenview[0] = written + 1
+
+    def getnew(self, read):
+        '''Get the transmits written since read, the number read, and the number overwritten'''
+        written = self.writtenview[0]
+        first = max(read, written - self.capacity)
+        transmits = []
+        for index in range(first, written):
+            slot = index % self.capacity
+            transmits.append((self.timeview[slot], self.canidview[slot], self.tagview[slot]))
+        # Transmits overwritten by the sender while being read
+        overwritten = min(max(self.writtenview[0] - self.capacity - first, 0), len(transmits))
+        return transmits[overwritten:], written, (first - read) + overwritten
+
+    def reset(self):
+        '''Remove all the transmits. Not to be called while the sender is running'''
+        self.writtenview[0] = 0
+
+
+class BusLatency:
+    '''Represents the end-to-end latencies of each algorithm, in shared memory.
+       Created before the processes are forked. Times are from the wall clock
+       (CLOCK_REALTIME), the clock of the SocketCAN kernel timestamps.
+       Received frames are matched with the oldest pending transmit of the same CAN ID
+       and tag, sent before the kernel RX. With the Encryption Scheme the tag is the
+       freshness counter, unique per frame. Otherwise it is the payload, the same for
+       frames of a block cipher, so transmits older than the period are lost'''
+    def __init__(self, names, capacity = BUS_LATENCY_CAPACITY):
+        self.transmitlog = TransmitLog(capacity)
+        # Latencies in us, algorithm name -> SampleRing
+        self.transmitreceive = SampleRings(names)
+        self.transmitplaintext = SampleRings(names)
+        self.statistics = RawArray(ctypes.c_double, BUS_LATENCY_STAT_COUNT)
+        # State of the receiver process, set by startreceiver
+        self.read = 0
+        # (CAN ID, tag) -> transmit times not yet matched, oldest first
+        self.pending = {}
+        # (transmit time, (CAN ID, tag)) of the pending transmits, for the timeout
+        self.pendingorder = collections.deque()
+        self.period_ns = BUS_LATENCY_TIMEOUT_NS
+
+    def transmit(self, canid, tag):
+        '''Called by the sender, right before the frame is sent'''
+        self.transmitlog.put(time.time_ns(), canid, tag)
+
+    def startreceiver(self, period_ns):
+        '''Called by the receiver at start, with the period of the frames'''
+        self.read = 0
+        self.pending = {}
+        self.pendingorder = collections.deque()
+        self.period_ns = period_ns
+
+    def collect(self, receivetime_ns):
+        '''Add the new transmits to the pending ones, and drop the ones past the timeout'''
+        transmits, self.read, overwritten = self.transmitlog.getnew(self.read)
+        self.statistics[BUS_LATENCY_STAT_LOST] += overwritten
+        for transmittime_ns, canid, tag in transmits:
+            key = (canid, tag)
+            self.pending.setdefault(key, collections.deque()).append(transmittime_ns)
+            self.pendingorder.append((transmittime_ns, key))
+        timeout_ns = receivetime_ns - BUS_LATENCY_TIMEOUT_NS
+        while ((len(self.pendingorder) > 0) and (self.pendingorder[0][0] < timeout_ns)):
+            transmittime_ns, key = self.pendingorder.popleft()
+            self.droptransmit(key, transmittime_ns)
+
+    def droptransmit(self, key, transmittime_ns):
+        '''Drop the pending transmit as lost, if not already matched'''
+        queue = self.pending.get(key)
+        if ((None != queue) and (transmittime_ns == queue[0])):
+            queue.popleft()
+            self.statistics[BUS_LATENCY_STAT_LOST] += 1
+            if (0 == len(queue)):
+                del self.pending[key]
+
+    def match(self, canid, tag, receivetime_ns, isunique):
+        '''Get the transmit time of the received frame, None if not matched.
+           If the tag is not unique, transmits older than the period before the receive are lost'''
+        self.collect(receivetime_ns)
+        key = (canid, tag)
+        queue = self.pending.get(key)
+        if (None == queue):
+            return None
+        if (False == isunique):
+            while ((len(queue) > 0) and (queue[0] <= (receivetime_ns - self.period_ns))):
+                queue.popleft()
+                self.statistics[BUS_LATENCY_STAT_LOST] += 1
+        # Frame cannot be received before it is sent
+        if ((0 == len(queue)) or (queue[0] > receivetime_ns)):
+            transmittime_ns = None
+        else:
+            transmittime_ns = queue.popleft()
+        if (0 == len(queue)):
+            del self.pending[key]
+        return transmittime_ns
+
+    def receive(self, algo, canid, tag, kerneltimestamp, plaintexttime_ns = None, isunique = False):
+        '''Called by the receiver after the frame is decrypted, with the kernel RX timestamp (s)
+           of the frame and the time_ns the plaintext was available, None if the frame was rejected.
+           tag is None if the frame cannot be matched (e.g. counter of a rejected frame)'''
+        receivetime_ns = int(kerneltimestamp * 1_000_000_000)
+        transmittime_ns = None
+        if (None != tag):
+            transmittime_ns = self.match(canid, tag, receivetime_ns, isunique)
+        if (None == transmittime_ns):
+            self.statistics[BUS_LATENCY_STAT_UNMATCHED] += 1
+            return
+        self.statistics[BUS_LATENCY_STAT_MATCHED] += 1
+        self.transmitreceive[algo].append((receivetime_ns - transmittime_ns) * CONVERT_NS_TO_US)
+        if (None != plaintexttime_ns):
+            self.transmitplaintext[algo].append((plaintexttime_ns - transmittime_ns) * CONVERT_NS_TO_US)
+
+    def resettransmits(self):
+        '''Remove the transmits and the statistics, at the start of a run'''
+        self.transmitlog.reset()
+        for index in range(BUS_LATENCY_STAT_COUNT):
+            self.statistics[index] = 0
+
+    def resetsamples(self, algo):
+        '''Remove the latencies of the algorithm'''
+        self.transmitreceive[algo].reset()
+        self.transmitplaintext[algo].reset()
+
+    def getsummary(self, algo):
+        '''Get the distributions of the latencies of the algorithm, None if no frame was matched'''
+        if (0 == self.transmitreceive[algo].getcount()):
+            return None
+        return {
+            "tx_rx" : self.transmitreceive[algo].getsnapshot().getsummary(),
+            "tx_plaintext" : self.transmitplaintext[algo].getsnapshot().getsummary(),
+            "matched" : int(self.statistics[BUS_LATENCY_STAT_MATCHED]),
+            "unmatched" : int(self.statistics[BUS_LATENCY_STAT_UNMATCHED]),
+            "lost" : int(self.statistics[BUS_LATENCY_STAT_LOST])
+        }
+
+    def release(self):
+        '''Release the shared memory of the latencies'''
+        self.transmitreceive.release()
+        self.transmitplaintext.release()
+
+
+################################################################################
+# Functions
+################################################################################
+def getpayloadkey(data):
+    '''Get the first 8 bytes of the payload as an integer, to match the frames'''
+    return int.from_bytes(bytes(data[0:8]), 'little')
@@ -0,0 +1,249 @@
+"""
+This module provides the clock calibration of the cores running the simulation.
+
+It includes :
+    * Functions to measure the effective frequency of a core, from the cpu
+      cycle counter, scaling_cur_freq or /proc/cpuinfo
+    * Class recording the frequency of a core at run start and end, and
+      flagging runs where the frequency drifted
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import os
+import platform
+import struct
+import threading
+import time
+
+
+################################################################################
+# Macros
+################################################################################
+# cpu frequency used, only if the frequency can not be measured on this host
+# this value has been fetched from cpuinfo file in process
+#cat /proc/cpuinfo | grep "MHz"
+CPU_FREQ_MHZ = 2592.008
+
+# Sources of the measured frequency, from the most to the least accurate
+CLOCK_SOURCE_CYCLES = "cycles"
+CLOCK_SOURCE_SCALING = "scaling_cur_freq"
+CLOCK_SOURCE_CPUINFO = "cpuinfo"
+CLOCK_SOURCE_ASSUMED = "assumed"
+CLOCK_SOURCES = [CLOCK_SOURCE_CYCLES, CLOCK_SOURCE_SCALING, CLOCK_SOURCE_CPUINFO, CLOCK_SOURCE_ASSUMED]
+
+# Time the core is kept busy, while counting its cycles
+CLOCK_MEASUREMENT_NS = 20_000_000
+
+# Period of tracking scaling_cur_freq during a run
+CLOCK_TRACKING_PERIOD_S = 0.1
+
+# Relative frequency change, above which the run is flagged (e.g. turbo, thermal throttling)
+CLOCK_DRIFT_THRESHOLD = 0.05
+
+# Files with the current frequency of a core
+SCALING_CUR_FREQ_FILE = "/sys/devices/system/cpu/cpu{}/cpufreq/scaling_cur_freq"
+CPUINFO_FILE = "/proc/cpuinfo"
+
+# perf_event_open() for counting the cpu cycles, in user space only
+PERF_TYPE_HARDWARE = 0
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_ATTR_SIZE = 64
+PERF_ATTR_EXCLUDE_KERNEL = 1 << 5
+PERF_ATTR_EXCLUDE_HV = 1 << 6
+PERF_EVENT_OPEN_SYSCALL = {
+    "x86_64" : 298,
+    "aarch64" : 241,
+    "armv7l" : 364,
+    "i686" : 336,
+}
+
+CONVERT_KHZ_TO_MHZ = 1/ 1_000
+CONVERT_NS_TO_US = 1/ 1_000
+
+
+################################################################################
+# Classes
+################################################################################
+class ClockCalibration:
+    '''Represents the clock calibration of a core for one run'''
+    def __init__(self, core, driftthreshold = CLOCK_DRIFT_THRESHOLD):
+        self.core = core
+        self.driftthreshold = driftthreshold
+        self.startmhz = None
+        self.endmhz = None
+        self.source = CLOCK_SOURCE_ASSUMED
+        # scaling_cur_freq samples, taken during the run
+        self.trackedmhz = []
+        self.trackingstop = threading.Event()
+        self.trackingthread = None
+
+    def start(self):
+        '''Measure the frequency at run start, and start tracking scaling_cur_freq'''
+        self.startmhz, self.source = measurecorefrequency(self.core)
+        self.endmhz = None
+        self.trackedmhz = []
+        if (None != readscalingfrequency(self.core)):
+            self.trackingstop.clear()
+            self.trackingthread = threading.Thread(target=self.trackfrequency, daemon=True)
+            self.trackingthread.start()
+
+    def stop(self):
+        '''Stop tracking scaling_cur_freq, and measure the frequency at run end'''
+        if (None != self.trackingthread):
+            self.trackingstop.set()
+            self.trackingthread.join()
+            self.trackingthread = None
+        self.endmhz, endsource = measurecorefrequency(self.core)
+        # Keep the least accurate source, if it changed during the run
+        if (CLOCK_SOURCES.index(endsource) > CLOCK_SOURCES.index(self.source)):
+            self.source = endsource
+
+    def trackfrequency(self):
+        '''Sample scaling_cur_freq of the core, until the run is stopped'''
+        while (False == self.trackingstop.wait(CLOCK_TRACKING_PERIOD_S)):
+            frequency = readscalingfrequency(self.core)
+            if (None != frequency):
+                self.trackedmhz.append(frequency)
+
+    def getfrequency(self):
+        '''Get the effective frequency of the run in MHz, mean of the start and end'''
+        measured = [mhz for mhz in (self.startmhz, self.endmhz) if None != mhz]
+        if (len(measured) == 0):
+            return CPU_FREQ_MHZ
+        return sum(measured) / len(measured)
+
+    def getdrift(self):
+        '''Get the relative frequency change during the run'''
+        drift = 0
+        for values in ([self.startmhz, self.endmhz], self.trackedmhz):
+            values = [mhz for mhz in values if None != mhz]
+            if (len(values) > 1):
+                drift = max(drift, (max(values) - min(values)) / min(values))
+        return drift
+
+    def isdrifted(self):
+        '''True, if the frequency drifted more than the threshold during the run'''
+        return (self.getdrift() > self.driftthreshold)
+
+    def getrecord(self):
+        '''Get the record of the run'''
+        return {
+            "core" : self.core,
+            "source" : self.source,
+            "start_mhz" : self.startmhz,
+            "end_mhz" : self.endmhz,
+            "tracked_min_mhz" : min(self.trackedmhz) if (len(self.trackedmhz) > 0) else None,
+            "tracked_max_mhz" : max(self.trackedmhz) if (len(self.trackedmhz) > 0) else None,
+            "frequency_mhz" : round(self.getfrequency(), 3),
+            "drift_percent" : round(100 * self.getdrift(), 3),
+            "drifted" : self.isdrifted()
+        }
+
+
+################################################################################
+# Functions
+################################################################################
+def readscalingfrequency(core):
+    '''Get the current frequency of the core from scaling_cur_freq in MHz, None if not available'''
+    try:
+        with open(SCALING_CUR_FREQ_FILE.format(core), "r") as fp:
+            return int(fp.read()) * CONVERT_KHZ_TO_MHZ
+    except (OSError, ValueError):
+        return None
+
+def readcpuinfofrequency(core):
+    '''Get the frequency of the core from /proc/cpuinfo in MHz, None if not available'''
+    try:
+        with open(CPUINFO_FILE, "r") as fp:
+            processor = None
+            for line in fp:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if ("processor" == key):
+                    processor = int(value)
+                elif (("cpu MHz" == key) and (core == processor)):
+                    return float(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+def opencyclecounter():
+    '''Open the cpu cycle counter of the calling thread, None if not available'''
+    syscallnumber = PERF_EVENT_OPEN_SYSCALL.get(platform.machine())
+    if (None == syscallnumber):
+        return None
+    # perf_event_attr: type, size, config, sample_period, sample_type, read_format,
+    # flags, wakeup_events, bp_type, config1
+    attr = ctypes.create_string_buffer(struct.pack("IIQQQQQIIQ",
+                                                   PERF_TYPE_HARDWARE, PERF_ATTR_SIZE,
+                                                   PERF_COUNT_HW_CPU_CYCLES, 0, 0, 0,
+                                                   PERF_ATTR_EXCLUDE_KERNEL | PERF_ATTR_EXCLUDE_HV,
+                                                   0, 0, 0))
+    libc = ctypes.CDLL(None, use_errno=True)
+    # Counting starts on open, for this thread on any cpu
+    fd = libc.syscall(syscallnumber, attr, 0, -1, -1, 0)
+    if (fd < 0):
+        return None
+    return fd
+
+def readcyclecounter(fd):
+    '''Get the cpu cycles counted so far'''
+    return struct.unpack("Q", os.read(fd, 8))[0]
+
+def measurecyclefrequency(duration_ns = CLOCK_MEASUREMENT_NS):
+    '''Measure the effective frequency of the calling thread's core in MHz,
+       by counting its cycles while busy. None if the counter is not available'''
+    fd = opencyclecounter()
+    if (None == fd):
+        return None
+    try:
+        startcycles = readcyclecounter(fd)
+        starttime = time.perf_counter_ns()
+        endtime = starttime + duration_ns
+        while (time.perf_counter_ns() < endtime):
+            pass
+        cycles = readcyclecounter(fd) - startcycles
+        elapsed_ns = time.perf_counter_ns() - starttime
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    # No cycles are counted, e.g. on virtual machines without a PMU
+    if (0 == cycles):
+        return None
+    return cycles / (elapsed_ns * CONVERT_NS_TO_US)
+
+def measurecorefrequency(core):
+    '''Measure the effective frequency of the core in MHz.
+       Returns the frequency and its source'''
+    frequency = None
+    # Cycles are counted on the core, by moving the calling thread there for the measurement
+    try:
+        affinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, [core])
+        try:
+            frequency = measurecyclefrequency()
+        finally:
+            os.sched_setaffinity(0, affinity)
+    except OSError:
+        # Core not available to this process
+        pass
+    if (None != frequency):
+        return frequency, CLOCK_SOURCE_CYCLES
+
+    frequency = readscalingfrequency(core)
+    if (None != frequency):
+        return frequency, CLOCK_SOURCE_SCALING
+
+    frequency = readcpuinfofrequency(core)
+    if (None != frequency):
+        return frequency, CLOCK_SOURCE_CPUINFO
+
+    return CPU_FREQ_MHZ, CLOCK_SOURCE_ASSUMED
+
+def getcyclesperbyte(time_ns, frequency_mhz, nbytes):
+    '''Get the cpu cycles per byte, for the time taken to process nbytes'''
+    return (time_ns * frequency_mhz / 1000) / nbytes
@@ -0,0 +1,106 @@
+"""
+This module provides the cpu accounting of the sender and receiver nodes.
+
+It includes :
+    * Class measuring the cpu time of each frame from the thread cpu clock,
+      as a share of the frame period, and the utilization of the node over
+      fixed windows as a time series in shared memory
+
+"""
+################################################################################
+# Imports
+################################################################################
+import time
+import numpy as np
+from perf_metrics.sample_ring import SampleRing
+
+
+################################################################################
+# Macros
+################################################################################
+# Length of the windows, over which the utilization of the node is computed
+CPU_WINDOW_NS = 100_000_000
+
+# Number of windows kept in the time series, older windows are overwritten
+CPU_SERIES_CAPACITY = 1 << 12
+
+CONVERT_NS_TO_S = 1/ 1_000_000_000
+
+
+################################################################################
+# Classes
+################################################################################
+class CpuAccounting:
+    '''Represents the cpu accounting of a node.
+       Created before the processes are forked, used by a single node process.
+       Cpu time is read from the clocks of the process (clock_gettime), without
+       reading /proc. A window is closed on the first frame after its end, so
+       windows with no frames are merged with the next one'''
+    def __init__(self, window_ns = CPU_WINDOW_NS, capacity = CPU_SERIES_CAPACITY):
+        self.window_ns = window_ns
+        # Utilization in % of one core, and the end of each window in s from the run start
+        self.utilization = SampleRing(capacity)
+        self.timestamps = SampleRing(capacity)
+        # Start of the run, of the previous frame and of the current window, local to the node process
+        self.runstart = None
+        self.framestart = None
+        self.windowstart = None
+        self.windowcpustart = None
+
+    def begin(self):
+        '''Get the cpu time of the calling thread, at the start of a frame'''
+        return time.thread_time_ns()
+
+    def end(self, cpustart, starttime, now):
+        '''Get the cpu percentage of the frame, i.e. its cpu time over the time since the
+           start of the previous frame. None for the first frame of the run.
+           starttime and now are the perf_counter_ns at the start and end of the frame.
+           Closes the current window if it ended before now'''
+        cpupercent = None
+        if ((None != self.framestart) and (starttime > self.framestart)):
+            cpupercent = 100 * (time.thread_time_ns() - cpustart) / (starttime - self.framestart)
+        self.framestart = starttime
+        if (None == self.windowstart):
+            self.runstart = self.windowstart = now
+            self.windowcpustart = time.process_time_ns()
+        elif ((now - self.windowstart) >= self.window_ns):
+            self.closewindow(now)
+        return cpupercent
+
+    def closewindow(self, now):
+        '''Add the utilization of the node from the window start to now, and start a new window.
+           Cpu time of all the threads of the node is counted (e.g. queue feeder threads)'''
+        cputime = time.process_time_ns()
+        self.utilization.append(100 * (cputime - self.windowcpustart) / (now - self.windowstart))
+        self.timestamps.append((now - self.runstart) * CONVERT_NS_TO_S)
+        self.windowstart = now
+        self.windowcpustart = cputime
+
+    def reset(self):
+        '''Remove the time series, e.g. at the start of a run. Not to be called while the node is running'''
+        self.utilization.reset()
+        self.timestamps.reset()
+
+    def getseries(self):
+        '''Get the end of each window in s and the utilization in %, as numpy views without copying'''
+        count = min(len(self.utilization), len(self.timestamps))
+        return self.timestamps.getsamples()[0:count], self.utilization.getsamples()[0:count]
+
+    def getrecord(self):
+        '''Get the record of the run, with the time series of the utilization'''
+        timestamps, utilization = self.getseries()
+        # Ring is rotated once full, the series is sorted back in time order
+        order = np.argsort(timestamps)
+        return {
+            "window_ms" : self.window_ns / 1_000_000,
+            "windows" : self.utilization.getcount(),
+            "mean_percent" : self.utilization.getsnapshot().mean,
+            "max_percent" : self.utilization.getsnapshot().getsummary()["max"],
+            "series" : [[round(float(timestamps[index]), 3), round(float(utilization[index]), 3)]
+                        for index in order]
+        }
+
+    def release(self):
+        '''Release the shared memory. Only called by the process that created it'''
+        self.utilization.release()
+        self.timestamps.release()
@@ -0,0 +1,182 @@
+"""
+This module provides the tracing of the frames through the sender and receiver nodes.
+
+It includes :
+    * Class recording the spans of each frame in a node process (e.g. encrypt,
+      send, recv wakeup, MAC verify, decrypt), with the frame ID shared by
+      the sender and the receiver, written as a compact binary file
+    * Functions converting the spans of the nodes into Chrome trace events and
+      merging them into a JSON file, opened with chrome://tracing or Perfetto
+
+"""
+################################################################################
+# Imports
+################################################################################
+import array
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+################################################################################
+# Macros
+################################################################################
+# Spans, index into TRACE_SPAN_NAMES
+TRACE_SPAN_ENCRYPT = 0
+TRACE_SPAN_SEND = 1
+TRACE_SPAN_KERNEL_RX = 2
+TRACE_SPAN_RECV_WAKEUP = 3
+TRACE_SPAN_MAC_VERIFY = 4
+TRACE_SPAN_DECRYPT = 5
+TRACE_SPAN_NAMES = ["encrypt", "send", "kernel RX", "recv wakeup", "MAC verify", "decrypt"]
+
+# Fields of a span: span, frame ID, start ns, end ns
+TRACE_SPAN_FIELDS = 4
+# End of the instant events
+TRACE_INSTANT = -1
+
+# Largest number of spans recorded per node, later spans are dropped.
+# About 64k receiver frames, converted to JSON in a few seconds when the simulation stops
+TRACE_MAX_SPANS = 1 << 18
+
+CONVERT_NS_TO_US = 1/ 1_000
+
+
+################################################################################
+# Classes
+################################################################################
+class FrameTracer:
+    '''Represents the tracing of a node process. Spans are kept in the process and
+       written as a binary file when the node stops, in milliseconds even if the node is
+       terminated shortly after. Timestamps are from perf_counter_ns (CLOCK_MONOTONIC),
+       comparable between the processes. Recording a span is a no-op when disabled'''
+    def __init__(self):
+        self.name = ""
+        self.enabled = False
+        # Flows of the frames are started by the sender and finished by the receiver
+        self.isreceiver = False
+        # Flat fields of the spans, end is TRACE_INSTANT for instant events
+        self.spans = array.array('q')
+        self.dropped = 0
+        self.frameid = 0
+        # Offset between the wall clock (e.g. kernel timestamps) and perf_counter_ns
+        self.walloffset_ns = 0
+        self.span = nospan
+        self.receive = nospan
+
+    def start(self, name, enabled, isreceiver = False):
+        '''Start tracing in the calling process, if enabled'''
+        self.name = name
+        self.enabled = enabled
+        self.isreceiver = isreceiver
+        self.spans = array.array('q')
+        self.dropped = 0
+        self.frameid = 0
+        self.walloffset_ns = time.time_ns() - time.perf_counter_ns()
+        self.span = self.addspan if (True == enabled) else nospan
+        self.receive = self.addreceive if (True == enabled) else nospan
+
+    def beginframe(self, frameid):
+        '''Set the frame ID of the next spans'''
+        self.frameid = frameid
+
+    def addspan(self, span, starttime, endtime = None):
+        '''Record a span of the current frame, from starttime to endtime (now by default).
+           Returns the end of the span, e.g. as the start of the next one'''
+        if (None == endtime):
+            endtime = time.perf_counter_ns()
+        if (len(self.spans) < (TRACE_MAX_SPANS * TRACE_SPAN_FIELDS)):
+            self.spans.extend((span, self.frameid, starttime, endtime))
+        else:
+            self.dropped += 1
+        return endtime
+
+    def addreceive(self, kerneltimestamp, wakeuptime):
+        '''Record the kernel RX of the current frame, from its kernel timestamp (wall clock, s),
+           and the recv wakeup span, from the kernel RX until recv returned'''
+        kernelrxtime = int(kerneltimestamp * 1_000_000_000) - self.walloffset_ns
+        if (len(self.spans) < ((TRACE_MAX_SPANS - 1) * TRACE_SPAN_FIELDS)):
+            self.spans.extend((TRACE_SPAN_KERNEL_RX, self.frameid, kernelrxtime, TRACE_INSTANT,
+                               TRACE_SPAN_RECV_WAKEUP, self.frameid, kernelrxtime, wakeuptime))
+        else:
+            self.dropped += 2
+
+    def write(self, path):
+        '''Write the spans of the node to the binary file (.npz), if enabled.
+           Written to a temporary file first, the file is never partially written'''
+        if (False == self.enabled):
+            return
+        if (self.dropped > 0):
+            print(f"[Warning] {self.name}: {self.dropped} trace spans dropped")
+        temppath = path + ".tmp"
+        with open(temppath, "wb") as fp:
+            np.savez(fp,
+                     spans=np.frombuffer(self.spans, dtype=np.int64).reshape(-1, TRACE_SPAN_FIELDS),
+                     name=np.array(self.name),
+                     pid=np.array(os.getpid()),
+                     tid=np.array(threading.get_native_id()),
+                     isreceiver=np.array(self.isreceiver))
+        os.replace(temppath, path)
+
+
+################################################################################
+# Functions
+################################################################################
+def nospan(*args):
+    '''Span function when tracing is disabled'''
+    pass
+
+def gettraceevents(spans, name, pid, tid, isreceiver):
+    '''Get the spans of a node as Chrome trace events. Frames are linked across the nodes by a flow,
+       from the end of their first span in the sender to their first span in the receiver'''
+    events = [{"name" : "process_name", "ph" : "M", "pid" : pid, "tid" : tid,
+               "args" : {"name" : name}}]
+    flows = set()
+    for span, frameid, starttime, endtime in spans.tolist():
+        event = {"name" : TRACE_SPAN_NAMES[span], "cat" : "frame", "pid" : pid, "tid" : tid,
+                 "ts" : starttime * CONVERT_NS_TO_US, "args" : {"frame" : frameid}}
+        if (TRACE_INSTANT == endtime):
+            event.update({"ph" : "i", "s" : "p"})
+        else:
+            event.update({"ph" : "X", "dur" : (endtime - starttime) * CONVERT_NS_TO_US})
+        events.append(event)
+        if (frameid not in flows):
+            flows.add(frameid)
+            flowtime = starttime if ((TRACE_INSTANT == endtime) or (True == isreceiver)) else endtime
+            events.append({"name" : "frame", "cat" : "frame", "id" : frameid, "pid" : pid, "tid" : tid,
+                           "ph" : "f" if (True == isreceiver) else "s",
+                           "bp" : "e", "ts" : flowtime * CONVERT_NS_TO_US})
+    return events
+
+def readtrace(path):
+    '''Read the binary file of a node, returns its Chrome trace events'''
+    with np.load(path) as trace:
+        return gettraceevents(trace["spans"], str(trace["name"]), int(trace["pid"]),
+                              int(trace["tid"]), bool(trace["isreceiver"]))
+
+def mergetraces(paths, output):
+    '''Merge the spans of the nodes into a Chrome trace JSON file, converted here
+       rather than in the nodes. Files of the nodes are removed, missing files are skipped'''
+    events = []
+    for path in paths:
+        try:
+            events.extend(readtrace(path))
+        except (OSError, ValueError, KeyError):
+            print("[Warning] Trace of the node is not available: " + path)
+        # Files of the node are not kept, e.g. left by a node terminated while writing
+        for eachpath in (path, path + ".tmp"):
+            if (True == os.path.exists(eachpath)):
+                os.remove(eachpath)
+    if (len(events) > 0):
+        with open(output, "w") as fp:
+            # Encoded at once, json.dump encodes a file in pure Python and is several times slower
+            fp.write(json.dumps({"traceEvents" : events, "displayTimeUnit" : "ns"}))
+
+
+################################################################################
+# Tracer
+################################################################################
+# Tracer of the process, started by each node process
+g_tracer = FrameTracer()
@@ -0,0 +1,109 @@
+"""
+This module provides the ring buffers of the performance samples in shared memory.
+
+It includes :
+    * Class with a ring buffer of float64 samples in shared memory, written by
+      one process and read zero-copy by the others, with the streaming
+      statistics of all its samples
+    * Class with the ring buffers of a list of algorithms
+
+"""
+################################################################################
+# Imports
+################################################################################
+from multiprocessing import shared_memory
+import numpy as np
+from perf_metrics.streaming_statistics import StreamingStatistics
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of samples kept per ring buffer, older samples are overwritten
+SAMPLE_RING_CAPACITY = 1 << 16
+
+# Header before the samples: number of samples written so far (uint64)
+SAMPLE_RING_HEADER_SIZE = 8
+SAMPLE_SIZE = 8
+
+
+################################################################################
+# Classes
+################################################################################
+class SampleRing:
+    '''Represents a ring buffer of float64 samples in shared memory.
+       Created before the processes are forked, written by a single process.
+       The count is written after the sample, so readers never see an unwritten sample'''
+    def __init__(self, capacity = SAMPLE_RING_CAPACITY):
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True,
+                                                 size=SAMPLE_RING_HEADER_SIZE + capacity * SAMPLE_SIZE)
+        # Views for writing a single value, cheaper than the numpy view
+        self.countview = self.memory.buf[0:SAMPLE_RING_HEADER_SIZE].cast('Q')
+        self.sampleview = self.memory.buf[SAMPLE_RING_HEADER_SIZE:].cast('d')
+        # Numpy view for reading, without copying
+        self.samples = np.ndarray((capacity,), dtype=np.float64, buffer=self.memory.buf,
+                                  offset=SAMPLE_RING_HEADER_SIZE)
+        self.countview[0] = 0
+        # Statistics of all the samples, including the overwritten ones
+        self.statistics = StreamingStatistics()
+
+    def append(self, value):
+        '''Add a sample, overwriting the oldest one if the ring is full'''
+        count = self.countview[0]
+        self.sampleview[count % self.capacity] = value
+        self.countview[0] = count + 1
+        self.statistics.add(value)
+
+    def reset(self):
+        '''Remove all the samples. Not to be called while the writer is running'''
+        self.countview[0] = 0
+        self.statistics.reset()
+
+    def getsnapshot(self):
+        '''Get the statistics of all the samples so far, e.g. while the writer is running'''
+        return self.statistics.getsnapshot()
+
+    def getcount(self):
+        '''Get the number of samples written so far, including the overwritten ones'''
+        return self.countview[0]
+
+    def __len__(self):
+        '''Get the number of samples in the ring'''
+        return min(self.countview[0], self.capacity)
+
+    def getsamples(self):
+        '''Get the samples in the ring, as a numpy view without copying.
+           Samples are in write order until the ring is full, then the order is rotated'''
+        return self.samples[0:len(self)]
+
+    def release(self):
+        '''Release the shared memory. Only called by the process that created the ring'''
+        self.samples = None
+        self.countview.release()
+        self.sampleview.release()
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views returned by getsamples are still in use, mapping is removed at exit
+            pass
+        self.memory.unlink()
+
+
+class SampleRings:
+    '''Represents the ring buffers of a list of algorithms, algorithm name -> SampleRing'''
+    def __init__(self, names, capacity = SAMPLE_RING_CAPACITY):
+        self.rings = {name : SampleRing(capacity) for name in names}
+
+    def __getitem__(self, name):
+        return self.rings[name]
+
+    def items(self):
+        '''Get the algorithm names and their ring buffers'''
+        return self.rings.items()
+
+    def release(self):
+        '''Release the shared memory of all the ring buffers'''
+        for ring in self.rings.values():
+            ring.release()
+        self.rings = {}
@@ -0,0 +1,178 @@
+"""
+This module provides the statistics of the performance samples, updated per sample.
+
+It includes :
+    * Class with the mean/variance (Welford) and a log-linear histogram of the
+      samples in shared memory, at a fixed memory per metric
+    * Class with a snapshot of the statistics, mergeable with other snapshots,
+      for the mean, quantiles, max and jitter at any moment
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import math
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+
+################################################################################
+# Macros
+################################################################################
+# Buckets per power of 2, the relative error of the quantiles is below 1/HISTOGRAM_SUB_BUCKETS
+HISTOGRAM_SUB_BUCKETS = 128
+
+# Range of the histogram, as powers of 2. Smaller and larger samples are counted
+# in the first and last bucket, the mean, min and max are exact
+HISTOGRAM_EXPONENT_MIN = -16
+HISTOGRAM_EXPONENT_MAX = 48
+HISTOGRAM_BUCKETS = (HISTOGRAM_EXPONENT_MAX - HISTOGRAM_EXPONENT_MIN) * HISTOGRAM_SUB_BUCKETS
+
+# Quantiles reported in the summary
+STATISTICS_QUANTILES = {
+    "p50" : 0.50,
+    "p95" : 0.95,
+    "p99" : 0.99,
+    "p99.9" : 0.999
+}
+
+# Index of the moments in the shared array
+MOMENT_COUNT = 0
+MOMENT_MEAN = 1
+MOMENT_M2 = 2
+MOMENT_MIN = 3
+MOMENT_MAX = 4
+MOMENT_SIZE = 5
+
+
+################################################################################
+# Classes
+################################################################################
+class StreamingStatistics:
+    '''Represents the statistics of a metric, updated per sample in shared memory.
+       Created before the processes are forked, written by a single process.
+       Readers take a snapshot at any moment, without stopping the writer'''
+    def __init__(self):
+        self.moments = RawArray(ctypes.c_double, MOMENT_SIZE)
+        self.buckets = RawArray(ctypes.c_int64, HISTOGRAM_BUCKETS)
+        # Views for updating a single value, cheaper than indexing the ctypes arrays
+        self.momentview = memoryview(self.moments).cast('B').cast('d')
+        self.bucketview = memoryview(self.buckets).cast('B').cast('q')
+        self.reset()
+
+    def add(self, value):
+        '''Add a sample'''
+        moments = self.momentview
+        # Welford's online mean and variance
+        count = moments[MOMENT_COUNT] + 1
+        delta = value - moments[MOMENT_MEAN]
+        mean = moments[MOMENT_MEAN] + delta / count
+        moments[MOMENT_M2] += delta * (value - mean)
+        moments[MOMENT_MEAN] = mean
+        if (value < moments[MOMENT_MIN]):
+            moments[MOMENT_MIN] = value
+        if (value > moments[MOMENT_MAX]):
+            moments[MOMENT_MAX] = value
+        self.bucketview[getbucket(value)] += 1
+        # Count is written last, readers use it as the number of complete samples
+        moments[MOMENT_COUNT] = count
+
+    def reset(self):
+        '''Remove all the samples. Not to be called while the writer is running'''
+        self.moments[MOMENT_COUNT] = 0
+        self.moments[MOMENT_MEAN] = 0
+        self.moments[MOMENT_M2] = 0
+        self.moments[MOMENT_MIN] = math.inf
+        self.moments[MOMENT_MAX] = -math.inf
+        ctypes.memset(self.buckets, 0, ctypes.sizeof(self.buckets))
+
+    def getcount(self):
+        '''Get the number of samples'''
+        return int(self.moments[MOMENT_COUNT])
+
+    def getsnapshot(self):
+        '''Get a copy of the statistics. Taken while the writer is running,
+           the last sample may be counted in the moments and not in the histogram'''
+        return StatisticsSnapshot(self.moments[MOMENT_COUNT], self.moments[MOMENT_MEAN],
+                                  self.moments[MOMENT_M2], self.moments[MOMENT_MIN],
+                                  self.moments[MOMENT_MAX],
+                                  np.ctypeslib.as_array(self.buckets).copy())
+
+
+class StatisticsSnapshot:
+    '''Represents the statistics of a metric at a moment'''
+    def __init__(self, count = 0, mean = 0, m2 = 0, minimum = math.inf, maximum = -math.inf,
+                 buckets = None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+        if (buckets is None):
+            buckets = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self.buckets = buckets
+
+    def merge(self, other):
+        '''Get the statistics of the samples of both snapshots (e.g. several runs or processes)'''
+        count = self.count + other.count
+        if (0 == count):
+            return StatisticsSnapshot()
+        # Chan's parallel combination of the mean and variance
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        return StatisticsSnapshot(count, mean, m2, min(self.minimum, other.minimum),
+                                  max(self.maximum, other.maximum), self.buckets + other.buckets)
+
+    def getquantile(self, quantile):
+        '''Get the quantile of the samples, from the histogram'''
+        total = int(self.buckets.sum())
+        if (0 == total):
+            return 0
+        # Rank of the sample, the first bucket reaching it holds the quantile
+        rank = max(1, math.ceil(quantile * total))
+        bucket = int(np.searchsorted(np.cumsum(self.buckets), rank))
+        # Bucket value is bounded by the exact min and max
+        return min(max(getbucketvalue(bucket), self.minimum), self.maximum)
+
+    def getjitter(self):
+        '''Get the standard deviation of the samples'''
+        if (self.count < 1):
+            return 0
+        return math.sqrt(max(self.m2, 0) / self.count)
+
+    def getsummary(self):
+        '''Get the count, mean, quantiles, max and jitter of the samples'''
+        summary = {
+            "count" : int(self.count),
+            "mean" : self.mean,
+        }
+        for name, quantile in STATISTICS_QUANTILES.items():
+            summary[name] = self.getquantile(quantile)
+        summary["max"] = self.maximum if (self.count > 0) else 0
+        summary["jitter"] = self.getjitter()
+        return summary
+
+
+################################################################################
+# Functions
+################################################################################
+def getbucket(value):
+    '''Get the histogram bucket of a sample'''
+    if (value <= 0):
+        return 0
+    # value = mantissa * 2^exponent, mantissa in [0.5, 1)
+    mantissa, exponent = math.frexp(value)
+    if (exponent <= HISTOGRAM_EXPONENT_MIN):
+        return 0
+    if (exponent > HISTOGRAM_EXPONENT_MAX):
+        return HISTOGRAM_BUCKETS - 1
+    return ((exponent - HISTOGRAM_EXPONENT_MIN - 1) * HISTOGRAM_SUB_BUCKETS
+            + int((mantissa - 0.5) * 2 * HISTOGRAM_SUB_BUCKETS))
+
+def getbucketvalue(bucket):
+    '''Get the value representing a histogram bucket, the middle of the bucket'''
+    exponent, subbucket = divmod(bucket, HISTOGRAM_SUB_BUCKETS)
+    mantissa = 0.5 + (subbucket + 0.5) / (2 * HISTOGRAM_SUB_BUCKETS)
+    return math.ldexp(mantissa, exponent + HISTOGRAM_EXPONENT_MIN + 1)
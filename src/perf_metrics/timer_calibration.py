@@ -0,0 +1,97 @@
+"""
+This module provides the calibration of the timer used for the per-frame timings.
+
+It includes :
+    * Class measuring the cost of an empty timed region in a process, i.e. the
+      timer itself and the dispatch around the timed call, in shared memory
+    * Functions correcting the timings by this bias, and flagging the timings
+      within the noise of the timer floor
+
+"""
+################################################################################
+# Imports
+################################################################################
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+
+################################################################################
+# Macros
+################################################################################
+# Number of empty regions timed, the median is used
+TIMER_CALIBRATION_REPEATS = 5_000
+
+# Timings below the bias plus this many times the noise are flagged
+TIMER_FLOOR_NOISE_FACTOR = 3
+
+# Index of the calibration in the shared array
+TIMER_STAT_CALIBRATED = 0
+# Cost of two back to back timer reads
+TIMER_STAT_FLOOR_NS = 1
+# Cost of the empty timed region, above the timer floor (e.g. state reads and calls)
+TIMER_STAT_DISPATCH_NS = 2
+# Spread of the empty timed region (p95 - p50), at least the timer resolution
+TIMER_STAT_NOISE_NS = 3
+TIMER_STAT_COUNT = 4
+
+
+################################################################################
+# Classes
+################################################################################
+class TimerCalibration:
+    '''Represents the timer calibration of a process, in shared memory.
+       Measured by the process doing the timings (e.g. a node, pinned to its core),
+       read by the other processes (e.g. UI)'''
+    def __init__(self):
+        self.statistics = RawArray(ctypes.c_double, TIMER_STAT_COUNT)
+
+    def calibrate(self, emptyregion, repeats = TIMER_CALIBRATION_REPEATS):
+        '''Measure the timer floor and the cost of the empty region.
+           emptyregion times a region without work, as the measured one, and returns its ns'''
+        floor = np.array([measuretimerfloor() for _ in range(repeats)], dtype=np.float64)
+        region = np.array([emptyregion() for _ in range(repeats)], dtype=np.float64)
+        floor_ns = float(np.median(floor))
+        p50, p95 = np.percentile(region, [50, 95])
+        resolution_ns = time.get_clock_info("perf_counter").resolution * 1_000_000_000
+        self.statistics[TIMER_STAT_FLOOR_NS] = floor_ns
+        self.statistics[TIMER_STAT_DISPATCH_NS] = max(float(p50) - floor_ns, 0)
+        self.statistics[TIMER_STAT_NOISE_NS] = max(float(p95 - p50), resolution_ns)
+        self.statistics[TIMER_STAT_CALIBRATED] = 1
+
+    def iscalibrated(self):
+        '''True, if the calibration was measured'''
+        return (1 == self.statistics[TIMER_STAT_CALIBRATED])
+
+    def getrecord(self):
+        '''Get the record of the calibration, None if not measured'''
+        if (False == self.iscalibrated()):
+            return None
+        return {
+            "floor_ns" : round(self.statistics[TIMER_STAT_FLOOR_NS], 3),
+            "dispatch_ns" : round(self.statistics[TIMER_STAT_DISPATCH_NS], 3),
+            "bias_ns" : round(self.statistics[TIMER_STAT_FLOOR_NS] + self.statistics[TIMER_STAT_DISPATCH_NS], 3),
+            "noise_ns" : round(self.statistics[TIMER_STAT_NOISE_NS], 3)
+        }
+
+
+################################################################################
+# Functions
+################################################################################
+def measuretimerfloor():
+    '''Time an empty region, the cost of the timer itself'''
+    starttime = time.perf_counter_ns()
+    return time.perf_counter_ns() - starttime
+
+def correcttiming(time_ns, record):
+    '''Get the timing without the bias of the calibration record, unchanged if not calibrated'''
+    if (None == record):
+        return time_ns
+    return max(time_ns - record["bias_ns"], 0)
+
+def isneartimerfloor(time_ns, record):
+    '''True, if the timing is within the noise of the timer floor, i.e. mostly measurement cost'''
+    if (None == record):
+        return False
+    return (time_ns <= record["bias_ns"] + TIMER_FLOOR_NOISE_FACTOR * record["noise_ns"])
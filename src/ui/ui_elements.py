@@ -23,6 +23,7 @@ from tkinter import Toplevel, Label, Button
 import matplotlib.pyplot as plt
 import json
 import threading
+import atexit
 
 
 
@@ -52,6 +53,11 @@ REPLAYSIM_DEINIT = 5
 # Periodicity to print messages in the console
 CONSOLE_LOGGING_PERIOD = 335
 
+# Frames added to each console per period, older frames are dropped (e.g. at 1 ms periodicity)
+CONSOLE_BATCH_MAX = 200
+# Lines kept in each console, the oldest are removed
+CONSOLE_MAX_LINES = 2000
+
 # Counter Update Period for Encryption Mechanism
 COUNTER_UPDATE_PERIOD = 100
 
@@ -203,6 +209,12 @@ mac_gen_algo =[
     "SHA256-HMAC"
 ]
 
+# Sizes that can be selected for the verification window of the receiver
+decryption_window_sizes = [2, 4, 8, 16, 32, 64]
+
+# Widths that can be selected for the anti-replay window of the receiver, 0 to disable
+replay_window_widths = [0, 64, 256, 1024, 4096]
+
 
 ################################################################################
 # Globals
@@ -212,18 +224,19 @@ en_perfmetrics = {}
 de_perfmetrics = {}
 # For saving the deadline miss ratio
 deadlinemiss = {}
+# For saving the key setup time
+keysetup = {}
 
-#Multiprocessing Queues
-ui_senderqueue = None
-ui_receiverqueue = None
+# Console feeds of the sender and receiver, frame records in shared memory
+ui_senderfeed = None
+ui_receiverfeed = None
 
 # Shared Variables
 deadlinemisscounts = None
 sentmessagescount = None
 simulationstate = None
 
-#Shared variables for collecting the encrypt and decrypt time samples
-manager = None
+#Shared ring buffers for collecting the encrypt and decrypt time samples
 encrypt_samples = None
 decrypt_samples = None
 encrypt_cpuper = None
@@ -242,6 +255,16 @@ counterthread = None
 #For replay attack simulation
 replayattacksimthread = None
 
+# Clock calibration of the sender and receiver cores, for the running simulation
+sender_clock = None
+receiver_clock = None
+# Clock records of the last run of each algorithm, for cycles/byte
+clockrecords = {}
+# Utilization records of the sender and receiver, for the last run of each algorithm
+cpuloadrecords = {}
+# Timer calibration records of the sender and receiver, for the last run of each algorithm
+timerrecords = {}
+
 ################################################################################
 # Classes
 ################################################################################
@@ -249,7 +272,7 @@ class CANSimGUI(tb.Window):
     '''Represents the UI'''
     def __init__(self):
         global encrypt_samples, decrypt_samples, encrypt_cpuper , decrypt_cpuper, ready_event
-        global manager 
+        global ui_senderfeed, ui_receiverfeed
 
         #----------------------------------- Callbacks for simulation------------------------------#
         self.startsimcallback = None
@@ -348,6 +371,8 @@ class CANSimGUI(tb.Window):
                                             value=algo, bootstyle="info"))
             self.rb_cryalgo_tab[index].pack(side="top", anchor="w", padx=20, pady=5)
             index = index + 1
+        # Select the backends of all the algorithms, calibrated only if not cached for this host
+        calibrateallbackends()
         # To set the encryption algorithm as RC4, initially
         setencryptionalgo("RC4")
 
@@ -381,13 +406,22 @@ class CANSimGUI(tb.Window):
         coldata = [
         {"text": "Algorithm", "stretch": True},
         {"text":"enc_Mean (us)", "stretch": True},
+        {"text":"enc_Mean corrected (us)", "stretch": True},
         {"text":"enc_p95 (us)", "stretch": True},
+        {"text":"enc_p99.9 (us)", "stretch": True},
         {"text":"dec_Mean (us)", "stretch": True},
+        {"text":"dec_Mean corrected (us)", "stretch": True},
         {"text":"dec_p95 (us)", "stretch": True},
+        {"text":"dec_p99.9 (us)", "stretch": True},
+        {"text":"tx→rx mean/p99 (us)", "stretch": True},
+        {"text":"tx→plaintext mean/p99 (us)", "stretch": True},
+        {"text":"key setup (us)", "stretch": True},
         {"text": "enc cycles/byte", "stretch": True},
         {"text": "dec cycles/byte", "stretch": True},
+        {"text": "cpu MHz enc/dec", "stretch": True},
         {"text": "enc cpu %", "stretch": True},
         {"text": "dec cpu %", "stretch": True},
+        {"text": "node load % enc/dec", "stretch": True},
         {"text": "deadline miss ratio %", "stretch": True}
         ]
 
@@ -408,6 +442,8 @@ class CANSimGUI(tb.Window):
         self.nonce_creation_option = tk.StringVar()
         self.keystream_gen_option = tk.StringVar()
         self.mac_gen_option = tk.StringVar()
+        self.decryption_window_option = tk.StringVar()
+        self.replay_window_option = tk.StringVar()
         # For encryption enabled/disabled state, initial state is false
         self.encscheme_state = tk.BooleanVar(value=False)
         self.replaysim_start = tk.BooleanVar(value=False)
@@ -474,6 +510,28 @@ class CANSimGUI(tb.Window):
         self.encschemeconf_combobox3.pack(side="left", padx=10, pady=5)
         self.mac_gen_option.set(mac_gen_algo[0])
 
+        encschemeconf_childframe8 = tb.Frame(encryption_scheme_subframe1)
+        encschemeconf_childframe8.pack(side="top", fill=tk.X)
+        encschemeconf_label8 = tb.Label(encschemeconf_childframe8, text=("Verification Window").ljust(16), 
+                                 bootstyle="info")
+        encschemeconf_label8.pack(side="left", padx=10, pady=5)
+        self.encschemeconf_combobox4 = tb.Combobox(encschemeconf_childframe8, 
+                                                   textvariable=self.decryption_window_option, 
+                                                   bootstyle="danger", values=decryption_window_sizes)
+        self.encschemeconf_combobox4.pack(side="left", padx=10, pady=5)
+        self.decryption_window_option.set(str(DECRYTPION_WINDOW))
+
+        encschemeconf_childframe9 = tb.Frame(encryption_scheme_subframe1)
+        encschemeconf_childframe9.pack(side="top", fill=tk.X)
+        encschemeconf_label9 = tb.Label(encschemeconf_childframe9, text=("Anti-Replay Window").ljust(16), 
+                                 bootstyle="info")
+        encschemeconf_label9.pack(side="left", padx=10, pady=5)
+        self.encschemeconf_combobox5 = tb.Combobox(encschemeconf_childframe9, 
+                                                   textvariable=self.replay_window_option, 
+                                                   bootstyle="danger", values=replay_window_widths)
+        self.encschemeconf_combobox5.pack(side="left", padx=10, pady=5)
+        self.replay_window_option.set(str(ANTI_REPLAY_WINDOW))
+
         self.encschemeupdatebtn = tb.Button(encryption_scheme_subframe1, text="Update",
                                    bootstyle="info", command=self.do_encschemeupdate)
         self.encschemeupdatebtn.pack(anchor=tk.SE, padx=10, pady=5)
@@ -498,6 +556,30 @@ class CANSimGUI(tb.Window):
                                  bootstyle="info")
         receivercounter_label.pack(side="top", padx=10, pady=10)
 
+        encschemeconf_childframe7 = tb.Frame(encryption_scheme_subframe2)
+        encschemeconf_childframe7.pack(side="left", padx=10, fill=tk.X)
+        self.lookahead_entry = tb.Entry(encschemeconf_childframe7,width=16)
+        self.lookahead_entry.pack(side="top", padx=10, pady=10)
+        lookahead_label = tb.Label(encschemeconf_childframe7, text="Keystream hit % / saved us", 
+                                 bootstyle="info")
+        lookahead_label.pack(side="top", padx=10, pady=10)
+
+        encschemeconf_childframe10 = tb.Frame(encryption_scheme_subframe2)
+        encschemeconf_childframe10.pack(side="left", padx=10, fill=tk.X)
+        self.attempts_entry = tb.Entry(encschemeconf_childframe10,width=16)
+        self.attempts_entry.pack(side="top", padx=10, pady=10)
+        attempts_label = tb.Label(encschemeconf_childframe10, text="MAC attempts / accepted", 
+                                 bootstyle="info")
+        attempts_label.pack(side="top", padx=10, pady=10)
+
+        encschemeconf_childframe11 = tb.Frame(encryption_scheme_subframe2)
+        encschemeconf_childframe11.pack(side="left", padx=10, fill=tk.X)
+        self.livelatency_entry = tb.Entry(encschemeconf_childframe11,width=16)
+        self.livelatency_entry.pack(side="top", padx=10, pady=10)
+        livelatency_label = tb.Label(encschemeconf_childframe11, text="Live enc / dec p99 (us)", 
+                                 bootstyle="info")
+        livelatency_label.pack(side="top", padx=10, pady=10)
+
         # For Encription Scheme Description
         encryption_scheme_subframe3 = tb.Frame(encryption_scheme_masterframe1)
         encryption_scheme_subframe3.pack(fill="both", padx=10)
@@ -573,32 +655,39 @@ class CANSimGUI(tb.Window):
         # Set simulation state to STOPPED, initially
         self.simulation = STOPPED
 
-        #Initialize the Shared variables to capture the performance metrics
-        manager = Manager()
-        encrypt_samples = manager.dict()
-        decrypt_samples = manager.dict()
-        encrypt_cpuper = manager.dict()
-        decrypt_cpuper = manager.dict()
+        #Initialize the Shared ring buffers to capture the performance metrics, for each algorithm
+        encrypt_samples = SampleRings(ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"])
+        decrypt_samples = SampleRings(ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"])
+        encrypt_cpuper = SampleRings(ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"])
+        decrypt_cpuper = SampleRings(ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"])
+        # Shared memory is released when the UI exits
+        for eachrings in (encrypt_samples, decrypt_samples, encrypt_cpuper, decrypt_cpuper):
+            atexit.register(eachrings.release)
+        # Utilization of the sender and receiver over CPU_WINDOW_NS windows, shared with the nodes
+        initializecpuaccounting()
+        atexit.register(deinitcpuaccounting)
+        # Bias of the timings, measured by the nodes on their cores
+        initializetimercalibration()
+        # End-to-end latency of the frames, from the sender transmit to the receiver
+        initializebuslatency(ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"])
+        atexit.register(deinitbuslatency)
+        # Frame records of the nodes for the consoles, read in batches
+        ui_senderfeed = ConsoleFeed()
+        ui_receiverfeed = ConsoleFeed()
         ready_event = multiprocessing.Event()
-        
-        #Initialize the samples array in the performance Metrics array for each algorithm
-        for algo in (ENCRYPTION_ALGORITHMS + ["ENCRYPTION_SCHEME"]):
-            encrypt_samples[algo] = []
-            decrypt_samples[algo] = []
-            encrypt_cpuper[algo] = []
-            decrypt_cpuper[algo] = []
 
     def getcipherdescription(self, algo):
         return cipherdescription[algo]
     
     def do_start_stop_simulation(self):
         '''Function called on pressing the Start/Stop button'''
-        global ui_receiverqueue, ui_senderqueue
+        global ui_receiverfeed, ui_senderfeed
         global deadlinemisscounts, sentmessagescount
         global simulationstate
         global encrypt_samples, encrypt_cpuper
         global decrypt_samples, decrypt_cpuper
         global counterthread
+        global sender_clock, receiver_clock, clockrecords, cpuloadrecords, timerrecords
 
         #If simulation is already started
         if (self.simulation == STARTED):
@@ -607,13 +696,28 @@ class CANSimGUI(tb.Window):
             self.start_stop_btn.config(text="▶ Start Simulation", bootstyle="success")
             #Call the stop simulation callback 
             self.stopsimcallback(simulationstate)
+            # Measure the frequency of the cores at run end, and record it for the algorithm
+            sender_clock.stop()
+            receiver_clock.stop()
+            clockrecords[self.selected_algo.get()] = {
+                "encryption_samples" : sender_clock.getrecord(),
+                "decryption_samples" : receiver_clock.getrecord()
+            }
+            # Record the utilization time series of the nodes for the algorithm
+            cpuloadrecords[self.selected_algo.get()] = getcpuaccountingrecords()
+            # Record the timer calibration of the nodes, for the bias-corrected timings
+            timerrecords[self.selected_algo.get()] = gettimercalibrationrecords()
+            for eachclock in (sender_clock, receiver_clock):
+                if (True == eachclock.isdrifted()):
+                    print(f"[Warning] Frequency of core {eachclock.core} drifted by "
+                          f"{100 * eachclock.getdrift():.1f}% during the run")
             self.inserttotableview(None)
         
         #If simulation is Stopped
         elif(self.simulation == STOPPED):
             #Create a multiprocessing queue for sender and receiver
-            ui_senderqueue = multiprocessing.Queue()
-            ui_receiverqueue = multiprocessing.Queue()
+            ui_senderfeed.reset()
+            ui_receiverfeed.reset()
 
             # Shared variables
             # Simulation State. Simulation will stop, once the state becomes False
@@ -630,11 +734,21 @@ class CANSimGUI(tb.Window):
             
             # Only if the encrypton scheme is enabled, start tasks for counter update
             if(True == self.encscheme_state.get()):
+                resetlookaheadstatistics()
                 # To display the status of benchmark process
                 counterthread = threading.Thread(target = self.update_counters, args = ())
                 counterthread.start()
+            # Utilization time series of the nodes starts with the run
+            resetcpuaccounting()
+            # Sequence numbers of the frames restart with the run
+            resetbuslatency()
+            # Measure the frequency of the cores at run start, before the nodes are pinned there
+            sender_clock = ClockCalibration(SENDER_CORE)
+            receiver_clock = ClockCalibration(RECEIVER_CORE)
+            sender_clock.start()
+            receiver_clock.start()
             #Call the start simulation callback
-            self.startsimcallback(ui_senderqueue, ui_receiverqueue, simulationstate, 
+            self.startsimcallback(ui_senderfeed, ui_receiverfeed, simulationstate, 
                                   deadlinemisscounts, sentmessagescount,
                                   encrypt_samples, encrypt_cpuper,
                                   decrypt_samples, decrypt_cpuper,
@@ -646,36 +760,55 @@ class CANSimGUI(tb.Window):
 
     def printtosenderconsole(self):
         '''Function to print into the Sender Console text box'''
-        global ui_senderqueue
+        global ui_senderfeed
 
         if(STARTED == self.simulation):
-            if(None != ui_senderqueue):
-                #Print until the queue is empty
-                while not ui_senderqueue.empty():
-                    msg = ui_senderqueue.get()
-                    self.sender_console_text.insert(tk.END, "\n" + msg )
+            if(None != ui_senderfeed):
+                # Frames sent since the last period, formatted and inserted at once
+                batch, dropped = ui_senderfeed.getbatch(CONSOLE_BATCH_MAX)
+                lines = [formatconsolerecord(record)[0] for record in batch]
+                if (dropped > 0):
+                    lines.insert(0, f"... {dropped} frames not shown")
+                if (len(lines) > 0):
+                    self.sender_console_text.insert(tk.END, "\n" + "\n".join(lines))
+                    self.trimconsole(self.sender_console_text)
                     self.sender_console_text.see(tk.END)
             # schedule next check
         self.after(CONSOLE_LOGGING_PERIOD, self.printtosenderconsole)  
 
     def printtoreceiverconsole(self):
         '''Function to print into the Receiver Console text box'''
-        global ui_receiverqueue
+        global ui_receiverfeed
 
         if(STARTED == self.simulation):
-            if (None != ui_receiverqueue):
-                #Print until the queue is empty
-                while not ui_receiverqueue.empty():
-                    msg = ui_receiverqueue.get()
-                    # self.recv_console_text.insert(tk.END, )
-                    if (msg.__contains__("  ✅")):
-                        self.recv_console_text.insert(tk.END, "\n" + msg, "green_bold")
+            if (None != ui_receiverfeed):
+                # Frames received since the last period, formatted and inserted at once,
+                # consecutive frames with the same acceptance are inserted together
+                batch, dropped = ui_receiverfeed.getbatch(CONSOLE_BATCH_MAX)
+                chunks = []
+                if (dropped > 0):
+                    chunks.append([f"... {dropped} frames not shown", "red_bold"])
+                for record in batch:
+                    line, accepted = formatconsolerecord(record)
+                    tag = "green_bold" if (True == accepted) else "red_bold"
+                    if ((len(chunks) > 0) and (tag == chunks[-1][1])):
+                        chunks[-1][0] += "\n" + line
                     else:
-                        self.recv_console_text.insert(tk.END, "\n" + msg, "red_bold")
+                        chunks.append([line, tag])
+                for text, tag in chunks:
+                    self.recv_console_text.insert(tk.END, "\n" + text, tag)
+                if (len(chunks) > 0):
+                    self.trimconsole(self.recv_console_text)
                     self.recv_console_text.see(tk.END)
         # schedule next check
         self.after(CONSOLE_LOGGING_PERIOD, self.printtoreceiverconsole)  
 
+    def trimconsole(self, console):
+        '''Remove the oldest lines of the console, above CONSOLE_MAX_LINES'''
+        lines = int(console.index("end-1c").split(".")[0])
+        if (lines > CONSOLE_MAX_LINES):
+            console.delete("1.0", f"{lines - CONSOLE_MAX_LINES + 1}.0")
+
     def clearconsole(self):
         '''Function clears the console for both Sender and Receiver'''
         self.sender_console_text.delete("1.0", "end")
@@ -710,7 +843,7 @@ class CANSimGUI(tb.Window):
 
     def inserttotableview(self, text):
         '''Add contents to the Perfomance Metrics Table view'''
-        global en_perfmetrics, de_perfmetrics, deadlinemiss
+        global en_perfmetrics, de_perfmetrics, deadlinemiss, clockrecords, keysetup
         # Clear the contents first
         self.dt.delete_rows()
 
@@ -724,6 +857,7 @@ class CANSimGUI(tb.Window):
             en_perfmetrics = self.getperfmetrics("encryption_samples")
             de_perfmetrics = self.getperfmetrics("decryption_samples")
             deadlinemiss[self.selected_algo.get()] = '%.3f'%self.getdeadlinemissratio()
+            keysetup[self.selected_algo.get()] = '%.3f'%(getkeysetupcost() / us_DURATION)
            
             for eachAlgo in ENCRYPTION_ALGORITHMS:
                 # Only if the sample data is present
@@ -731,17 +865,61 @@ class CANSimGUI(tb.Window):
                     row = []
                     row.append(eachAlgo)
                     row.append(en_perfmetrics[eachAlgo]["mean_ns"])
+                    row.append(en_perfmetrics[eachAlgo]["mean_corrected"])
                     row.append(en_perfmetrics[eachAlgo]["p95"])
+                    row.append(en_perfmetrics[eachAlgo]["p99.9"])
                     row.append(de_perfmetrics[eachAlgo]["mean_ns"])
+                    row.append(de_perfmetrics[eachAlgo]["mean_corrected"])
                     row.append(de_perfmetrics[eachAlgo]["p95"])
+                    row.append(de_perfmetrics[eachAlgo]["p99.9"])
+                    row.extend(self.getbuslatencytext(eachAlgo))
+                    row.append(keysetup[eachAlgo])
                     row.append(en_perfmetrics[eachAlgo]["cycles/byte"])
                     row.append(de_perfmetrics[eachAlgo]["cycles/byte"])
+                    row.append(self.getclocktext(eachAlgo))
                     row.append(en_perfmetrics[eachAlgo]["cpu_percent"])
                     row.append(de_perfmetrics[eachAlgo]["cpu_percent"])
+                    row.append(self.getcpuloadtext(eachAlgo))
                     row.append(deadlinemiss[eachAlgo])
                     # Append row to the table view
                     self.dt.insert_row(values=row) 
     
+    def getclocktext(self, algo):
+        '''Get the measured cpu frequency of the run for the table view, flagged if it drifted'''
+        global clockrecords
+        if (algo not in clockrecords):
+            return '%.0f (assumed)'%(CPU_FREQ_MHZ)
+        enc = clockrecords[algo]["encryption_samples"]
+        dec = clockrecords[algo]["decryption_samples"]
+        text = '%.0f/%.0f'%(enc["frequency_mhz"], dec["frequency_mhz"])
+        if ((True == enc["drifted"]) or (True == dec["drifted"])):
+            text += " ⚠ drift"
+        return text
+
+    def getcpuloadtext(self, algo):
+        '''Get the mean and peak utilization of the sender and receiver for the table view'''
+        global cpuloadrecords
+        if ((algo not in cpuloadrecords) or (None == cpuloadrecords[algo])):
+            return "-"
+        enc = cpuloadrecords[algo]["encryption_samples"]
+        dec = cpuloadrecords[algo]["decryption_samples"]
+        return '%.1f/%.1f (max %.1f/%.1f)'%(enc["mean_percent"], dec["mean_percent"],
+                                            enc["max_percent"], dec["max_percent"])
+
+    def getbuslatencytext(self, algo):
+        '''Get the mean and p99 of the transmit-to-receive and transmit-to-plaintext latencies
+           for the table view'''
+        summary = getbuslatencysummary(algo)
+        if (None == summary):
+            return ["-", "-"]
+        texts = []
+        for key in ("tx_rx", "tx_plaintext"):
+            if (0 == summary[key]["count"]):
+                texts.append("-")
+            else:
+                texts.append('%.3f/%.3f'%(summary[key]["mean"], summary[key]["p99"]))
+        return texts
+
     def getdeadlinemissratio(self):
         '''Function to get the deadline miss ratio'''
         global deadlinemisscounts, sentmessagescount
@@ -770,7 +948,7 @@ class CANSimGUI(tb.Window):
         label.after(3000, self.update_label, label, pbar)
 
     def update_counters(self):
-        global simulationstate
+        global simulationstate, encrypt_samples, decrypt_samples
 
         # Clear the counter entries first
         self.sendercounter_entry.delete(0, END)
@@ -780,6 +958,24 @@ class CANSimGUI(tb.Window):
         rcounter = getreceivercounter()
         self.sendercounter_entry.insert(0, str(scounter))
         self.receivercounter_entry.insert(0, str(rcounter))
+        # Update the hit rate and the time saved per frame, by the precomputed keystreams
+        self.lookahead_entry.delete(0, END)
+        lookahead = getlookaheadstatistics()
+        if (None != lookahead):
+            self.lookahead_entry.insert(0, '%.1f / %.3f'%(100 * lookahead["hit_rate"],
+                                                          lookahead["saved_ns_per_frame"] / us_DURATION))
+        # Update the MAC verifications per accepted frame, and the late frames accepted
+        self.attempts_entry.delete(0, END)
+        acceptance = getacceptancestatistics()
+        if (None != acceptance):
+            self.attempts_entry.insert(0, '%.2f (%d late)'%(acceptance["attempts_per_accepted"],
+                                                            acceptance["late"]))
+        # Update the p99 latency of the run so far, from the statistics updated by the nodes
+        self.livelatency_entry.delete(0, END)
+        if (encrypt_samples["ENCRYPTION_SCHEME"].getcount() > 0):
+            self.livelatency_entry.insert(0, '%.1f / %.1f'%(
+                encrypt_samples["ENCRYPTION_SCHEME"].getsnapshot().getquantile(0.99),
+                decrypt_samples["ENCRYPTION_SCHEME"].getsnapshot().getquantile(0.99)))
         
         if(True == simulationstate.value):
             # Schedule this function to be called again after COUNTER_UPDATE_PERIOD milliseconds
@@ -829,7 +1025,9 @@ class CANSimGUI(tb.Window):
             initializeencryptionscheme(self.nonce_creation_option.get(),
                                    self.keystream_gen_option.get(),
                                    self.mac_gen_option.get(),
-                                   int(self.canconf_entry1.get(),16))
+                                   int(self.canconf_entry1.get(),16),
+                                   self.getdecryptionwindow(),
+                                   self.getreplaywindow())
             # switch to the next state
             self.replaysim_state.value = REPLAYSIM_RECORD_FRAMES
 
@@ -1132,13 +1330,40 @@ class CANSimGUI(tb.Window):
         setcanmessage(canid, data, True)
         setmsgperiodicity(periodicity)
 
+    def getdecryptionwindow(self):
+        '''Get the selected verification window size, the default if the selection is not valid'''
+        try:
+            window = int(self.decryption_window_option.get())
+            checkwindowsize(window)
+        except ValueError:
+            print("[Warning] Verification window must be " + str(DECRYPTION_WINDOW_MIN) + ".."
+                  + str(DECRYPTION_WINDOW_MAX) + ", using " + str(DECRYTPION_WINDOW))
+            window = DECRYTPION_WINDOW
+            self.decryption_window_option.set(str(window))
+        return window
+
+    def getreplaywindow(self):
+        '''Get the selected anti-replay window width, disabled if the selection is not valid'''
+        try:
+            width = int(self.replay_window_option.get())
+            if (0 != width):
+                checkreplaywindow(width)
+        except ValueError:
+            print("[Warning] Anti-replay window must be 0 or " + str(ANTI_REPLAY_WINDOW_MIN) + ".."
+                  + str(ANTI_REPLAY_WINDOW_MAX) + ", disabling it")
+            width = 0
+            self.replay_window_option.set(str(width))
+        return width
+
     def do_encschemeupdate(self):
         ''' Updates the encryption scheme based on new configuration '''
         # Check if the encyrption scheme is enabled
         initializeencryptionscheme(self.nonce_creation_option.get(),
                                    self.keystream_gen_option.get(),
                                    self.mac_gen_option.get(),
-                                   int(self.canconf_entry1.get(),16))
+                                   int(self.canconf_entry1.get(),16),
+                                   self.getdecryptionwindow(),
+                                   self.getreplaywindow())
         setencryptionalgo("ENCRYPTION_SCHEME")
         
     def toggleencschemestate(self):
@@ -1149,7 +1374,9 @@ class CANSimGUI(tb.Window):
             initializeencryptionscheme(self.nonce_creation_option.get(),
                                    self.keystream_gen_option.get(),
                                    self.mac_gen_option.get(),
-                                   int(self.canconf_entry1.get(),16))
+                                   int(self.canconf_entry1.get(),16),
+                                   self.getdecryptionwindow(),
+                                   self.getreplaywindow())
         else: # Encryption scheme disabled
             #Deinitialize the objects
             deinitencryptionscheme()
@@ -1160,16 +1387,19 @@ class CANSimGUI(tb.Window):
         global encrypt_samples, decrypt_cpuper
 
         # Reset the encryption and decryption samples
-        encrypt_samples[algorithm] = []
-        decrypt_samples[algorithm] = []
+        encrypt_samples[algorithm].reset()
+        decrypt_samples[algorithm].reset()
         # Reset the cpu percentage samples
-        encrypt_cpuper[algorithm] = []
-        decrypt_cpuper[algorithm] = []
+        encrypt_cpuper[algorithm].reset()
+        decrypt_cpuper[algorithm].reset()
+        # Reset the end-to-end latencies
+        resetbuslatencysamples(algorithm)
 
     def getperfmetrics(self, sampletype):
         '''Called after simulation stopped to get the Performance metrics for each algorithm'''
         global encrypt_samples, decrypt_samples
         global encrypt_cpuper, decrypt_cpuper
+        global clockrecords, timerrecords
 
         perfmetrics = {}
         # Select the array depending on the metrics needed
@@ -1183,30 +1413,43 @@ class CANSimGUI(tb.Window):
         # Reset the mean cpu percentage variable
         mean_cpuper = {}
         # For cpu percentage samples
-        for eachalgo, cpuper in cpuperarray.items():
-            mean_cpuper[eachalgo] = 0
-            #Only if valid samples are available
-            if(len(cpuper) > 0):
-                cpuper = np.array(cpuper)
-                # Calculate the median
-                mean_cpuper[eachalgo] = np.mean(cpuper)
+        for eachalgo, ring in cpuperarray.items():
+            # Mean of all the samples, updated per frame in the nodes
+            mean_cpuper[eachalgo] = ring.getsnapshot().mean
 
         # For encryption and decryption times
-        for eachalgo, samples in samplearray.items():
+        for eachalgo, ring in samplearray.items():
             #Only if valid samples are available
-            if(len(samples) > 0):
-                samples = np.array(samples)
-                mean_ns = statistics.fmean(samples)
-                p95 = np.percentile(samples, 95)
-                p99 = np.percentile(samples, 99)
-                jitter_ns = statistics.pstdev(samples)
-                cyclesperbyte = (mean_ns * CPU_FREQ_MHZ / 1000)/8
+            if(ring.getcount() > 0):
+                # Statistics of all the samples, updated per frame in the nodes
+                summary = ring.getsnapshot().getsummary()
+                mean_ns = summary["mean"]
+                p95 = summary["p95"]
+                p99 = summary["p99"]
+                jitter_ns = summary["jitter"]
+                # Frequency measured during the run of the algorithm, assumed if not measured
+                frequency_mhz = CPU_FREQ_MHZ
+                if (eachalgo in clockrecords):
+                    frequency_mhz = clockrecords[eachalgo][sampletype]["frequency_mhz"]
+                # Samples are in us
+                cyclesperbyte = getcyclesperbyte(mean_ns * us_DURATION, frequency_mhz, 8)
+                # Mean without the cost of the timer and the dispatch, flagged if mostly measurement cost
+                timerrecord = None
+                if ((eachalgo in timerrecords) and (None != timerrecords[eachalgo])):
+                    timerrecord = timerrecords[eachalgo][sampletype]
+                mean_corrected = '%.3f'%(correcttiming(mean_ns * us_DURATION, timerrecord) / us_DURATION)
+                if (True == isneartimerfloor(mean_ns * us_DURATION, timerrecord)):
+                    mean_corrected += " ⚠ timer floor"
 
                 # Add data to the Metrics dictionary
                 perfmetrics[eachalgo] = {
                     "mean_ns" : '%.3f'%(mean_ns),
+                    "mean_corrected" : mean_corrected,
+                    "p50" : '%.3f'%(summary["p50"]),
                     "p95" : '%.3f'%(p95),
                     "p99" : '%.3f'%(p99),
+                    "p99.9" : '%.3f'%(summary["p99.9"]),
+                    "max" : '%.3f'%(summary["max"]),
                     "jitter_ns" : '%.3f'%(jitter_ns),
                     "cycles/byte" : '%.3f'%(cyclesperbyte),
                     "cpu_percent" : '%.3f'%(mean_cpuper[eachalgo])